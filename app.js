@@ -1,8 +1,12 @@
 // Global variables
 let currentUser = null;
 let currentWhiteboard = null;
+let lastSeq = 0;  // Every stroke up to this sequence number is drawn on the canvas
+let persistedRanges = new Map();  // First seq -> last seq of stored live strokes not yet contiguous with lastSeq
+const MAX_PERSISTED_RANGES = 256;
 let authToken = null;
 let websocket = null;
+let viewportTimer = null;
 let canvas = null;
 let ctx = null;
 let isDrawing = false;
@@ -36,6 +40,13 @@ const toastContainer = document.getElementById('toast-container');
 // API base URL
 const API_BASE_URL = 'http://localhost:8000/api';
 
+// WebSocket subprotocols, binary strokes are preferred when the server supports them
+const BINARY_SUBPROTOCOL = 'whiteboard.bin.v1';
+const JSON_SUBPROTOCOL = 'whiteboard.json';
+
+// Close codes after which the client reconnects: going away, service restart, try again later
+const RECONNECT_CLOSE_CODES = [1001, 1012, 1013];
+
 // Initialize the app
 document.addEventListener('DOMContentLoaded', () => {
     // Check if user is already logged in
@@ -173,6 +184,10 @@ function resizeCanvas() {
     canvas.width = rect.width;
     canvas.height = rect.height;
     
+    // Tell the server once resizing settles, so it sends strokes in the new area
+    clearTimeout(viewportTimer);
+    viewportTimer = setTimeout(sendViewport, 200);
+    
     // Redraw canvas content if exists
     if (drawingHistory.length > 0 && historyStep >= 0) {
         redrawCanvas();
@@ -351,10 +366,11 @@ async function createNewWhiteboardSession() {
         }
         
         currentWhiteboard = await response.json();
+        resetLastSeq(currentWhiteboard.stroke_seq || 0);
         whiteboardTitle.textContent = currentWhiteboard.name;
         
         // Clear canvas
-        clearCanvas();
+        resetCanvas();
         
         // Connect to WebSocket for real-time updates
         connectWebSocket();
@@ -425,7 +441,7 @@ async function showMyWhiteboards() {
 
 async function loadWhiteboard(whiteboardId) {
     try {
-        const response = await fetch(`${API_BASE_URL}/sessions/${whiteboardId}`, {
+        const response = await fetch(`${API_BASE_URL}/sessions/${whiteboardId}?include_elements=false`, {
             headers: {
                 'Authorization': `Bearer ${authToken}`
             }
@@ -439,10 +455,9 @@ async function loadWhiteboard(whiteboardId) {
         whiteboardTitle.textContent = currentWhiteboard.name;
         
         // Clear and redraw canvas with saved elements
-        clearCanvas();
-        if (currentWhiteboard.elements && currentWhiteboard.elements.length > 0) {
-            redrawElements(currentWhiteboard.elements);
-        }
+        resetCanvas();
+        resetLastSeq(0);
+        await fetchElementsSince(whiteboardId, lastSeq);
         
         // Close modal
         const modal = bootstrap.Modal.getInstance(document.getElementById('whiteboards-modal'));
@@ -457,6 +472,67 @@ async function loadWhiteboard(whiteboardId) {
     }
 }
 
+async function fetchElementsSince(whiteboardId, since) {
+    // Fetch and draw elements page by page, tracking the last sequence number
+    let hasMore = true;
+    while (hasMore) {
+        const response = await fetch(`${API_BASE_URL}/sessions/${whiteboardId}/elements?since=${since}`, {
+            headers: {
+                'Authorization': `Bearer ${authToken}`
+            }
+        });
+        
+        if (!response.ok) {
+            throw new Error('Failed to load whiteboard elements');
+        }
+        
+        const delta = await response.json();
+        applyElementDelta(delta);
+        since = delta.last_seq;
+        hasMore = delta.has_more;
+    }
+}
+
+function applyElementDelta(delta) {
+    if (delta.elements.length > 0) {
+        redrawElements(delta.elements);
+    }
+    lastSeq = Math.max(lastSeq, delta.last_seq);
+    advanceLastSeq();
+}
+
+function resetLastSeq(seq) {
+    lastSeq = seq;
+    persistedRanges.clear();
+}
+
+function notePersistedStrokes(firstSeq, lastStoredSeq) {
+    // Live strokes we already drew were stored with these seqs
+    if (lastStoredSeq <= lastSeq) {
+        return;
+    }
+    persistedRanges.set(firstSeq, lastStoredSeq);
+    if (persistedRanges.size > MAX_PERSISTED_RANGES) {
+        persistedRanges.delete(persistedRanges.keys().next().value);
+    }
+    advanceLastSeq();
+}
+
+function advanceLastSeq() {
+    // Batches stored by different nodes can arrive out of order; only advance over contiguous ones
+    let advanced = true;
+    while (advanced) {
+        advanced = false;
+        for (const [firstSeq, lastStoredSeq] of persistedRanges) {
+            if (firstSeq <= lastSeq + 1) {
+                lastSeq = Math.max(lastSeq, lastStoredSeq);
+                persistedRanges.delete(firstSeq);
+                advanced = true;
+            }
+        }
+    }
+}
+
 function showNewWhiteboardModal() {
     const modal = new bootstrap.Modal(document.getElementById('new-whiteboard-modal'));
     modal.show();
@@ -486,10 +562,11 @@ async function createNewWhiteboard() {
         }
         
         currentWhiteboard = await response.json();
+        resetLastSeq(currentWhiteboard.stroke_seq || 0);
         whiteboardTitle.textContent = currentWhiteboard.name;
         
         // Clear canvas
-        clearCanvas();
+        resetCanvas();
         
         // Connect to WebSocket for real-time updates
         connectWebSocket();
@@ -558,7 +635,7 @@ async function addCollaborator() {
 }
 
 // WebSocket connection for real-time updates
-function connectWebSocket() {
+function connectWebSocket(route = null) {
     if (!currentWhiteboard || !authToken) {
         return;
     }
@@ -568,29 +645,46 @@ function connectWebSocket() {
         websocket.close();
     }
     
-    // Create WebSocket connection
-    const wsUrl = `ws://localhost:8000/api/webrtc/ws/${authToken}?whiteboard_id=${currentWhiteboard.id}`;
-    websocket = new WebSocket(wsUrl);
+    // Create WebSocket connection, on the node that owns the board if we were redirected
+    const base = (route && route.url) || 'ws://localhost:8000';
+    const wsUrl = `${base}/api/webrtc/ws/${authToken}?whiteboard_id=${currentWhiteboard.id}`;
+    websocket = new WebSocket(wsUrl, [BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL]);
+    websocket.binaryType = 'arraybuffer';
     
     websocket.onopen = () => {
         console.log('WebSocket connected');
         showConnectionStatus('connected');
         
-        // Join the whiteboard session
+        // Join the whiteboard session, asking for anything missed since lastSeq
         websocket.send(JSON.stringify({
             type: 'join_session',
-            whiteboard_id: currentWhiteboard.id
+            whiteboard_id: currentWhiteboard.id,
+            since: lastSeq
         }));
+        sendViewport();
     };
     
     websocket.onmessage = (event) => {
+        if (event.data instanceof ArrayBuffer) {
+            // Binary stroke relayed from another user
+            const stroke = decodeRelayedStroke(event.data);
+            if (stroke) {
+                applyDrawingData(stroke.data);
+            }
+            return;
+        }
         const message = JSON.parse(event.data);
         handleWebSocketMessage(message);
     };
     
-    websocket.onclose = () => {
+    websocket.onclose = (event) => {
         console.log('WebSocket disconnected');
         showConnectionStatus('disconnected');
+        
+        // A worker restarting or draining closes with one of these; come back on another
+        if (event.target === websocket && RECONNECT_CLOSE_CODES.includes(event.code)) {
+            setTimeout(() => connectWebSocket(), 500 + Math.random() * 1500);
+        }
     };
     
     websocket.onerror = (error) => {
@@ -605,6 +699,19 @@ function handleWebSocketMessage(message) {
             // Apply drawing data from other users
             applyDrawingData(message.data);
             break;
+        case 'drawing_batch':
+            // Apply a tick's worth of drawing data in order
+            message.items.forEach(item => applyDrawingData(item.data));
+            break;
+        case 'sync_delta':
+            // Elements persisted while we were away
+            applyElementDelta(message);
+            break;
+        case 'strokes_persisted':
+            if (currentWhiteboard && message.whiteboard_id === currentWhiteboard.id) {
+                notePersistedStrokes(message.first_seq, message.last_seq);
+            }
+            break;
         case 'user_joined':
             // Update collaborators list
             addCollaborator(message.user_id, message.user_info);
@@ -627,6 +734,49 @@ function handleWebSocketMessage(message) {
             // Handle WebRTC signaling
             handleWebRTCSignaling(message);
             break;
+        case 'access_denied':
+        case 'access_revoked':
+            showToast('You no longer have access to this whiteboard', 'danger');
+            break;
+        case 'session_expired':
+            // The server closes the connection right after this message
+            showToast('Your session has ended, please log in again', 'warning');
+            break;
+        case 'redirect':
+        case 'migrate':
+            // The board is hosted by another node; reconnect there and catch up from lastSeq
+            if (currentWhiteboard && message.whiteboard_id === currentWhiteboard.id) {
+                connectWebSocket(message);
+            }
+            break;
+        case 'connection_replaced':
+            showToast('This whiteboard was opened in another window', 'info');
+            break;
+        case 'rate_limited':
+            // Held drawing data still arrives, merged; anything else over the limit was dropped
+            if (message.action !== 'hold') {
+                showToast('You are sending updates too quickly, some were not delivered', 'warning');
+            }
+            break;
+        case 'viewport_resync':
+            // Strokes held back for our viewport were dropped; reload them from the server
+            if (currentWhiteboard && message.whiteboard_id === currentWhiteboard.id) {
+                fetchElementsSince(currentWhiteboard.id, lastSeq);
+            }
+            break;
+        case 'frame_too_large':
+            showToast('That change was too large to send', 'danger');
+            break;
+    }
+}
+
+function sendViewport() {
+    // Strokes outside this area are held back until it covers them
+    if (websocket && websocket.readyState === WebSocket.OPEN) {
+        websocket.send(JSON.stringify({
+            type: 'viewport',
+            bbox: [0, 0, canvas.width, canvas.height]
+        }));
     }
 }
 
@@ -776,10 +926,15 @@ function handleTouch(e) {
     canvas.dispatchEvent(mouseEvent);
 }
 
-function clearCanvas() {
+function resetCanvas() {
+    // Local only: used when switching boards, so nothing is sent or persisted
     ctx.clearRect(0, 0, canvas.width, canvas.height);
     drawingHistory = [];
     historyStep = -1;
+}
+
+function clearCanvas() {
+    resetCanvas();
     
     // Send clear canvas event to other users
     sendDrawingData({
@@ -858,12 +1013,14 @@ function redrawCanvas() {
 function redrawElements(elements) {
     // Redraw elements from saved whiteboard data
     elements.forEach(element => {
+        // Persisted elements use "type", live drawing data uses "tool"
+        const tool = element.tool || element.type;
         ctx.strokeStyle = element.style.color || '#000000';
         ctx.lineWidth = element.style.width || 2;
         ctx.lineCap = 'round';
         ctx.lineJoin = 'round';
         
-        if (element.tool === 'pen') {
+        if (tool === 'pen') {
             ctx.beginPath();
             element.coordinates.forEach((point, index) => {
                 if (index === 0) {
@@ -873,12 +1030,12 @@ function redrawElements(elements) {
                 }
             });
             ctx.stroke();
-        } else if (element.tool === 'line') {
+        } else if (tool === 'line') {
             ctx.beginPath();
             ctx.moveTo(element.coordinates[0].x, element.coordinates[0].y);
             ctx.lineTo(element.coordinates[1].x, element.coordinates[1].y);
             ctx.stroke();
-        } else if (element.tool === 'rectangle') {
+        } else if (tool === 'rectangle') {
             ctx.beginPath();
             ctx.rect(
                 element.coordinates[0].x,
@@ -887,7 +1044,7 @@ function redrawElements(elements) {
                 element.coordinates[1].y - element.coordinates[0].y
             );
             ctx.stroke();
-        } else if (element.tool === 'circle') {
+        } else if (tool === 'circle') {
             const radius = Math.sqrt(
                 Math.pow(element.coordinates[1].x - element.coordinates[0].x, 2) +
                 Math.pow(element.coordinates[1].y - element.coordinates[0].y, 2)
@@ -895,6 +1052,20 @@ function redrawElements(elements) {
             ctx.beginPath();
             ctx.arc(element.coordinates[0].x, element.coordinates[0].y, radius, 0, 2 * Math.PI);
             ctx.stroke();
+        } else if (tool === 'eraser') {
+            ctx.globalCompositeOperation = 'destination-out';
+            ctx.beginPath();
+            element.coordinates.forEach((point, index) => {
+                if (index === 0) {
+                    ctx.moveTo(point.x, point.y);
+                } else {
+                    ctx.lineTo(point.x, point.y);
+                }
+            });
+            ctx.stroke();
+            ctx.globalCompositeOperation = 'source-over';
+        } else if (tool === 'clear') {
+            ctx.clearRect(0, 0, canvas.width, canvas.height);
         }
     });
     
@@ -963,6 +1134,13 @@ function applyDrawingData(data) {
 
 function sendDrawingData(data) {
     if (websocket && websocket.readyState === WebSocket.OPEN) {
+        if (websocket.protocol === BINARY_SUBPROTOCOL) {
+            const frame = encodeStroke(data);
+            if (frame) {
+                websocket.send(frame);
+                return;
+            }
+        }
         websocket.send(JSON.stringify({
             type: 'drawing_data',
             data: data
@@ -970,6 +1148,102 @@ function sendDrawingData(data) {
     }
 }
 
+// Binary stroke encoding (mirrors stroke_codec.py)
+const STROKE_TOOL_CODES = {pen: 1, eraser: 2, line: 3, rectangle: 4, circle: 5, clear: 6};
+const STROKE_TOOL_NAMES = Object.fromEntries(Object.entries(STROKE_TOOL_CODES).map(([name, code]) => [code, name]));
+const STROKE_SCALE = 4;
+const STROKE_HEADER_SIZE = 12;
+const FLAG_WIDE_DELTAS = 0x01;
+const FLAG_HAS_COLOR = 0x02;
+const FLAG_HAS_WIDTH = 0x04;
+
+function encodeStroke(data) {
+    const tool = STROKE_TOOL_CODES[data.tool];
+    const style = data.style || {};
+    if (!tool || Object.keys(style).some(key => key !== 'color' && key !== 'width')) {
+        return null;
+    }
+    
+    const points = data.coordinates || [];
+    const xs = points.map(point => Math.round(point.x * STROKE_SCALE));
+    const ys = points.map(point => Math.round(point.y * STROKE_SCALE));
+    const deltas = [];
+    for (let i = 1; i < points.length; i++) {
+        deltas.push(xs[i] - xs[i - 1], ys[i] - ys[i - 1]);
+    }
+    
+    let flags = 0;
+    if (deltas.some(delta => delta < -32768 || delta > 32767)) flags |= FLAG_WIDE_DELTAS;
+    if (style.color !== undefined) flags |= FLAG_HAS_COLOR;
+    if (style.width !== undefined) flags |= FLAG_HAS_WIDTH;
+    const deltaSize = flags & FLAG_WIDE_DELTAS ? 4 : 2;
+    
+    const size = STROKE_HEADER_SIZE + (points.length ? 8 + deltas.length * deltaSize : 0);
+    const view = new DataView(new ArrayBuffer(size));
+    view.setUint8(0, 1);
+    view.setUint8(1, tool);
+    view.setUint8(2, STROKE_SCALE);
+    view.setUint8(3, flags);
+    view.setUint32(4, style.color !== undefined ? (parseInt(style.color.slice(1), 16) << 8) >>> 0 : 0, true);
+    view.setUint16(8, style.width !== undefined ? Math.round(style.width * 10) : 0, true);
+    view.setUint16(10, points.length, true);
+    if (points.length) {
+        view.setInt32(12, xs[0], true);
+        view.setInt32(16, ys[0], true);
+        deltas.forEach((delta, index) => {
+            const offset = 20 + index * deltaSize;
+            if (deltaSize === 4) {
+                view.setInt32(offset, delta, true);
+            } else {
+                view.setInt16(offset, delta, true);
+            }
+        });
+    }
+    return view.buffer;
+}
+
+function decodeRelayedStroke(buffer) {
+    const view = new DataView(buffer);
+    if (view.getUint8(0) !== 2) {
+        return null;
+    }
+    const senderLength = view.getUint8(1);
+    const userId = new TextDecoder().decode(new Uint8Array(buffer, 2, senderLength));
+    const base = 2 + senderLength;
+    
+    const tool = STROKE_TOOL_NAMES[view.getUint8(base + 1)];
+    const scale = view.getUint8(base + 2);
+    const flags = view.getUint8(base + 3);
+    const style = {};
+    if (flags & FLAG_HAS_COLOR) {
+        style.color = '#' + (view.getUint32(base + 4, true) >>> 8).toString(16).padStart(6, '0');
+    }
+    if (flags & FLAG_HAS_WIDTH) {
+        style.width = view.getUint16(base + 8, true) / 10;
+    }
+    
+    const count = view.getUint16(base + 10, true);
+    const coordinates = [];
+    if (count) {
+        const deltaSize = flags & FLAG_WIDE_DELTAS ? 4 : 2;
+        let x = view.getInt32(base + 12, true);
+        let y = view.getInt32(base + 16, true);
+        coordinates.push({x: x / scale, y: y / scale});
+        for (let i = 1; i < count; i++) {
+            const offset = base + 20 + (i - 1) * 2 * deltaSize;
+            if (deltaSize === 4) {
+                x += view.getInt32(offset, true);
+                y += view.getInt32(offset + 4, true);
+            } else {
+                x += view.getInt16(offset, true);
+                y += view.getInt16(offset + 2, true);
+            }
+            coordinates.push({x: x / scale, y: y / scale});
+        }
+    }
+    return {user_id: userId, data: {tool, coordinates, style}};
+}
+
 // Collaborator management
 function addCollaborator(userId, userInfo = {}) {
     if (!collaborators.has(userId)) {
@@ -7,6 +7,7 @@ from ..services.auth_service import (
     create_access_token, 
     create_user,
     get_current_user,
+    principal_cache,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 from ..database.mongodb import get_db
@@ -54,4 +55,9 @@ async def refresh_token(current_user: User = Depends(get_current_user)):
     access_token = create_access_token(
         data={"sub": current_user.username}, expires_delta=access_token_expires
     )
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    return {"access_token": access_token, "token_type": "bearer"}
+
+@router.get("/cache/stats")
+async def get_principal_cache_stats(current_user: User = Depends(get_current_user)):
+    """Get hit-rate counters for the principal cache"""
+    return principal_cache.stats()
\ No newline at end of file
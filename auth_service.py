@@ -1,13 +1,19 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from ..models.user import UserInDB, UserCreate, TokenData
 from ..database.mongodb import get_db
+from .cache import TTLCache
+from .metrics import REGISTRY, timed_db_operation
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,7 +23,25 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Resolved principals, keyed by token subject
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+principal_cache = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_SECONDS)
+REGISTRY.callback("whiteboard_principal_cache_entries", "Principals cached", lambda: len(principal_cache))
+REGISTRY.callback(
+    "whiteboard_principal_cache_lookups_total", "Principal cache lookups by result",
+    lambda: {("hit",): principal_cache.hits, ("miss",): principal_cache.misses}, kind="counter", labelnames=["result"]
+)
+
+# Password hashing; changing BCRYPT_ROUNDS rehashes passwords on next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+# bcrypt releases the GIL, so threads keep hashing off the event loop
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_password_jobs_pending = 0
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 def verify_password(plain_password, hashed_password):
@@ -28,6 +52,29 @@ def get_password_hash(password):
     """Generate password hash"""
     return pwd_context.hash(password)
 
+async def _run_password_job(func, *args):
+    """Run a bcrypt call on the password pool, refusing work past the queue cap"""
+    global _password_jobs_pending
+    if _password_jobs_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent logins, please retry",
+            headers={"Retry-After": "1"},
+        )
+    _password_jobs_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        _password_jobs_pending -= 1
+
+async def hash_password(password: str) -> str:
+    """Generate password hash without blocking the event loop"""
+    return await _run_password_job(pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password and return a new hash if its cost factor is outdated"""
+    return await _run_password_job(pwd_context.verify_and_update, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -39,9 +86,10 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+@timed_db_operation
 async def get_user_by_username(db, username: str) -> Optional[UserInDB]:
     """Get user by username from database"""
-    user_data = db.users.find_one({"username": username})
+    user_data = await db.users.find_one({"username": username})
     if user_data:
         user_data["id"] = str(user_data.pop("_id"))
         return UserInDB(**user_data)
@@ -52,8 +100,17 @@ async def authenticate_user(db, username: str, password: str) -> Optional[UserIn
     user = await get_user_by_username(db, username)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = await verify_and_update_password(password, user.hashed_password)
+    if not verified:
         return None
+    if new_hash:
+        # BCRYPT_ROUNDS changed since this hash was made
+        await db.users.update_one(
+            {"_id": ObjectId(user.id), "hashed_password": user.hashed_password},
+            {"$set": {"hashed_password": new_hash}}
+        )
+        user.hashed_password = new_hash
+        invalidate_principal(user.username)
     return user
 
 async def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_db)):
@@ -72,11 +129,35 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_d
     except JWTError:
         raise credentials_exception
     
-    user = await get_user_by_username(db, username=token_data.username)
+    user = principal_cache.get(token_data.username)
     if user is None:
-        raise credentials_exception
+        user = await get_user_by_username(db, username=token_data.username)
+        if user is None:
+            raise credentials_exception
+        # Never keep the principal past the expiry of the token it came from
+        expires_in = payload["exp"] - time.time() if "exp" in payload else None
+        principal_cache.set(token_data.username, user, expires_in)
     return user
 
+async def authenticate_token(db, token: str) -> Optional[UserInDB]:
+    """Resolve a bearer token to its user, or None if it is not valid"""
+    try:
+        return await get_current_user(token, db)
+    except HTTPException:
+        return None
+
+def get_token_expiry(token: str) -> Optional[float]:
+    """Expiry of an already verified token as a Unix timestamp"""
+    try:
+        expires_at = jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        return None
+    return float(expires_at) if expires_at is not None else None
+
+def invalidate_principal(username: str):
+    """Drop a cached principal after its user document changes"""
+    principal_cache.invalidate(username)
+
 async def create_user(db, user: UserCreate) -> UserInDB:
     """Create a new user in the database"""
     # Check if user already exists
@@ -88,7 +169,7 @@ async def create_user(db, user: UserCreate) -> UserInDB:
         )
     
     # Check if email already exists
-    existing_email = db.users.find_one({"email": user.email})
+    existing_email = await db.users.find_one({"email": user.email})
     if existing_email:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -96,13 +177,22 @@ async def create_user(db, user: UserCreate) -> UserInDB:
         )
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password(user.password)
     user_dict = user.dict()
     user_dict["hashed_password"] = hashed_password
     user_dict.pop("password")
     user_dict["created_at"] = datetime.utcnow()
     
-    result = db.users.insert_one(user_dict)
+    try:
+        result = await db.users.insert_one(user_dict)
+    except DuplicateKeyError as e:
+        # Lost a registration race; the unique indexes have the final say
+        field = "Email" if "email" in str(e.details or e) else "Username"
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{field} already registered"
+        )
     user_dict["id"] = str(result.inserted_id)
+    invalidate_principal(user.username)
     
     return UserInDB(**user_dict)
\ No newline at end of file
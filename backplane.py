@@ -0,0 +1,507 @@
+import asyncio
+import logging
+import os
+import socket
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Set, Tuple, Union
+from urllib.parse import unquote, urlsplit
+from dotenv import load_dotenv
+from .serialization import dumps, loads
+from .structured_logging import SampledLogger
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+hot_log = SampledLogger(logger)
+
+# Backplane configuration: memory:// for a single process, redis://host:port/db to span workers
+BACKPLANE_URL = os.getenv("BACKPLANE_URL", "memory://")
+NODE_ID = os.getenv("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# A node's presence entries expire this long after its last heartbeat, e.g. when it crashes
+PRESENCE_TTL_SECONDS = float(os.getenv("PRESENCE_TTL_SECONDS", "30"))
+
+MessageCallback = Callable[[str, bytes], None]
+
+# Cluster-wide announcements such as shard map changes
+CONTROL_CHANNEL = "whiteboard:control"
+
+
+def room_channel(whiteboard_id: str) -> str:
+    """Channel carrying broadcasts for one whiteboard"""
+    return f"whiteboard:room:{whiteboard_id}"
+
+
+def user_channel(user_id: str) -> str:
+    """Channel carrying messages addressed to one user"""
+    return f"whiteboard:user:{user_id}"
+
+
+def presence_key(whiteboard_id: str, node_id: str) -> str:
+    """Hash of the users present on a whiteboard through one node"""
+    return f"whiteboard:presence:{whiteboard_id}:{node_id}"
+
+
+def presence_nodes_key(whiteboard_id: str) -> str:
+    """Set of the nodes that may have users present on a whiteboard"""
+    return f"whiteboard:presence-nodes:{whiteboard_id}"
+
+
+def node_boards_key(node_id: str) -> str:
+    """Set of the whiteboards a node has presence entries on"""
+    return f"whiteboard:node-boards:{node_id}"
+
+
+def encode_envelope(header: Dict[str, Any], body: Union[str, bytes]) -> bytes:
+    """Frame a payload with its routing header for the backplane
+
+    The header is compact JSON, which never contains a raw newline, so a
+    single newline separates it from the body without escaping it.
+    """
+    is_bytes = isinstance(body, bytes)
+    header = dict(header, b=1) if is_bytes else header
+    return dumps(header) + b"\n" + (body if is_bytes else body.encode("utf-8"))
+
+
+def decode_envelope(data: bytes) -> Tuple[Dict[str, Any], Union[str, bytes]]:
+    """Split a backplane message into its header and body"""
+    raw_header, _, body = data.partition(b"\n")
+    header = loads(raw_header)
+    return header, body if header.get("b") else body.decode("utf-8")
+
+
+class Backplane(ABC):
+    """Pub/sub and presence shared by every node serving whiteboards
+
+    Delivery is at most once. A node may also receive the messages it
+    publishes itself, as with Redis pub/sub, so callers filter by origin.
+    """
+
+    @abstractmethod
+    async def start(self, on_message: MessageCallback):
+        """Start delivering messages on subscribed channels to on_message"""
+
+    @abstractmethod
+    async def close(self):
+        """Stop delivery and release connections"""
+
+    @abstractmethod
+    async def publish(self, channel: str, data: bytes):
+        """Publish a message without waiting for delivery"""
+
+    @abstractmethod
+    async def subscribe(self, channel: str):
+        """Start receiving a channel"""
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str):
+        """Stop receiving a channel"""
+
+    @abstractmethod
+    async def set_presence(self, whiteboard_id: str, user_id: str, info: Dict[str, Any]):
+        """Record a user as present on a whiteboard"""
+
+    @abstractmethod
+    async def remove_presence(self, whiteboard_id: str, user_id: str):
+        """Remove a user from a whiteboard's presence"""
+
+    @abstractmethod
+    async def get_presence(self, whiteboard_id: str) -> Dict[str, Dict[str, Any]]:
+        """Get the users present on a whiteboard and their info"""
+
+
+class InMemoryHub:
+    """Shared state for in-memory backplanes in one process"""
+
+    def __init__(self):
+        self.subscribers: Dict[str, Set["InMemoryBackplane"]] = {}
+        self.presence: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+
+class InMemoryBackplane(Backplane):
+    """Backplane for a single process, or several managers sharing a hub in tests"""
+
+    def __init__(self, hub: Optional[InMemoryHub] = None):
+        self.hub = hub or InMemoryHub()
+        self._on_message: Optional[MessageCallback] = None
+        self._channels: Set[str] = set()
+
+    async def start(self, on_message: MessageCallback):
+        self._on_message = on_message
+
+    async def close(self):
+        for channel in list(self._channels):
+            await self.unsubscribe(channel)
+        self._on_message = None
+
+    async def publish(self, channel: str, data: bytes):
+        loop = asyncio.get_running_loop()
+        for backplane in list(self.hub.subscribers.get(channel, ())):
+            # The publisher already delivered locally, so skip the echo
+            if backplane is not self:
+                # Deliver on a later loop iteration, as a network hop would
+                loop.call_soon(backplane._deliver, channel, data)
+
+    def _deliver(self, channel: str, data: bytes):
+        if self._on_message is not None and channel in self._channels:
+            self._on_message(channel, data)
+
+    async def subscribe(self, channel: str):
+        self._channels.add(channel)
+        self.hub.subscribers.setdefault(channel, set()).add(self)
+
+    async def unsubscribe(self, channel: str):
+        self._channels.discard(channel)
+        subscribers = self.hub.subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.hub.subscribers[channel]
+
+    async def set_presence(self, whiteboard_id: str, user_id: str, info: Dict[str, Any]):
+        self.hub.presence.setdefault(whiteboard_id, {})[user_id] = info
+
+    async def remove_presence(self, whiteboard_id: str, user_id: str):
+        present = self.hub.presence.get(whiteboard_id)
+        if present is not None:
+            present.pop(user_id, None)
+            if not present:
+                del self.hub.presence[whiteboard_id]
+
+    async def get_presence(self, whiteboard_id: str) -> Dict[str, Dict[str, Any]]:
+        return dict(self.hub.presence.get(whiteboard_id, {}))
+
+
+class RedisError(Exception):
+    """Error reply from a Redis server"""
+
+
+def encode_command(*args: Union[str, bytes, int]) -> bytes:
+    """Encode a command as a RESP array of bulk strings"""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode("utf-8")
+        elif isinstance(arg, int):
+            arg = str(arg).encode("ascii")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    """Read one RESP2 reply; error replies are returned, not raised"""
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Connection to Redis closed")
+    prefix, value = line[:1], line[1:-2]
+    if prefix == b"+":
+        return value.decode("utf-8")
+    if prefix == b"-":
+        return RedisError(value.decode("utf-8"))
+    if prefix == b":":
+        return int(value)
+    if prefix == b"$":
+        length = int(value)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if prefix == b"*":
+        length = int(value)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"Unexpected reply from Redis: {line!r}")
+
+
+class RedisConnection:
+    """Pipelined command connection: replies are matched to commands in order"""
+
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        # None marks a fire-and-forget command whose reply is discarded
+        self._pending: Deque[Optional[asyncio.Future]] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = True
+
+    async def connect(self):
+        """Open the connection and authenticate"""
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self.closed = False
+        self._task = asyncio.create_task(self._read_replies())
+        if self.password:
+            await self.execute("AUTH", self.password)
+        if self.db:
+            await self.execute("SELECT", self.db)
+
+    async def execute(self, *args) -> Any:
+        """Send a command and wait for its reply"""
+        future = asyncio.get_running_loop().create_future()
+        self._write(args, future)
+        reply = await future
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def send(self, *args):
+        """Send a command without waiting for its reply"""
+        self._write(args, None)
+
+    def _write(self, args, future: Optional[asyncio.Future]):
+        if self.closed:
+            raise ConnectionError("Not connected to Redis")
+        self._pending.append(future)
+        self._writer.write(encode_command(*args))
+
+    async def _read_replies(self):
+        try:
+            while True:
+                reply = await read_reply(self._reader)
+                future = self._pending.popleft()
+                if future is not None and not future.done():
+                    future.set_result(reply)
+                elif isinstance(reply, RedisError):
+                    hot_log.warning("redis_command_rejected", "Redis rejected a pipelined command: %s", reply)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Redis connection lost: %s", e)
+        finally:
+            self._fail_pending()
+
+    def _fail_pending(self):
+        self.closed = True
+        while self._pending:
+            future = self._pending.popleft()
+            if future is not None and not future.done():
+                future.set_exception(ConnectionError("Connection to Redis closed"))
+
+    async def close(self):
+        """Close the connection"""
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._writer is not None:
+            self._writer.close()
+
+
+class RedisBackplane(Backplane):
+    """Backplane on Redis pub/sub and hashes, speaking RESP directly
+
+    Uses one pipelined connection for commands and one in subscribe mode,
+    which reconnects and resubscribes on its own. Each node keeps its own
+    presence hash per whiteboard and refreshes their TTL from a heartbeat,
+    so the users of a node that dies without cleaning up expire. A node
+    clears its entries when it starts and when it closes.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        node_id: str = NODE_ID,
+        presence_ttl: float = PRESENCE_TTL_SECONDS,
+    ):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.node_id = node_id
+        self.presence_ttl = presence_ttl
+        self._commands: Optional[RedisConnection] = None
+        self._connect_lock = asyncio.Lock()
+        self._channels: Set[str] = set()
+        self._on_message: Optional[MessageCallback] = None
+        self._subscriber: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._present: Dict[str, Set[str]] = {}  # whiteboard_id -> users present through this node
+
+    @classmethod
+    def from_url(cls, url: str, node_id: str = NODE_ID) -> "RedisBackplane":
+        """Create a backplane from a redis://[:password@]host[:port][/db] URL"""
+        parts = urlsplit(url)
+        db = parts.path.lstrip("/")
+        return cls(
+            host=parts.hostname or "localhost",
+            port=parts.port or 6379,
+            db=int(db) if db else 0,
+            password=unquote(parts.password) if parts.password else None,
+            node_id=node_id,
+        )
+
+    async def start(self, on_message: MessageCallback):
+        self._on_message = on_message
+        await self._connection()
+        # Entries left by an earlier run of this node that didn't shut down cleanly
+        await self._clear_presence()
+        if self._task is None:
+            self._task = asyncio.create_task(self._subscribe_loop())
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def close(self):
+        for task in (self._task, self._heartbeat):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._heartbeat = None
+        if self._commands is not None:
+            try:
+                await self._clear_presence()
+            except Exception as e:
+                logger.warning("Could not clear presence for node %s: %s", self.node_id, e)
+            self._present.clear()
+            await self._commands.close()
+            self._commands = None
+
+    async def _connection(self) -> RedisConnection:
+        """Get the command connection, reconnecting if it dropped"""
+        async with self._connect_lock:
+            if self._commands is None or self._commands.closed:
+                connection = RedisConnection(self.host, self.port, self.db, self.password)
+                await connection.connect()
+                self._commands = connection
+            return self._commands
+
+    async def _subscribe_loop(self):
+        """Read pushed messages, reconnecting and resubscribing after failures"""
+        backoff = 0.1
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+                try:
+                    if self.password:
+                        writer.write(encode_command("AUTH", self.password))
+                        reply = await read_reply(reader)
+                        if isinstance(reply, RedisError):
+                            raise reply
+                    self._subscriber = writer
+                    if self._channels:
+                        writer.write(encode_command("SUBSCRIBE", *self._channels))
+                    backoff = 0.1
+                    while True:
+                        reply = await read_reply(reader)
+                        if isinstance(reply, list) and reply and reply[0] == b"message":
+                            self._dispatch(reply[1].decode("utf-8"), reply[2])
+                finally:
+                    self._subscriber = None
+                    writer.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Redis subscriber disconnected, retrying in %.1fs: %s", backoff, e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+
+    def _dispatch(self, channel: str, data: bytes):
+        if self._on_message is None:
+            return
+        try:
+            self._on_message(channel, data)
+        except Exception as e:
+            hot_log.error("backplane_dispatch_failed", "Error handling backplane message on %s: %s", channel, e)
+
+    async def publish(self, channel: str, data: bytes):
+        (await self._connection()).send("PUBLISH", channel, data)
+
+    async def subscribe(self, channel: str):
+        self._channels.add(channel)
+        if self._subscriber is not None:
+            self._subscriber.write(encode_command("SUBSCRIBE", channel))
+
+    async def unsubscribe(self, channel: str):
+        self._channels.discard(channel)
+        if self._subscriber is not None:
+            self._subscriber.write(encode_command("UNSUBSCRIBE", channel))
+
+    async def set_presence(self, whiteboard_id: str, user_id: str, info: Dict[str, Any]):
+        connection = await self._connection()
+        self._present.setdefault(whiteboard_id, set()).add(user_id)
+        connection.send("HSET", presence_key(whiteboard_id, self.node_id), user_id, dumps(info))
+        self._refresh_presence(connection, whiteboard_id)
+
+    async def remove_presence(self, whiteboard_id: str, user_id: str):
+        connection = await self._connection()
+        connection.send("HDEL", presence_key(whiteboard_id, self.node_id), user_id)
+        present = self._present.get(whiteboard_id)
+        if present is not None:
+            present.discard(user_id)
+            if not present:
+                del self._present[whiteboard_id]
+                connection.send("SREM", presence_nodes_key(whiteboard_id), self.node_id)
+                connection.send("SREM", node_boards_key(self.node_id), whiteboard_id)
+
+    async def get_presence(self, whiteboard_id: str) -> Dict[str, Dict[str, Any]]:
+        connection = await self._connection()
+        nodes = await connection.execute("SMEMBERS", presence_nodes_key(whiteboard_id)) or []
+        nodes = [node.decode("utf-8") for node in nodes]
+        replies = await asyncio.gather(*(
+            connection.execute("HGETALL", presence_key(whiteboard_id, node)) for node in nodes
+        ))
+        present = {}
+        for node, reply in zip(nodes, replies):
+            if not reply:
+                # The node's hash expired or emptied, so it has no users here
+                connection.send("SREM", presence_nodes_key(whiteboard_id), node)
+                continue
+            for index in range(0, len(reply), 2):
+                present[reply[index].decode("utf-8")] = loads(reply[index + 1])
+        return present
+
+    def _refresh_presence(self, connection: RedisConnection, whiteboard_id: str):
+        """Index this node's presence on a whiteboard and push back its expiry"""
+        ttl_ms = int(self.presence_ttl * 1000)
+        # Re-added on every heartbeat in case a reader dropped the node while it had no users
+        connection.send("SADD", presence_nodes_key(whiteboard_id), self.node_id)
+        connection.send("SADD", node_boards_key(self.node_id), whiteboard_id)
+        connection.send("PEXPIRE", presence_key(whiteboard_id, self.node_id), ttl_ms)
+        connection.send("PEXPIRE", presence_nodes_key(whiteboard_id), ttl_ms)
+        connection.send("PEXPIRE", node_boards_key(self.node_id), ttl_ms)
+
+    async def _heartbeat_loop(self):
+        """Keep this node's presence entries alive"""
+        while True:
+            await asyncio.sleep(self.presence_ttl / 3)
+            try:
+                connection = await self._connection()
+                for whiteboard_id in list(self._present):
+                    self._refresh_presence(connection, whiteboard_id)
+            except Exception as e:
+                hot_log.warning("presence_heartbeat_failed", "Presence heartbeat failed: %s", e)
+
+    async def _clear_presence(self):
+        """Remove every presence entry recorded by this node"""
+        connection = await self._connection()
+        boards = await connection.execute("SMEMBERS", node_boards_key(self.node_id)) or []
+        for whiteboard_id in (board.decode("utf-8") for board in boards):
+            connection.send("DEL", presence_key(whiteboard_id, self.node_id))
+            connection.send("SREM", presence_nodes_key(whiteboard_id), self.node_id)
+        await connection.execute("DEL", node_boards_key(self.node_id))
+
+
+# Shared by every in-memory backplane created from BACKPLANE_URL in this process
+_memory_hub = InMemoryHub()
+
+
+def create_backplane(url: str = BACKPLANE_URL) -> Backplane:
+    """Create the backplane configured by a memory:// or redis:// URL"""
+    scheme = urlsplit(url).scheme
+    if scheme == "memory":
+        return InMemoryBackplane(_memory_hub)
+    if scheme == "redis":
+        return RedisBackplane.from_url(url)
+    raise ValueError(f"Unsupported BACKPLANE_URL scheme: {scheme!r}")
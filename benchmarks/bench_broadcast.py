@@ -0,0 +1,103 @@
+"""Micro-benchmark for the drawing_data broadcast encode path.
+
+Compares encoding a stroke once per recipient (the previous behaviour)
+against encoding it once per broadcast, across room sizes.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_broadcast
+"""
+import asyncio
+import json
+import time
+from datetime import datetime
+
+from app.services.serialization import JSON_BACKEND, encode_message
+from app.services.webrtc_service import WebRTCManager
+
+ROOM_SIZES = [2, 10, 50, 200]
+STROKES = 1000
+
+
+class NullWebSocket:
+    """WebSocket stand-in that discards frames"""
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+    async def send_bytes(self, data: bytes):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def make_stroke(i: int) -> dict:
+    """Build a drawing_data message shaped like the frontend's pen events"""
+    return {
+        "type": "drawing_data",
+        "user_id": "drawer",
+        "data": {
+            "tool": "pen",
+            "coordinates": [{"x": 100.5 + i, "y": 200.25 + i}, {"x": 101.5 + i, "y": 201.25 + i}],
+            "style": {"color": "#000000", "width": 2},
+        },
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+
+
+def bench_encode(room_size: int):
+    """CPU seconds per 1k strokes for per-recipient vs. encode-once"""
+    strokes = [make_stroke(i) for i in range(STROKES)]
+    recipients = room_size - 1
+
+    start = time.process_time()
+    for message in strokes:
+        for _ in range(recipients):
+            json.dumps(message)
+    per_recipient = time.process_time() - start
+
+    start = time.process_time()
+    for message in strokes:
+        encode_message(message)
+    once = time.process_time() - start
+
+    return per_recipient, once
+
+
+async def bench_manager(room_size: int) -> float:
+    """CPU seconds per 1k strokes through WebRTCManager.broadcast_to_whiteboard"""
+    manager = WebRTCManager()
+    for i in range(room_size):
+        await manager.connect(NullWebSocket(), f"user-{i}")
+        await manager.join_whiteboard(f"user-{i}", "board")
+    strokes = [make_stroke(i) for i in range(STROKES)]
+
+    start = time.process_time()
+    for message in strokes:
+        await manager.broadcast_to_whiteboard("board", message, exclude_user="user-0")
+        # Let writer tasks drain so queues don't overflow
+        await asyncio.sleep(0)
+    elapsed = time.process_time() - start
+
+    for i in range(room_size):
+        manager.disconnect(f"user-{i}")
+    return elapsed
+
+
+def main():
+    print(f"JSON backend: {JSON_BACKEND}, strokes per run: {STROKES}")
+    print(f"{'room':>6} {'encodes/bcast old':>18} {'encodes/bcast new':>18} "
+          f"{'old ms/1k':>10} {'new ms/1k':>10} {'manager ms/1k':>14}")
+    for room_size in ROOM_SIZES:
+        per_recipient, once = bench_encode(room_size)
+        manager = asyncio.run(bench_manager(room_size))
+        print(f"{room_size:>6} {room_size - 1:>18} {1:>18} "
+              f"{per_recipient * 1000:>10.2f} {once * 1000:>10.2f} {manager * 1000:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Benchmark for packed stroke points against per-point dicts.
+
+Builds a board with a fixed number of points spread over strokes of a
+given length and stores it twice: with coordinates as an array of
+{x, y} documents, and with the points packed into one binary field.
+Each board is round-tripped through BSON and loaded the way the
+elements endpoint does it:
+
+    dicts: DrawingElement per stroke, response_model re-validation,
+           jsonable_encoder and json.dumps
+    packed: CompactElement per stroke, encoded once with dumps
+
+The benchmark reports the BSON size, the memory held by the loaded
+elements, and the CPU time to load and to serialize the response.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_compact_strokes --points 100000 --stroke-points 2 16 256
+"""
+import argparse
+import json
+import math
+import random
+import time
+import tracemalloc
+
+import bson
+from fastapi.encoders import jsonable_encoder
+
+from app.models.whiteboard import DrawingElement, ElementDelta
+from app.services.compact_stroke import CompactElement, element_document
+from app.services.serialization import dumps
+
+
+def make_board(points: int, stroke_points: int, seed: int):
+    """Pen strokes at pixel-fraction positions, like pointer input on a zoomed canvas"""
+    rng = random.Random(seed)
+    elements = []
+    for seq in range(1, points // stroke_points + 1):
+        x, y = rng.uniform(0, 4000), rng.uniform(0, 4000)
+        coordinates = []
+        for i in range(stroke_points):
+            coordinates.append({"x": round(x + 3 * math.cos(i / 8) * i, 1), "y": round(y + 2 * i, 1)})
+        elements.append(DrawingElement(type="pen", coordinates=coordinates, style={"color": "#000000", "width": 2}, seq=seq))
+    return elements
+
+
+def round_trip(documents):
+    """Documents as the driver hands them back"""
+    encoded = [bson.encode(document) for document in documents]
+    return sum(map(len, encoded)), [bson.decode(data) for data in encoded]
+
+
+def held_bytes(build):
+    """Bytes still allocated by the result of build()"""
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def timed(func):
+    started = time.process_time()
+    result = func()
+    return result, time.process_time() - started
+
+
+def load_dicts(documents):
+    return [DrawingElement(**document) for document in documents]
+
+
+def respond_dicts(elements):
+    delta = ElementDelta(whiteboard_id="board", elements=elements, since=0, last_seq=len(elements))
+    # What FastAPI does with a response_model
+    validated = ElementDelta(**delta.dict())
+    return json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+
+def load_packed(documents):
+    return [CompactElement.from_document(document) for document in documents]
+
+
+def respond_packed(elements):
+    delta = ElementDelta.construct(whiteboard_id="board", elements=elements, since=0, last_seq=len(elements), has_more=False)
+    return dumps(delta.dict())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=100000, help="points per board")
+    parser.add_argument("--stroke-points", type=int, nargs="+", default=[2, 16, 256])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.points} points per board")
+    print(f"{'pts/stroke':>10} {'format':>7} {'BSON MB':>8} {'held MB':>8} {'B/point':>8} "
+          f"{'load ms':>8} {'respond ms':>11}")
+    for stroke_points in args.stroke_points:
+        elements = make_board(args.points, stroke_points, args.seed)
+        points = sum(len(element.coordinates) for element in elements)
+        formats = [
+            ("dicts", [dict(element.dict(), whiteboard_id="board") for element in elements], load_dicts, respond_dicts),
+            ("packed", [dict(element_document(element), whiteboard_id="board", seq=element.seq) for element in elements],
+             load_packed, respond_packed),
+        ]
+        bodies = []
+        for name, documents, load, respond in formats:
+            bson_size, documents = round_trip(documents)
+            loaded, load_cpu = timed(lambda: load(documents))
+            _, held = held_bytes(lambda: load(documents))
+            body, respond_cpu = timed(lambda: respond(loaded))
+            bodies.append(json.loads(body))
+            print(f"{stroke_points:>10} {name:>7} {bson_size / 1e6:>8.2f} {held / 1e6:>8.2f} {held / points:>8.1f} "
+                  f"{load_cpu * 1e3:>8.1f} {respond_cpu * 1e3:>11.1f}")
+        assert bodies[0] == bodies[1], "both formats must serve the same JSON"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""WebSocket relay latency during a login storm.
+
+Starts the API with uvicorn in a subprocess against the MongoDB given by
+MONGO_URI, then measures drawing_data relay latency between two
+WebSocket clients: first on an idle server, then while many clients log
+in concurrently. With bcrypt running on the event loop every login
+stalls the relay for the whole hash. With the password pool, relay
+latency should stay close to idle while logins queue behind
+PASSWORD_HASH_WORKERS.
+
+Run from the backend directory, with MongoDB running:
+
+    python -m benchmarks.bench_login_storm --logins 64
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.bench_relay_latency import (
+    create_shared_board,
+    measure_relay,
+    register_and_login,
+    report,
+    wait_for_server,
+)
+
+
+async def login_storm(base_url: str, usernames, concurrency: int, stop: asyncio.Event):
+    """Log the given users in over and over from concurrent clients"""
+    latencies = []
+    rejected = 0
+    async with httpx.AsyncClient(timeout=60) as client:
+        async def worker(index: int):
+            nonlocal rejected
+            while not stop.is_set():
+                started = time.perf_counter()
+                response = await client.post(f"{base_url}/api/auth/login", data={
+                    "username": usernames[index % len(usernames)],
+                    "password": "benchmark-password"
+                })
+                if response.status_code == 503:
+                    rejected += 1
+                    await asyncio.sleep(0.05)
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        await asyncio.gather(*(worker(index) for index in range(concurrency)))
+    return latencies, rejected
+
+
+async def run(args):
+    base_url = f"http://127.0.0.1:{args.port}"
+    ws_url = f"ws://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port), "--log-level", "warning"],
+        env=dict(os.environ)
+    )
+    try:
+        await wait_for_server(base_url)
+        async with httpx.AsyncClient(timeout=60) as client:
+            sender_token = await register_and_login(client, base_url)
+            receiver_token = await register_and_login(client, base_url)
+            board = await create_shared_board(client, base_url, sender_token, receiver_token, "login storm")
+            usernames = [
+                (await client.get(f"{base_url}/api/auth/me", headers={"Authorization": f"Bearer {token}"})).json()["username"]
+                for token in (sender_token, receiver_token)
+            ]
+
+        idle = await measure_relay(ws_url, sender_token, receiver_token, board["id"], args.rate, args.duration)
+        report("idle", idle)
+
+        stop = asyncio.Event()
+        storm = asyncio.create_task(login_storm(base_url, usernames, args.logins, stop))
+        loaded = await measure_relay(ws_url, sender_token, receiver_token, board["id"], args.rate, args.duration)
+        stop.set()
+        logins, rejected = await storm
+        report(f"{args.logins} logins in flight", loaded,
+               f"logins/s={len(logins) / args.duration:.1f} rejected={rejected}")
+        report("login latency", logins)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--logins", type=int, default=32, help="concurrent login clients")
+    parser.add_argument("--rate", type=float, default=60, help="strokes per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per phase")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
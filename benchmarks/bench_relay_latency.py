@@ -0,0 +1,192 @@
+"""WebSocket relay latency while REST reads hit the database.
+
+Starts the API with uvicorn in a subprocess against the MongoDB given by
+MONGO_URI, seeds a board, and measures drawing_data relay latency
+between two WebSocket clients: first on an idle server, then while
+concurrent readers fetch the full board over REST. With blocking
+database calls on the event loop, relay p99 tracks query time. With the
+async driver, it should stay close to the idle numbers.
+
+Run from the backend directory, with MongoDB running:
+
+    python -m benchmarks.bench_relay_latency --readers 32 --seed-elements 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+import websockets
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def wait_for_server(base_url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{base_url}/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+async def register_and_login(client: httpx.AsyncClient, base_url: str) -> str:
+    username = f"bench-{uuid.uuid4().hex[:10]}"
+    await client.post(f"{base_url}/api/auth/register", json={
+        "username": username,
+        "email": f"{username}@example.com",
+        "password": "benchmark-password"
+    })
+    response = await client.post(f"{base_url}/api/auth/login", data={
+        "username": username,
+        "password": "benchmark-password"
+    })
+    return response.json()["access_token"]
+
+
+async def create_shared_board(client: httpx.AsyncClient, base_url: str, owner_token: str,
+                              collaborator_token: str, name: str) -> dict:
+    """Create a board and share it so both clients may join it"""
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    board = (await client.post(f"{base_url}/api/sessions/", json={"name": name}, headers=headers)).json()
+    collaborator = (await client.get(
+        f"{base_url}/api/auth/me", headers={"Authorization": f"Bearer {collaborator_token}"}
+    )).json()
+    await client.post(f"{base_url}/api/sessions/{board['id']}/collaborators",
+                      params={"collaborator_username": collaborator["username"]}, headers=headers)
+    return board
+
+
+async def seed_board(client: httpx.AsyncClient, base_url: str, token: str, collaborator_token: str,
+                     elements: int) -> str:
+    headers = {"Authorization": f"Bearer {token}"}
+    board = await create_shared_board(client, base_url, token, collaborator_token, "latency bench")
+    element = {
+        "type": "pen",
+        "coordinates": [{"x": float(i), "y": float(i % 50)} for i in range(32)],
+        "style": {"color": "#000000", "width": 2}
+    }
+    semaphore = asyncio.Semaphore(32)
+
+    async def add():
+        async with semaphore:
+            await client.post(f"{base_url}/api/sessions/{board['id']}/elements", json=element, headers=headers)
+
+    await asyncio.gather(*(add() for _ in range(elements)))
+    return board["id"]
+
+
+async def measure_relay(ws_url: str, sender_token: str, receiver_token: str, board_id: str,
+                        rate: float, duration: float):
+    """Send timestamped strokes from one client and time their arrival at another"""
+    latencies = []
+    async with websockets.connect(f"{ws_url}/api/webrtc/ws/{receiver_token}?whiteboard_id={board_id}") as receiver, \
+            websockets.connect(f"{ws_url}/api/webrtc/ws/{sender_token}?whiteboard_id={board_id}") as sender:
+        await asyncio.sleep(0.5)
+
+        async def receive():
+            async for raw in receiver:
+                if isinstance(raw, bytes):
+                    continue
+                message = json.loads(raw)
+                items = message.get("items") if message.get("type") == "drawing_batch" else [message]
+                for item in items or []:
+                    sent_at = (item.get("data") or {}).get("sent_at")
+                    if sent_at is not None:
+                        latencies.append((time.perf_counter() - sent_at) * 1000)
+
+        receive_task = asyncio.create_task(receive())
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            await sender.send(json.dumps({
+                "type": "drawing_data",
+                "data": {
+                    "tool": "pen",
+                    "coordinates": [{"x": 1, "y": 1}, {"x": 2, "y": 2}],
+                    "style": {"color": "#000000", "width": 2},
+                    "sent_at": time.perf_counter()
+                }
+            }))
+            await asyncio.sleep(1 / rate)
+        await asyncio.sleep(0.5)
+        receive_task.cancel()
+    return latencies
+
+
+async def rest_readers(base_url: str, token: str, board_id: str, readers: int, stop: asyncio.Event):
+    """Repeatedly load the full board from several concurrent clients"""
+    headers = {"Authorization": f"Bearer {token}"}
+    completed = 0
+    async with httpx.AsyncClient(timeout=60) as client:
+        async def reader():
+            nonlocal completed
+            while not stop.is_set():
+                await client.get(f"{base_url}/api/sessions/{board_id}", headers=headers)
+                completed += 1
+
+        await asyncio.gather(*(reader() for _ in range(readers)))
+    return completed
+
+
+def report(label: str, latencies, extra: str = ""):
+    print(f"{label:<22} n={len(latencies):<5} p50={percentile(latencies, 50):7.2f}ms "
+          f"p99={percentile(latencies, 99):7.2f}ms max={max(latencies, default=float('nan')):7.2f}ms "
+          f"mean={statistics.fmean(latencies) if latencies else float('nan'):7.2f}ms {extra}")
+
+
+async def run(args):
+    base_url = f"http://127.0.0.1:{args.port}"
+    ws_url = f"ws://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port), "--log-level", "warning"],
+        env=dict(os.environ)
+    )
+    try:
+        await wait_for_server(base_url)
+        async with httpx.AsyncClient(timeout=60) as client:
+            sender_token = await register_and_login(client, base_url)
+            receiver_token = await register_and_login(client, base_url)
+            board_id = await seed_board(client, base_url, sender_token, receiver_token, args.seed_elements)
+
+        idle = await measure_relay(ws_url, sender_token, receiver_token, board_id, args.rate, args.duration)
+        report("idle", idle)
+
+        stop = asyncio.Event()
+        readers = asyncio.create_task(rest_readers(base_url, sender_token, board_id, args.readers, stop))
+        loaded = await measure_relay(ws_url, sender_token, receiver_token, board_id, args.rate, args.duration)
+        stop.set()
+        reads = await readers
+        report(f"{args.readers} REST readers", loaded, f"reads/s={reads / args.duration:.1f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--seed-elements", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=60, help="strokes per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per phase")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
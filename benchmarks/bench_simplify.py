@@ -0,0 +1,91 @@
+"""Benchmark for stroke simplification and quantization on ingest.
+
+Generates pen strokes that look like pointer input: a smooth curve
+sampled once per event, with sub-pixel jitter and runs of nearly
+collinear points. The strokes go through simplify_strokes in batches,
+like a tick's merged segments or a bulk save, with the pure-Python and,
+when it is installed, the NumPy backend. The benchmark reports the share
+of points removed, the JSON bytes saved and the CPU time per 10k strokes.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_simplify --tolerance 0.25 0.5 1 --quantize 0.1
+"""
+import argparse
+import math
+import random
+import time
+
+from app.services.serialization import encode_message
+from app.services.simplify import numpy, simplify_strokes
+
+
+def make_strokes(count: int, min_points: int, max_points: int, seed: int):
+    """Pen strokes with a point per pointer event"""
+    rng = random.Random(seed)
+    strokes = []
+    for _ in range(count):
+        points = rng.randint(min_points, max_points)
+        x, y = rng.uniform(0, 2000), rng.uniform(0, 2000)
+        heading = rng.uniform(0, 2 * math.pi)
+        turn = rng.uniform(-0.05, 0.05)
+        coordinates = []
+        for _ in range(points):
+            heading += turn + rng.gauss(0, 0.02)
+            step = rng.uniform(0.5, 3)
+            x += step * math.cos(heading)
+            y += step * math.sin(heading)
+            coordinates.append({"x": x + rng.gauss(0, 0.15), "y": y + rng.gauss(0, 0.15)})
+        strokes.append(coordinates)
+    return strokes
+
+
+def run(strokes, batch: int, tolerance: float, step: float, use_numpy: bool):
+    points_in = sum(len(stroke) for stroke in strokes)
+    started = time.process_time()
+    simplified = []
+    for start in range(0, len(strokes), batch):
+        simplified.extend(simplify_strokes(strokes[start:start + batch], tolerance, step, use_numpy))
+    cpu = time.process_time() - started
+    points_out = sum(len(stroke) for stroke in simplified)
+    return points_in, points_out, cpu, simplified
+
+
+def json_size(strokes) -> int:
+    return sum(
+        len(encode_message({"type": "drawing_data", "data": {"tool": "pen", "coordinates": stroke}}))
+        for stroke in strokes
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--strokes", type=int, default=10000)
+    parser.add_argument("--min-points", type=int, default=8)
+    parser.add_argument("--max-points", type=int, default=400)
+    parser.add_argument("--batch", type=int, default=32, help="strokes simplified per call")
+    parser.add_argument("--tolerance", type=float, nargs="+", default=[0.25, 0.5, 1.0, 2.0])
+    parser.add_argument("--quantize", type=float, default=0.1, help="quantization step in pixels, 0 to disable")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    strokes = make_strokes(args.strokes, args.min_points, args.max_points, args.seed)
+    bytes_in = json_size(strokes)
+    per_10k = 10000 / len(strokes)
+    backends = [False, True] if numpy is not None else [False]
+    if numpy is None:
+        print("NumPy is not installed, only the pure-Python backend is measured")
+
+    print(f"{args.strokes} strokes, {sum(map(len, strokes))} points, {bytes_in / 1e6:.1f}MB of JSON, "
+          f"quantize step {args.quantize}, batches of {args.batch}")
+    print(f"{'backend':>8} {'tol px':>7} {'points kept':>12} {'removed':>8} {'JSON saved':>11} {'CPU s/10k':>10}")
+    for tolerance in args.tolerance:
+        for use_numpy in backends:
+            points_in, points_out, cpu, simplified = run(strokes, args.batch, tolerance, args.quantize, use_numpy)
+            bytes_saved = 1 - json_size(simplified) / bytes_in
+            print(f"{'numpy' if use_numpy else 'python':>8} {tolerance:>7.2f} {points_out:>12} "
+                  f"{1 - points_out / points_in:>8.1%} {bytes_saved:>11.1%} {cpu * per_10k:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
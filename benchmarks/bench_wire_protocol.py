@@ -0,0 +1,71 @@
+"""Benchmark for the JSON and binary stroke wire encodings.
+
+Reports bytes per stroke and the server CPU spent relaying one message
+under each subprotocol: JSON is decoded and re-encoded once, binary is
+validated and prefixed with the sender id.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_wire_protocol
+"""
+import math
+import time
+from datetime import datetime
+
+from app.services.serialization import encode_message, loads
+from app.services.stroke_codec import encode_stroke, relay_frame, validate_stroke_frame
+
+POINTS_PER_STROKE = [2, 16, 64, 256]
+MESSAGES = 5000
+
+
+def make_stroke(points: int) -> dict:
+    """A pen stroke following a smooth curve, like real pointer input"""
+    return {
+        "tool": "pen",
+        "coordinates": [
+            {"x": 400 + 150 * math.cos(i / 20) + i * 0.37, "y": 300 + 150 * math.sin(i / 20) + i * 0.21}
+            for i in range(points)
+        ],
+        "style": {"color": "#1a2b3c", "width": 2},
+    }
+
+
+def relay_json(raw: str) -> str:
+    """What the server does with an incoming JSON drawing_data frame"""
+    message = loads(raw)
+    return encode_message({
+        "type": "drawing_data",
+        "user_id": "drawer",
+        "data": message["data"],
+        "timestamp": datetime.utcnow().isoformat(),
+    })
+
+
+def relay_binary(frame: bytes) -> bytes:
+    """What the server does with an incoming binary stroke frame"""
+    validate_stroke_frame(frame)
+    return relay_frame("drawer", frame)
+
+
+def cpu_per_message(func, payload) -> float:
+    """Microseconds of CPU per call"""
+    start = time.process_time()
+    for _ in range(MESSAGES):
+        func(payload)
+    return (time.process_time() - start) / MESSAGES * 1e6
+
+
+def main():
+    print(f"{'points':>7} {'json B':>8} {'bin B':>7} {'ratio':>6} {'json us/msg':>12} {'bin us/msg':>11}")
+    for points in POINTS_PER_STROKE:
+        stroke = make_stroke(points)
+        raw_json = encode_message({"type": "drawing_data", "data": stroke})
+        frame = encode_stroke(stroke)
+        json_bytes = len(raw_json.encode("utf-8"))
+        print(f"{points:>7} {json_bytes:>8} {len(frame):>7} {json_bytes / len(frame):>6.1f} "
+              f"{cpu_per_message(relay_json, raw_json):>12.2f} {cpu_per_message(relay_binary, frame):>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Relayed strokes per second against worker count.
+
+For each worker count, this starts the API with `python -m app.serve`
+against the MongoDB given by MONGO_URI. It seeds one board per room,
+each with a sender and several receivers. Every client connects on the
+shared port and follows the room redirect to the worker that owns its
+board. Senders then stream drawing_data as fast as the server takes it,
+and the benchmark counts how many strokes the receivers get per second.
+Each room's fan-out stays inside one worker, so throughput should scale
+with workers until rooms or cores run out.
+
+Run from the backend directory, with MongoDB running:
+
+    python -m benchmarks.bench_workers --workers 1 2 4 --rooms 16 --receivers 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+import websockets
+
+from benchmarks.bench_relay_latency import register_and_login, wait_for_server
+
+
+async def seed_room(client: httpx.AsyncClient, base_url: str, receivers: int):
+    """Create a board owned by its sender and shared with every receiver"""
+    sender = await register_and_login(client, base_url)
+    tokens = [await register_and_login(client, base_url) for _ in range(receivers)]
+    headers = {"Authorization": f"Bearer {sender}"}
+    board = (await client.post(f"{base_url}/api/sessions/", json={"name": "workers bench"}, headers=headers)).json()
+    for token in tokens:
+        me = (await client.get(f"{base_url}/api/auth/me", headers={"Authorization": f"Bearer {token}"})).json()
+        await client.post(f"{base_url}/api/sessions/{board['id']}/collaborators",
+                          params={"collaborator_username": me["username"]}, headers=headers)
+    return board["id"], sender, tokens
+
+
+async def open_room(ws_url: str, token: str, board_id: str):
+    """Connect to a board, following redirects to the worker that owns it"""
+    for _ in range(3):
+        websocket = await websockets.connect(f"{ws_url}/api/webrtc/ws/{token}?whiteboard_id={board_id}")
+        message = json.loads(await websocket.recv())
+        if message["type"] != "redirect":
+            return websocket
+        await websocket.close()
+        ws_url = message["url"]
+    raise RuntimeError(f"Too many redirects for board {board_id}")
+
+
+async def measure(ws_url: str, rooms, duration: float):
+    """Stream strokes from every sender and count deliveries at the receivers"""
+    received = 0
+    sent = 0
+    connections = []
+    for board_id, sender, tokens in rooms:
+        receivers = [await open_room(ws_url, token, board_id) for token in tokens]
+        connections.append((await open_room(ws_url, sender, board_id), receivers))
+    stop = asyncio.Event()
+
+    async def receive(websocket):
+        nonlocal received
+        async for raw in websocket:
+            message = json.loads(raw)
+            if message.get("type") == "drawing_batch":
+                received += len(message["items"])
+            elif message.get("type") == "drawing_data":
+                received += 1
+
+    async def send(websocket):
+        nonlocal sent
+        frame = json.dumps({
+            "type": "drawing_data",
+            "data": {"tool": "pen", "coordinates": [{"x": 1, "y": 1}, {"x": 2, "y": 2}],
+                     "style": {"color": "#000000", "width": 2}}
+        })
+        while not stop.is_set():
+            await websocket.send(frame)
+            sent += 1
+            # Yield so receivers on this client process keep up
+            await asyncio.sleep(0)
+
+    receive_tasks = [asyncio.create_task(receive(ws)) for _, receivers in connections for ws in receivers]
+    send_tasks = [asyncio.create_task(send(sender)) for sender, _ in connections]
+    await asyncio.sleep(1)
+    start_received = received
+    started = time.perf_counter()
+    await asyncio.sleep(duration)
+    elapsed = time.perf_counter() - started
+    relayed = received - start_received
+    stop.set()
+    await asyncio.gather(*send_tasks)
+    for task in receive_tasks:
+        task.cancel()
+    for sender, receivers in connections:
+        for websocket in [sender, *receivers]:
+            await websocket.close()
+    return relayed / elapsed, sent
+
+
+async def run_for_workers(args, workers: int):
+    base_url = f"http://127.0.0.1:{args.port}"
+    ws_url = f"ws://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--workers", str(workers), "--port", str(args.port),
+         "--host", "127.0.0.1", "--public-host", "127.0.0.1", "--log-level", "warning"],
+        # Cheap hashes so seeding users doesn't dominate the run, and senders
+        # flood on purpose, so lift the per-connection drawing limit
+        env={**os.environ, "BCRYPT_ROUNDS": os.getenv("BCRYPT_ROUNDS", "4"),
+             "WS_RATE_LIMITS": os.getenv("WS_RATE_LIMITS", "drawing=1000000:1000000")}
+    )
+    try:
+        await wait_for_server(base_url)
+        async with httpx.AsyncClient(timeout=60) as client:
+            rooms = [await seed_room(client, base_url, args.receivers) for _ in range(args.rooms)]
+        rate, sent = await measure(ws_url, rooms, args.duration)
+        print(f"workers={workers:<3} rooms={args.rooms:<4} receivers/room={args.receivers:<4} "
+              f"relayed={rate:10.0f} strokes/s sent={sent}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def run(args):
+    for workers in args.workers:
+        await run_for_workers(args, workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--rooms", type=int, default=16)
+    parser.add_argument("--receivers", type=int, default=8, help="receivers per room")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per worker count")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
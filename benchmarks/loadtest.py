@@ -0,0 +1,435 @@
+"""Load test: N rooms x M drawers against the WebSocket endpoint.
+
+Runs the app in this process, on its own thread and event loop, against
+an in-memory mock MongoDB (mongomock-motor) or the one given with
+--mongo-uri. Synthetic users register and log in over REST, share one
+board per room and connect to /api/webrtc/ws/{token}. Every drawer then
+replays pen strokes: short two-point segments along a wandering path at
+--rate segments per second, with a pause between strokes, like the
+browser client sends while drawing.
+
+Each segment carries a per-sender sequence number in its colour, so
+receivers can time delivery end to end in both the JSON and binary
+protocols. The report covers latency percentiles, strokes and frames
+per second, server event loop CPU, process CPU and memory. --max-p99-ms
+and --min-delivery make the run exit non-zero, so it can gate
+regressions in WebRTCManager and the whiteboard service.
+
+Run from the backend directory:
+
+    pip install mongomock-motor
+    python -m benchmarks.loadtest --rooms 20 --drawers 5 --rate 30 --duration 20
+
+Clients and server share one process and the GIL, so absolute numbers
+are lower than a deployed server's. The mock database also runs on the
+server's event loop and slows down as strokes pile up, so with live
+stroke persistence on, latency reflects it more than a real MongoDB;
+--no-persist measures relaying alone. Compare runs on the same machine.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import websockets
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def rss_mb() -> float:
+    """Resident memory of this process, or peak memory where /proc is missing"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, AttributeError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+@dataclass
+class Scenario:
+    rooms: int = 10
+    drawers: int = 4
+    rate: float = 30.0
+    stroke_segments: int = 40
+    pause_ms: float = 300.0
+    duration: float = 10.0
+    warmup: float = 2.0
+    binary: bool = False
+    port: int = 0
+    mongo_uri: Optional[str] = None
+
+
+@dataclass
+class LoadResult:
+    scenario: Scenario
+    strokes_sent: int = 0
+    strokes_delivered: int = 0
+    frames_received: int = 0
+    expected_deliveries: int = 0
+    latencies_ms: List[float] = field(default_factory=list, repr=False)
+    server_loop_cpu_seconds: float = 0.0
+    process_cpu_seconds: float = 0.0
+    rss_mb_before: float = 0.0
+    rss_mb_after: float = 0.0
+    server_queue_drops: int = 0
+
+    @property
+    def delivery_ratio(self) -> float:
+        return self.strokes_delivered / self.expected_deliveries if self.expected_deliveries else 0.0
+
+    def summary(self) -> Dict:
+        seconds = self.scenario.duration
+        return {
+            "scenario": asdict(self.scenario),
+            "strokes_sent_per_second": self.strokes_sent / seconds,
+            "strokes_delivered_per_second": self.strokes_delivered / seconds,
+            "frames_received_per_second": self.frames_received / seconds,
+            "delivery_ratio": round(self.delivery_ratio, 4),
+            "latency_ms": {
+                "p50": percentile(self.latencies_ms, 50),
+                "p90": percentile(self.latencies_ms, 90),
+                "p99": percentile(self.latencies_ms, 99),
+                "max": max(self.latencies_ms, default=float("nan")),
+            },
+            "server_loop_cpu_percent": 100 * self.server_loop_cpu_seconds / seconds,
+            "process_cpu_percent": 100 * self.process_cpu_seconds / seconds,
+            "rss_mb": {"before": round(self.rss_mb_before, 1), "after": round(self.rss_mb_after, 1)},
+            "server_queue_drops": self.server_queue_drops,
+        }
+
+
+class InProcessServer:
+    """Serve the app with uvicorn on a separate thread and event loop"""
+
+    def __init__(self, port: int, mongo_uri: Optional[str] = None):
+        self.port = port
+        self.mongo_uri = mongo_uri
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.server = None
+        self._thread = threading.Thread(target=self._run, name="loadtest-server", daemon=True)
+
+    def _use_mock_db(self):
+        """Point the app at an in-memory MongoDB instead of connecting"""
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("The mock database needs mongomock-motor: pip install mongomock-motor, "
+                             "or pass --mongo-uri")
+        from app import main
+        from app.database import mongodb
+        from app.services.stroke_writer import stroke_buffer
+
+        async def connect_mock():
+            mongodb.client = AsyncMongoMockClient()
+            mongodb.db = mongodb.client[mongodb.DB_NAME]
+            await mongodb.create_indexes()
+
+        main.connect_to_mongo = connect_mock
+        # mongomock's with_options returns a synchronous collection
+        stroke_buffer.write_concern = None
+
+    def _run(self):
+        import uvicorn
+        from app.main import app
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.loop.run_until_complete(self.server.serve())
+
+    def start(self, timeout: float = 30):
+        if self.mongo_uri:
+            os.environ["MONGO_URI"] = self.mongo_uri
+        else:
+            self._use_mock_db()
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not (self.server and self.server.started):
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("Server did not start")
+            time.sleep(0.05)
+        # Port 0 picks a free port
+        self.port = self.server.servers[0].sockets[0].getsockname()[1]
+
+    async def call(self, func):
+        """Run a function on the server's loop thread and return its result"""
+        async def run():
+            return func()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(run(), self.loop))
+
+    def stop(self):
+        if self.server:
+            self.server.should_exit = True
+        self._thread.join(timeout=30)
+
+
+async def seed_room(client: httpx.AsyncClient, base_url: str, drawers: int) -> Tuple[str, List[Tuple[str, str]]]:
+    """Register a room's drawers and share one board between them"""
+    users = []
+    for _ in range(drawers):
+        username = f"load-{uuid.uuid4().hex[:12]}"
+        await client.post(f"{base_url}/api/auth/register", json={
+            "username": username, "email": f"{username}@example.com", "password": "loadtest-password"
+        })
+        token = (await client.post(f"{base_url}/api/auth/login", data={
+            "username": username, "password": "loadtest-password"
+        })).json()["access_token"]
+        me = (await client.get(f"{base_url}/api/auth/me", headers={"Authorization": f"Bearer {token}"})).json()
+        users.append((token, me["id"], username))
+    headers = {"Authorization": f"Bearer {users[0][0]}"}
+    board = (await client.post(f"{base_url}/api/sessions/", json={"name": "load test"}, headers=headers)).json()
+    for _, _, username in users[1:]:
+        await client.post(f"{base_url}/api/sessions/{board['id']}/collaborators",
+                          params={"collaborator_username": username}, headers=headers)
+    return board["id"], [(token, user_id) for token, user_id, _ in users]
+
+
+def pen_path(rng: random.Random):
+    """Endless wandering pen positions, like a hand drawing on a canvas"""
+    x, y = rng.uniform(100, 1100), rng.uniform(100, 700)
+    heading = rng.uniform(0, 2 * math.pi)
+    while True:
+        heading += rng.gauss(0, 0.3)
+        step = rng.uniform(2, 8)
+        x = min(max(x + step * math.cos(heading), 0), 1200)
+        y = min(max(y + step * math.sin(heading), 0), 800)
+        yield x, y
+
+
+class LoadTest:
+    """Drive one scenario and collect its measurements"""
+
+    def __init__(self, scenario: Scenario, server: InProcessServer):
+        from app.services.stroke_codec import BINARY_SUBPROTOCOL, RELAY_PREFIX, decode_stroke, encode_stroke
+
+        self.scenario = scenario
+        self.server = server
+        self.result = LoadResult(scenario)
+        self.recording = False
+        self.stopping = asyncio.Event()
+        self.sent_at: Dict[str, List[float]] = {}  # user_id -> send time per sequence number
+        self._binary_subprotocol = BINARY_SUBPROTOCOL
+        self._relay_prefix = RELAY_PREFIX
+        self._decode_stroke = decode_stroke
+        self._encode_stroke = encode_stroke
+
+    async def connect(self, ws_url: str, token: str, board_id: str):
+        subprotocols = [self._binary_subprotocol] if self.scenario.binary else None
+        websocket = await websockets.connect(
+            f"{ws_url}/api/webrtc/ws/{token}?whiteboard_id={board_id}", subprotocols=subprotocols, max_queue=None
+        )
+        message = json.loads(await websocket.recv())
+        if message.get("type") != "current_users":
+            raise RuntimeError(f"Could not join board {board_id}: {message}")
+        return websocket
+
+    def _strokes(self, raw) -> List[Tuple[str, Dict]]:
+        """Sender and drawing data of every stroke in a received frame"""
+        if isinstance(raw, bytes):
+            _, length = self._relay_prefix.unpack_from(raw)
+            start = self._relay_prefix.size
+            return [(raw[start:start + length].decode("utf-8"), self._decode_stroke(raw[start + length:]))]
+        message = json.loads(raw)
+        if message.get("type") == "drawing_data":
+            return [(message["user_id"], message["data"])]
+        if message.get("type") == "drawing_batch":
+            return [(item["user_id"], item["data"]) for item in message["items"]]
+        return []
+
+    async def receive(self, websocket):
+        try:
+            async for raw in websocket:
+                received_at = time.perf_counter()
+                strokes = self._strokes(raw)
+                if not self.recording or not strokes:
+                    continue
+                self.result.frames_received += 1
+                for user_id, data in strokes:
+                    seq = int(data["style"]["color"][1:], 16)
+                    sent = self.sent_at.get(user_id)
+                    if sent is not None and seq < len(sent):
+                        self.result.strokes_delivered += 1
+                        self.result.latencies_ms.append((received_at - sent[seq]) * 1000)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def draw(self, websocket, user_id: str, peers: int, rng: random.Random):
+        """Send pen segments at the scenario's rate until told to stop"""
+        scenario = self.scenario
+        sent = self.sent_at.setdefault(user_id, [])
+        path = pen_path(rng)
+        previous = next(path)
+        interval = 1 / scenario.rate
+        next_send = time.perf_counter() + rng.uniform(0, interval)
+        segment = 0
+        while not self.stopping.is_set():
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            point = next(path)
+            data = {
+                "tool": "pen",
+                "coordinates": [{"x": previous[0], "y": previous[1]}, {"x": point[0], "y": point[1]}],
+                "style": {"color": f"#{len(sent) & 0xFFFFFF:06x}", "width": 2},
+            }
+            sent.append(time.perf_counter())
+            if scenario.binary:
+                await websocket.send(self._encode_stroke(data))
+            else:
+                await websocket.send(json.dumps({"type": "drawing_data", "data": data}))
+            if self.recording:
+                self.result.strokes_sent += 1
+                self.result.expected_deliveries += peers
+            previous = point
+            segment += 1
+            next_send += interval
+            if segment % scenario.stroke_segments == 0:
+                # Pen up between strokes
+                next_send += scenario.pause_ms / 1000
+                previous = next(path)
+
+    async def run(self) -> LoadResult:
+        scenario = self.scenario
+        base_url = f"http://127.0.0.1:{self.server.port}"
+        ws_url = f"ws://127.0.0.1:{self.server.port}"
+        async with httpx.AsyncClient(timeout=60) as client:
+            semaphore = asyncio.Semaphore(8)
+
+            async def seed():
+                async with semaphore:
+                    return await seed_room(client, base_url, scenario.drawers)
+
+            rooms = await asyncio.gather(*(seed() for _ in range(scenario.rooms)))
+
+        self.result.rss_mb_before = rss_mb()
+        connections = []
+        for board_id, users in rooms:
+            for token, user_id in users:
+                connections.append((await self.connect(ws_url, token, board_id), user_id))
+
+        rng = random.Random(1)
+        tasks = [asyncio.create_task(self.receive(websocket)) for websocket, _ in connections]
+        tasks += [
+            asyncio.create_task(self.draw(websocket, user_id, scenario.drawers - 1, random.Random(rng.random())))
+            for websocket, user_id in connections
+        ]
+        await asyncio.sleep(scenario.warmup)
+
+        self.recording = True
+        loop_cpu = await self.server.call(time.thread_time)
+        process_cpu = time.process_time()
+        await asyncio.sleep(scenario.duration)
+        self.result.server_loop_cpu_seconds = await self.server.call(time.thread_time) - loop_cpu
+        self.result.process_cpu_seconds = time.process_time() - process_cpu
+        self.recording = False
+        self.result.rss_mb_after = rss_mb()
+
+        from app.services.webrtc_service import webrtc_manager
+        self.result.server_queue_drops = (await self.server.call(webrtc_manager.get_queue_stats))["total_dropped"]
+
+        self.stopping.set()
+        await asyncio.sleep(0.2)
+        for websocket, _ in connections:
+            await websocket.close()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return self.result
+
+
+def run_scenario(scenario: Scenario) -> LoadResult:
+    """Start an in-process server, run the scenario against it and stop it"""
+    server = InProcessServer(scenario.port, scenario.mongo_uri)
+    server.start()
+    try:
+        return asyncio.run(LoadTest(scenario, server).run())
+    finally:
+        server.stop()
+
+
+def report(result: LoadResult):
+    summary = result.summary()
+    scenario = result.scenario
+    latency = summary["latency_ms"]
+    print(f"{scenario.rooms} rooms x {scenario.drawers} drawers, {scenario.rate:g} segments/s each, "
+          f"{'binary' if scenario.binary else 'json'} protocol, {scenario.duration:g}s")
+    print(f"  strokes sent      {summary['strokes_sent_per_second']:10.0f}/s")
+    print(f"  strokes delivered {summary['strokes_delivered_per_second']:10.0f}/s "
+          f"({summary['delivery_ratio']:.1%} of expected, {result.server_queue_drops} dropped by server queues)")
+    print(f"  frames received   {summary['frames_received_per_second']:10.0f}/s")
+    print(f"  latency           p50={latency['p50']:.2f}ms p90={latency['p90']:.2f}ms "
+          f"p99={latency['p99']:.2f}ms max={latency['max']:.2f}ms")
+    print(f"  server loop CPU   {summary['server_loop_cpu_percent']:5.1f}% of a core "
+          f"(process incl. clients {summary['process_cpu_percent']:.1f}%)")
+    print(f"  memory (RSS)      {result.rss_mb_before:.1f}MB -> {result.rss_mb_after:.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--drawers", type=int, default=4, help="drawers per room")
+    parser.add_argument("--rate", type=float, default=30, help="pen segments per second per drawer")
+    parser.add_argument("--stroke-segments", type=int, default=40, help="segments per stroke")
+    parser.add_argument("--pause-ms", type=float, default=300, help="pen-up time between strokes")
+    parser.add_argument("--duration", type=float, default=10, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="unmeasured seconds before measuring")
+    parser.add_argument("--binary", action="store_true", help="use the binary stroke protocol")
+    parser.add_argument("--port", type=int, default=0, help="server port (default: any free port)")
+    parser.add_argument("--no-persist", action="store_true",
+                        help="don't persist live strokes, to measure relaying alone")
+    parser.add_argument("--mongo-uri", default=None, help="real MongoDB instead of the in-memory mock")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="fail if p99 latency is higher")
+    parser.add_argument("--min-delivery", type=float, default=None,
+                        help="fail if fewer than this fraction of expected strokes arrive")
+    args = parser.parse_args()
+
+    # Cheap hashes so registering users doesn't dominate setup, and quiet
+    # logs; both must be set before the app is imported
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if args.no_persist:
+        os.environ["PERSIST_LIVE_STROKES"] = "false"
+
+    scenario = Scenario(
+        rooms=args.rooms, drawers=args.drawers, rate=args.rate, stroke_segments=args.stroke_segments,
+        pause_ms=args.pause_ms, duration=args.duration, warmup=args.warmup, binary=args.binary,
+        port=args.port, mongo_uri=args.mongo_uri,
+    )
+    result = run_scenario(scenario)
+    if args.json:
+        print(json.dumps(result.summary(), indent=2))
+    else:
+        report(result)
+
+    failures = []
+    p99 = percentile(result.latencies_ms, 99)
+    if args.max_p99_ms is not None and not p99 <= args.max_p99_ms:
+        failures.append(f"p99 latency {p99:.2f}ms is above {args.max_p99_ms}ms")
+    if args.min_delivery is not None and result.delivery_ratio < args.min_delivery:
+        failures.append(f"delivery ratio {result.delivery_ratio:.3f} is below {args.min_delivery}")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
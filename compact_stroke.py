@@ -0,0 +1,131 @@
+import os
+import sys
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from bson.binary import Binary
+from dotenv import load_dotenv
+from ..models.whiteboard import DrawingElement
+
+load_dotenv()
+
+# Store stroke points as one packed binary field instead of an array of {x, y} documents.
+# Readers handle both, so turn this off while older workers that only read arrays are running.
+STROKE_PACKED_POINTS = os.getenv("STROKE_PACKED_POINTS", "true").lower() == "true"
+
+# Field holding packed points in stroke and snapshot documents
+POINTS_FIELD = "points"
+
+# float32 when every coordinate survives it exactly, float64 otherwise
+PACKED_TYPECODES = ("f", "d")
+
+Points = Union[array, List[Dict[str, float]]]
+
+
+def pack_points(coordinates: Sequence[Dict[str, float]]) -> Optional[array]:
+    """Flatten {x, y} points into an x, y, x, y array, or None if they carry other fields"""
+    flat = []
+    try:
+        for point in coordinates:
+            if len(point) != 2:
+                return None
+            flat.append(point["x"])
+            flat.append(point["y"])
+        packed = array("f", flat)
+    except (KeyError, TypeError):
+        return None
+    except OverflowError:
+        return array("d", flat)
+    if packed.tolist() != flat:
+        packed = array("d", flat)
+    return packed
+
+
+def encode_points(packed: array) -> Binary:
+    """Packed points as BSON binary: the array typecode, then little-endian values"""
+    if sys.byteorder == "big":
+        packed = array(packed.typecode, packed)
+        packed.byteswap()
+    return Binary(packed.typecode.encode("ascii") + packed.tobytes())
+
+
+def decode_points(data: bytes) -> array:
+    """Inverse of encode_points"""
+    typecode = chr(data[0])
+    if typecode not in PACKED_TYPECODES:
+        raise ValueError(f"Unknown packed points typecode {typecode!r}")
+    packed = array(typecode)
+    packed.frombytes(data[1:])
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed
+
+
+def point_columns(element: Dict[str, Any]) -> Tuple[Sequence[float], Sequence[float]]:
+    """x and y values of a stroke document's points, packed or not"""
+    data = element.get(POINTS_FIELD)
+    if data is not None:
+        packed = decode_points(data)
+        return packed[0::2], packed[1::2]
+    coordinates = element.get("coordinates") or []
+    return [point["x"] for point in coordinates], [point["y"] for point in coordinates]
+
+
+def element_document(element: DrawingElement) -> Dict[str, Any]:
+    """Stroke document fields for an element, with its points packed when possible"""
+    document = {"type": element.type, "style": element.style}
+    packed = pack_points(element.coordinates) if STROKE_PACKED_POINTS else None
+    if packed is None:
+        document["coordinates"] = element.coordinates
+    else:
+        document[POINTS_FIELD] = encode_points(packed)
+    return document
+
+
+class CompactElement:
+    """A stored drawing element held with its points in one flat array
+
+    Elements read from MongoDB stay in this form, without a dict per
+    point or pydantic validation, until they are serialized at the API
+    edge with to_dict. Points that carry fields besides x and y are kept
+    as the original list.
+    """
+
+    __slots__ = ("type", "points", "style", "seq")
+
+    def __init__(self, type: str, points: Points, style: Optional[Dict[str, Any]] = None, seq: Optional[int] = None):
+        self.type = type
+        self.points = points
+        self.style = style if style is not None else {}
+        self.seq = seq
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any]) -> "CompactElement":
+        """Build from a stroke or snapshot document"""
+        data = document.get(POINTS_FIELD)
+        if data is not None:
+            points = decode_points(data)
+        else:
+            coordinates = document.get("coordinates") or []
+            points = pack_points(coordinates)
+            if points is None:
+                points = coordinates
+        return cls(document["type"], points, document.get("style"), document.get("seq"))
+
+    @property
+    def coordinates(self) -> List[Dict[str, float]]:
+        """Points in the public [{"x": ..., "y": ...}] shape"""
+        if not isinstance(self.points, array):
+            return self.points
+        values = iter(self.points.tolist())
+        return [{"x": x, "y": y} for x, y in zip(values, values)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The public JSON shape, the same as DrawingElement.dict()"""
+        return {"type": self.type, "coordinates": self.coordinates, "style": self.style, "seq": self.seq}
+
+    @property
+    def point_count(self) -> int:
+        return len(self.points) // 2 if isinstance(self.points, array) else len(self.points)
+
+    def __repr__(self) -> str:
+        return f"CompactElement(type={self.type!r}, points={self.point_count}, seq={self.seq!r})"
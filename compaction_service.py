@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+import bson
+from bson import ObjectId
+from pymongo import ASCENDING
+from dotenv import load_dotenv
+from ..database.mongodb import get_db
+from .geometry import Bounds, bounds_intersect, element_bounds
+from .metrics import timed_db_operation
+from .sharding import ShardMap, shard_map as default_shard_map
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Compaction configuration
+COMPACTION_INTERVAL_SECONDS = float(os.getenv("COMPACTION_INTERVAL_SECONDS", "60"))
+COMPACTION_MIN_NEW_STROKES = int(os.getenv("COMPACTION_MIN_NEW_STROKES", "500"))
+COMPACTION_BATCH_SIZE = int(os.getenv("COMPACTION_BATCH_SIZE", "5000"))
+# Snapshot chunks hold at most this many elements and this many BSON bytes,
+# well under MongoDB's 16 MB document limit even with long freehand strokes
+SNAPSHOT_CHUNK_SIZE = 1000
+SNAPSHOT_CHUNK_MAX_BYTES = int(os.getenv("SNAPSHOT_CHUNK_MAX_BYTES", str(4 * 1024 * 1024)))
+
+# A missing sequence number younger than this may still be in flight
+SEQ_GAP_GRACE = timedelta(seconds=30)
+
+
+def compact_elements(elements: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop elements that no longer affect the rendered board
+
+    Everything before the last clear is discarded, as are eraser strokes
+    that don't overlap any geometry drawn before them. The clear itself is
+    kept, so a client that syncs from the snapshot while holding older
+    elements still wipes them.
+    """
+    start = 0
+    for index, element in enumerate(elements):
+        if element.get("type") == "clear":
+            start = index
+
+    compacted = []
+    drawn: Optional[Bounds] = None
+    for element in elements[start:]:
+        bounds = element_bounds(element)
+        if element.get("type") == "eraser":
+            if drawn is None or bounds is None or not bounds_intersect(drawn, bounds):
+                continue
+        elif bounds is not None:
+            drawn = bounds if drawn is None else (
+                min(drawn[0], bounds[0]), min(drawn[1], bounds[1]),
+                max(drawn[2], bounds[2]), max(drawn[3], bounds[3])
+            )
+        compacted.append(element)
+    return compacted
+
+
+def chunk_elements(
+    elements: List[Dict[str, Any]],
+    max_bytes: int = SNAPSHOT_CHUNK_MAX_BYTES,
+    max_count: int = SNAPSHOT_CHUNK_SIZE
+) -> List[List[Dict[str, Any]]]:
+    """Split snapshot elements into runs of at most max_count elements and max_bytes of BSON"""
+    chunks = []
+    current: List[Dict[str, Any]] = []
+    size = 0
+    for element in elements:
+        element_size = len(bson.encode(element))
+        if current and (size + element_size > max_bytes or len(current) >= max_count):
+            chunks.append(current)
+            current, size = [], 0
+        current.append(element)
+        size += element_size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+@timed_db_operation
+async def get_snapshot_elements(db, snapshot_id: Optional[ObjectId]) -> List[Dict[str, Any]]:
+    """Load the elements of a board snapshot"""
+    if snapshot_id is None:
+        return []
+    elements = []
+    cursor = db.snapshot_chunks.find({"snapshot_id": snapshot_id}).sort("chunk", ASCENDING)
+    async for chunk in cursor:
+        elements.extend(chunk["elements"])
+    return elements
+
+
+@timed_db_operation
+async def get_snapshot_page(db, snapshot_id: ObjectId, after_seq: int, limit: int) -> List[Dict[str, Any]]:
+    """Load up to limit snapshot elements with a sequence number above after_seq"""
+    elements = []
+    cursor = db.snapshot_chunks.find(
+        {"snapshot_id": snapshot_id, "last_seq": {"$gt": after_seq}}
+    ).sort("chunk", ASCENDING)
+    async for chunk in cursor:
+        elements.extend(element for element in chunk["elements"] if element["seq"] > after_seq)
+        if len(elements) >= limit:
+            break
+    return elements[:limit]
+
+
+def contiguous_strokes(strokes: List[Dict[str, Any]], after_seq: int) -> List[Dict[str, Any]]:
+    """Strokes sorted by seq, cut at the first gap after after_seq that may still be filled
+
+    Sequence numbers are reserved before the insert, so a gap followed by
+    a young stroke means a write is still in flight. Older gaps belong to
+    strokes that were never stored and are skipped.
+    """
+    expected = after_seq + 1
+    cutoff = datetime.utcnow() - SEQ_GAP_GRACE
+    for index, stroke in enumerate(strokes):
+        if stroke["seq"] != expected and stroke.get("created_at", cutoff) >= cutoff:
+            return strokes[:index]
+        expected = stroke["seq"] + 1
+    return strokes
+
+
+async def _read_contiguous_strokes(db, whiteboard_id: str, after_seq: int, up_to_seq: int) -> List[Dict[str, Any]]:
+    """Read strokes after after_seq, stopping at a gap that may still be filled"""
+    cursor = db.strokes.find(
+        {"whiteboard_id": whiteboard_id, "seq": {"$gt": after_seq, "$lte": up_to_seq}},
+        {"_id": 0, "whiteboard_id": 0, "bbox": 0, "cells": 0}
+    ).sort("seq", ASCENDING).limit(COMPACTION_BATCH_SIZE)
+    strokes = contiguous_strokes([stroke async for stroke in cursor], after_seq)
+    for stroke in strokes:
+        stroke.pop("created_at", None)
+    return strokes
+
+
+@timed_db_operation
+async def compact_whiteboard(db, whiteboard_id: str) -> Optional[int]:
+    """Fold new strokes into a board's snapshot
+
+    Returns the sequence number the new snapshot covers, or None if there
+    was nothing to compact. Live writes are never blocked: strokes are
+    appended to their own collection and the snapshot is switched over
+    with a single conditional update.
+    """
+    if not ObjectId.is_valid(whiteboard_id):
+        return None
+
+    whiteboard = await db.whiteboards.find_one(
+        {"_id": ObjectId(whiteboard_id)},
+        {"stroke_seq": 1, "snapshot_seq": 1, "snapshot_id": 1}
+    )
+    if not whiteboard:
+        return None
+
+    snapshot_seq = whiteboard.get("snapshot_seq", 0)
+    strokes = await _read_contiguous_strokes(db, whiteboard_id, snapshot_seq, whiteboard.get("stroke_seq", 0))
+    if not strokes:
+        return None
+
+    previous = await get_snapshot_elements(db, whiteboard.get("snapshot_id"))
+    elements = compact_elements(previous + strokes)
+    new_seq = strokes[-1]["seq"]
+
+    # Write the new snapshot beside the old one, then switch over
+    snapshot_id = ObjectId()
+    now = datetime.utcnow()
+    chunks = [
+        {
+            "snapshot_id": snapshot_id,
+            "whiteboard_id": whiteboard_id,
+            "seq": new_seq,
+            "chunk": index,
+            "elements": chunk,
+            # Lets a paged read skip chunks the client already has
+            "last_seq": chunk[-1]["seq"],
+            "created_at": now
+        }
+        for index, chunk in enumerate(chunk_elements(elements))
+    ]
+    if chunks:
+        await db.snapshot_chunks.insert_many(chunks)
+
+    result = await db.whiteboards.update_one(
+        {"_id": ObjectId(whiteboard_id), "snapshot_id": whiteboard.get("snapshot_id")},
+        {
+            "$set": {"snapshot_seq": new_seq, "snapshot_id": snapshot_id, "snapshot_size": len(elements)},
+            # Every seq the snapshot now covers, including lost strokes it skipped
+            "$inc": {"strokes_since_snapshot": snapshot_seq - new_seq}
+        }
+    )
+    if result.modified_count == 0:
+        # Another compaction got there first
+        await db.snapshot_chunks.delete_many({"snapshot_id": snapshot_id})
+        return None
+
+    await db.snapshot_chunks.delete_many({"whiteboard_id": whiteboard_id, "snapshot_id": {"$ne": snapshot_id}})
+    logger.info(
+        "Compacted whiteboard %s up to seq %d: %d -> %d elements",
+        whiteboard_id, new_seq, len(previous) + len(strokes), len(elements)
+    )
+    return new_seq
+
+
+@timed_db_operation
+async def find_compaction_candidates(db, min_new_strokes: int = COMPACTION_MIN_NEW_STROKES) -> List[str]:
+    """Find boards with at least min_new_strokes strokes beyond their snapshot
+
+    Reads the strokes_since_snapshot counter kept by stroke appends and
+    compaction, so the query is served by its index.
+    """
+    cursor = db.whiteboards.find(
+        {"strokes_since_snapshot": {"$gte": min_new_strokes}},
+        {"_id": 1}
+    )
+    return [str(whiteboard["_id"]) async for whiteboard in cursor]
+
+
+class CompactionWorker:
+    """Background task that periodically compacts busy boards
+
+    Each worker only compacts the boards whose rooms it owns in the shard
+    map, so workers don't repeat each other's passes.
+    """
+
+    def __init__(self, interval: float = COMPACTION_INTERVAL_SECONDS, shard_map: ShardMap = default_shard_map):
+        self.interval = interval
+        self.shard_map = shard_map
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the background loop"""
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background loop"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> int:
+        """Compact every candidate board once and return how many changed"""
+        db = get_db()
+        if db is None:
+            return 0
+        compacted = 0
+        for whiteboard_id in await find_compaction_candidates(db):
+            if not self.shard_map.is_local(whiteboard_id):
+                continue
+            try:
+                if await compact_whiteboard(db, whiteboard_id) is not None:
+                    compacted += 1
+            except Exception as e:
+                logger.error("Compaction failed for whiteboard %s: %s", whiteboard_id, e)
+            # Give live traffic a turn between boards
+            await asyncio.sleep(0)
+        return compacted
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error("Compaction pass failed: %s", e)
+
+
+compaction_worker = CompactionWorker()
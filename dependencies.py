@@ -1,6 +1,6 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from ..services.auth_service import get_current_user
+from ..services.auth_service import authenticate_token, get_current_user
 from ..database.mongodb import get_db
 
 security = HTTPBearer()
@@ -17,7 +17,4 @@ async def get_current_user_optional(
 
 async def verify_websocket_token(token: str, db=Depends(get_db)):
     """Verify WebSocket token"""
-    try:
-        return await get_current_user(token, db)
-    except HTTPException:
-        return None
\ No newline at end of file
+    return await authenticate_token(db, token)
\ No newline at end of file
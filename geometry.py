@@ -0,0 +1,22 @@
+from typing import Any, Dict, Optional, Tuple
+from .compact_stroke import point_columns
+
+Bounds = Tuple[float, float, float, float]
+
+
+def element_bounds(element: Dict[str, Any]) -> Optional[Bounds]:
+    """Bounding box of an element's points, packed or not, padded by its line width"""
+    xs, ys = point_columns(element)
+    if not xs:
+        return None
+    pad = float((element.get("style") or {}).get("width", 0)) / 2
+    if element.get("type") == "circle" and len(xs) >= 2:
+        # The second point lies on the circle, the first is its centre
+        radius = ((xs[1] - xs[0]) ** 2 + (ys[1] - ys[0]) ** 2) ** 0.5
+        return (xs[0] - radius - pad, ys[0] - radius - pad, xs[0] + radius + pad, ys[0] + radius + pad)
+    return (min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad)
+
+
+def bounds_intersect(a: Bounds, b: Bounds) -> bool:
+    """Whether two bounding boxes overlap, edges included"""
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
\ No newline at end of file
@@ -1,11 +1,18 @@
 from fastapi import FastAPI
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
-from .database.mongodb import connect_to_mongo, close_mongo_connection
+from .database.mongodb import connect_to_mongo, close_mongo_connection, get_db
 from .routes import auth, sessions, webrtc
+from .services.compaction_service import compaction_worker
+from .services.metrics import CONTENT_TYPE, REGISTRY, MetricsMiddleware
+from .services.stroke_writer import stroke_buffer
+from .services.structured_logging import configure_logging
+from .services.webrtc_service import webrtc_manager
+from .services.whiteboard_service import access_change_hooks, get_room_settings, invalidate_board_access
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; records are written from a background thread
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Create FastAPI app
@@ -26,6 +33,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency per route, exposed on /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["authentication"])
 app.include_router(sessions.router, prefix="/api/sessions", tags=["whiteboard sessions"])
@@ -36,11 +46,27 @@ app.include_router(webrtc.router, prefix="/api/webrtc", tags=["webrtc"])
 async def startup_event():
     """Connect to MongoDB on startup"""
     await connect_to_mongo()
+    compaction_worker.start()
+    stroke_buffer.start()
+    # Persist a room's buffered strokes before it moves to another node
+    webrtc_manager.handoff_hooks.append(stroke_buffer.flush_board)
+    # Let clients advance their last seq past live strokes once they are stored
+    stroke_buffer.persist_hooks.append(webrtc_manager.announce_persisted)
+    # Keep every worker's board ACLs and rooms in step with access changes
+    access_change_hooks.append(webrtc_manager.publish_access_change)
+    webrtc_manager.access_hooks.append(invalidate_board_access)
+    # Rooms opening here, e.g. after a handoff, start with the board's stored tick and rate limits
+    webrtc_manager.settings_loader = lambda whiteboard_id: get_room_settings(get_db(), whiteboard_id)
+    await webrtc_manager.start()
     logger.info("Application started successfully")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Close MongoDB connection on shutdown"""
+    # Persist buffered strokes before the connection goes away
+    await stroke_buffer.close()
+    await webrtc_manager.stop()
+    await compaction_worker.stop()
     close_mongo_connection()
     logger.info("Application stopped")
 
@@ -59,6 +85,11 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "collaborative-whiteboard-api"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics for this worker"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,110 @@
+"""One-off data migrations.
+
+Run from the backend directory, with the application stopped:
+
+    python -m app.database.migrations
+"""
+import asyncio
+from datetime import datetime
+from pymongo import UpdateOne
+from .mongodb import connect_to_mongo, close_mongo_connection, get_db
+from ..services.spatial_index import spatial_fields
+
+# Strokes updated per bulk write when backfilling spatial fields
+BACKFILL_BATCH_SIZE = 1000
+
+
+async def split_embedded_elements(db) -> int:
+    """Move embedded whiteboards.elements arrays into the strokes collection
+
+    Strokes are upserted by (whiteboard_id, seq) before the array is
+    removed, so the migration can be re-run safely after an interruption.
+    Returns the number of migrated whiteboards.
+    """
+    migrated = 0
+    async for whiteboard in db.whiteboards.find(
+        {"elements": {"$exists": True}},
+        {"elements": 1, "stroke_seq": 1}
+    ):
+        whiteboard_id = str(whiteboard["_id"])
+        base_seq = whiteboard.get("stroke_seq", 0)
+        elements = whiteboard.get("elements") or []
+
+        if elements:
+            now = datetime.utcnow()
+            await db.strokes.bulk_write([
+                UpdateOne(
+                    {"whiteboard_id": whiteboard_id, "seq": base_seq + offset},
+                    {"$setOnInsert": dict(element, created_at=now)},
+                    upsert=True
+                )
+                for offset, element in enumerate(elements, start=1)
+            ], ordered=False)
+
+        # Only drop the array if no one appended strokes in the meantime
+        await db.whiteboards.update_one(
+            {"_id": whiteboard["_id"], "stroke_seq": whiteboard.get("stroke_seq")},
+            {
+                "$unset": {"elements": ""},
+                "$set": {"stroke_seq": base_seq + len(elements)}
+            }
+        )
+        migrated += 1
+    return migrated
+
+
+async def index_stroke_bounds(db) -> int:
+    """Add the bbox and grid cells viewport queries use to older strokes
+
+    Only strokes without cells are touched, so the migration can be
+    re-run safely. Returns the number of updated strokes.
+    """
+    updated = 0
+    batch = []
+    async for stroke in db.strokes.find(
+        {"cells": {"$exists": False}},
+        {"type": 1, "coordinates": 1, "points": 1, "style": 1}
+    ):
+        batch.append(UpdateOne({"_id": stroke["_id"]}, {"$set": spatial_fields(stroke)}))
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            await db.strokes.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await db.strokes.bulk_write(batch, ordered=False)
+        updated += len(batch)
+    return updated
+
+
+async def count_strokes_since_snapshot(db) -> int:
+    """Give older whiteboards the strokes_since_snapshot counter compaction looks for
+
+    Only whiteboards without the counter are touched, so the migration
+    can be re-run safely. Returns the number of updated whiteboards.
+    """
+    result = await db.whiteboards.update_many(
+        {"strokes_since_snapshot": {"$exists": False}},
+        [{"$set": {"strokes_since_snapshot": {"$subtract": [
+            {"$ifNull": ["$stroke_seq", 0]},
+            {"$ifNull": ["$snapshot_seq", 0]}
+        ]}}}]
+    )
+    return result.modified_count
+
+
+async def main():
+    if not await connect_to_mongo():
+        return
+    try:
+        migrated = await split_embedded_elements(get_db())
+        print(f"Migrated elements of {migrated} whiteboards to the strokes collection")
+        indexed = await index_stroke_bounds(get_db())
+        print(f"Added bounding boxes to {indexed} strokes")
+        counted = await count_strokes_since_snapshot(get_db())
+        print(f"Counted strokes since the snapshot on {counted} whiteboards")
+    finally:
+        close_mongo_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,5 @@
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING
 from pymongo.errors import ConnectionFailure
 import os
 from dotenv import load_dotenv
@@ -9,6 +10,13 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DB_NAME", "whiteboard_db")
 
+# Connection pool sizing, per process
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
 client = None
 db = None
 
@@ -16,16 +24,46 @@ async def connect_to_mongo():
     """Connect to MongoDB"""
     global client, db
     try:
-        client = MongoClient(MONGO_URI)
+        # Motor keeps socket I/O off the event loop so a slow query only
+        # delays the request that made it
+        client = AsyncIOMotorClient(
+            MONGO_URI,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS
+        )
         db = client[DB_NAME]
         # Test connection
-        client.admin.command('ping')
+        await client.admin.command('ping')
+        await create_indexes()
         print("✅ Connected to MongoDB!")
         return True
     except ConnectionFailure as e:
         print(f"❌ Could not connect to MongoDB: {e}")
         return False
 
+async def create_indexes():
+    """Create the indexes the services rely on"""
+    # Principal lookups and registration checks go by username and email
+    await db.users.create_index("username", unique=True)
+    await db.users.create_index("email", unique=True)
+    await db.strokes.create_index(
+        [("whiteboard_id", ASCENDING), ("seq", ASCENDING)],
+        unique=True
+    )
+    # Viewport queries go through the grid cells, and start after the last clear
+    await db.strokes.create_index([("whiteboard_id", ASCENDING), ("cells", ASCENDING), ("seq", ASCENDING)])
+    await db.strokes.create_index([("whiteboard_id", ASCENDING), ("type", ASCENDING), ("seq", DESCENDING)])
+    await db.snapshot_chunks.create_index([("snapshot_id", ASCENDING), ("chunk", ASCENDING)])
+    await db.snapshot_chunks.create_index("whiteboard_id")
+    # Session listing sorts each $or branch on updated_at
+    await db.whiteboards.create_index([("owner_id", ASCENDING), ("updated_at", DESCENDING)])
+    await db.whiteboards.create_index([("collaborators", ASCENDING), ("updated_at", DESCENDING)])
+    # Compaction looks for boards with enough strokes beyond their snapshot
+    await db.whiteboards.create_index("strokes_since_snapshot")
+
 def get_db():
     """Get database instance"""
     return db
@@ -0,0 +1,243 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from .metrics import REGISTRY
+from .stroke_batcher import merge_drawing_items
+
+load_dotenv()
+
+# Inbound message categories, each with its own token bucket per connection
+CATEGORY_DRAWING = "drawing"
+CATEGORY_SIGNALING = "signaling"
+CATEGORY_SESSION = "session"
+CATEGORY_VIEWPORT = "viewport"
+CATEGORY_OTHER = "other"
+CATEGORIES = (CATEGORY_DRAWING, CATEGORY_SIGNALING, CATEGORY_SESSION, CATEGORY_VIEWPORT, CATEGORY_OTHER)
+
+MESSAGE_CATEGORIES = {
+    "drawing_data": CATEGORY_DRAWING,
+    "stroke": CATEGORY_DRAWING,  # binary stroke frames
+    "offer": CATEGORY_SIGNALING,
+    "answer": CATEGORY_SIGNALING,
+    "ice_candidate": CATEGORY_SIGNALING,
+    "join_session": CATEGORY_SESSION,
+    "leave_session": CATEGORY_SESSION,
+    "viewport": CATEGORY_VIEWPORT,
+}
+
+# What happens to a message over its limit
+POLICY_DROP = "drop"
+POLICY_COALESCE = "coalesce"  # drawing data is merged and relayed when tokens return; the rest is dropped
+POLICY_DISCONNECT = "disconnect"
+POLICIES = (POLICY_DROP, POLICY_COALESCE, POLICY_DISCONNECT)
+
+# Decisions returned by InboundThrottle.admit
+ADMIT = "admit"
+HOLD = "hold"
+DROP = "drop"
+DISCONNECT = "disconnect"
+
+RateLimits = Dict[str, Tuple[float, float]]  # category -> (messages per second, burst)
+
+
+def parse_limits(spec: str) -> RateLimits:
+    """Parse category=rate:burst entries, e.g. drawing=120:240,session=5:10"""
+    limits = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        category, _, values = entry.partition("=")
+        rate, _, burst = values.partition(":")
+        limits[category.strip()] = (float(rate), float(burst or rate))
+    validate_limits(limits)
+    return limits
+
+
+def validate_limits(limits: RateLimits):
+    """Reject unknown categories and rates that could never admit a message"""
+    for category, (rate, burst) in limits.items():
+        if category not in CATEGORIES:
+            raise ValueError(f"Unknown rate limit category {category!r}, expected one of {CATEGORIES}")
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Rate limit for {category} needs rate > 0 and burst >= 1")
+
+
+# Largest text or binary frame a client may send, in bytes
+WS_MAX_FRAME_BYTES = int(os.getenv("WS_MAX_FRAME_BYTES", "65536"))
+# Default per-connection limits; boards can override them
+WS_RATE_LIMITS = parse_limits(os.getenv(
+    "WS_RATE_LIMITS", "drawing=120:240,signaling=50:100,session=5:10,viewport=20:40,other=10:20"
+))
+WS_RATE_LIMIT_POLICY = os.getenv("WS_RATE_LIMIT_POLICY", POLICY_COALESCE)
+# Coalesced drawing items held per connection before the oldest are dropped
+WS_COALESCE_MAX_PENDING = int(os.getenv("WS_COALESCE_MAX_PENDING", "64"))
+
+if WS_RATE_LIMIT_POLICY not in POLICIES:
+    raise ValueError(f"WS_RATE_LIMIT_POLICY must be one of {POLICIES}, got {WS_RATE_LIMIT_POLICY!r}")
+
+WS_THROTTLED = REGISTRY.counter(
+    "whiteboard_ws_throttled_total", "Inbound messages over their rate limit, by category and action",
+    ["category", "action"]
+)
+WS_FRAMES_TOO_LARGE = REGISTRY.counter(
+    "whiteboard_ws_frames_too_large_total", "Connections closed for sending a frame over WS_MAX_FRAME_BYTES"
+)
+WS_THROTTLE_EPISODES = REGISTRY.counter(
+    "whiteboard_ws_throttle_episodes_total", "Times a connection started being throttled, by category", ["category"]
+)
+
+
+def message_category(message_type: Any) -> str:
+    """Bucket an inbound message type belongs to"""
+    return MESSAGE_CATEGORIES.get(message_type, CATEGORY_OTHER)
+
+
+class TokenBucket:
+    """Refills at rate tokens per second up to burst; each message takes one"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def configure(self, rate: float, burst: float):
+        """Change the limits, keeping no more tokens than the new burst"""
+        if (rate, burst) != (self.rate, self.burst):
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.burst = burst
+            self.tokens = min(self.tokens, burst)
+
+    def take(self) -> bool:
+        """Take a token if one is available"""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Seconds until the next token"""
+        self._refill(time.monotonic())
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class InboundThrottle:
+    """Rate limits for one connection's inbound messages
+
+    Each category has a token bucket sized by the limits in force for the
+    connection's board. Over the limit, the policy decides: drop the
+    message, hold drawing data to relay it merged once tokens return, or
+    disconnect the client.
+    """
+
+    def __init__(self, user_id: str, policy: str = WS_RATE_LIMIT_POLICY,
+                 max_pending: int = WS_COALESCE_MAX_PENDING):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown rate limit policy: {policy}")
+        self.user_id = user_id
+        self.policy = policy
+        self.max_pending = max_pending
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._throttled: Dict[str, bool] = {}
+        self._pending: List[Dict[str, Any]] = []
+        self._release: Optional[Callable[[List[Dict[str, Any]]], None]] = None
+        self._release_handle: Optional[asyncio.TimerHandle] = None
+        self.throttled = 0
+        self.dropped = 0
+        self.episodes = 0
+
+    def _bucket(self, category: str, limits: RateLimits) -> TokenBucket:
+        rate, burst = limits.get(category) or limits[CATEGORY_OTHER]
+        bucket = self._buckets.get(category)
+        if bucket is None:
+            bucket = self._buckets[category] = TokenBucket(rate, burst)
+        else:
+            bucket.configure(rate, burst)
+        return bucket
+
+    def admit(self, category: str, limits: RateLimits) -> str:
+        """Decide what to do with an inbound message: ADMIT, HOLD, DROP or DISCONNECT"""
+        if self._bucket(category, limits).take():
+            self._throttled[category] = False
+            return ADMIT
+        self.throttled += 1
+        if not self._throttled.get(category):
+            self._throttled[category] = True
+            self.episodes += 1
+            WS_THROTTLE_EPISODES.labels(category).inc()
+        if self.policy == POLICY_DISCONNECT:
+            decision = DISCONNECT
+        elif self.policy == POLICY_COALESCE and category == CATEGORY_DRAWING:
+            decision = HOLD
+        else:
+            decision = DROP
+            self.dropped += 1
+        WS_THROTTLED.labels(category, decision).inc()
+        return decision
+
+    def retry_after(self, category: str) -> float:
+        """Seconds until a category admits messages again"""
+        bucket = self._buckets.get(category)
+        return bucket.wait_time() if bucket else 0.0
+
+    def hold(self, data: Dict[str, Any], release: Callable[[List[Dict[str, Any]]], None]):
+        """Keep throttled drawing data, merged with what is already held
+
+        release is called with the held items once a drawing token is
+        available again.
+        """
+        self._pending.append({"user_id": self.user_id, "data": data, "timestamp": datetime.utcnow().isoformat()})
+        self._pending = merge_drawing_items(self._pending)
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.dropped += overflow
+            WS_THROTTLED.labels(CATEGORY_DRAWING, DROP).inc(overflow)
+        self._release = release
+        self._schedule_release()
+
+    def _schedule_release(self):
+        if self._release_handle is None:
+            self._release_handle = asyncio.get_running_loop().call_later(
+                self.retry_after(CATEGORY_DRAWING), self._release_pending
+            )
+
+    def _release_pending(self):
+        self._release_handle = None
+        if not self._pending:
+            return
+        bucket = self._buckets[CATEGORY_DRAWING]
+        if not bucket.take():
+            self._schedule_release()
+            return
+        items, self._pending = self._pending, []
+        self._release(items)
+
+    @property
+    def pending(self) -> int:
+        """Drawing items held for relaying"""
+        return len(self._pending)
+
+    def stats(self) -> Dict[str, int]:
+        """Throttling counters for this connection"""
+        return {"throttled": self.throttled, "dropped": self.dropped, "episodes": self.episodes,
+                "pending": len(self._pending)}
+
+    def close(self):
+        """Stop any pending release; held items are discarded"""
+        if self._release_handle is not None:
+            self._release_handle.cancel()
+            self._release_handle = None
+        self._pending = []
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+from fastapi import WebSocket
+from dotenv import load_dotenv
+from .metrics import REGISTRY
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Overflow policies for a full outbound queue
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOW_DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE, OVERFLOW_DISCONNECT)
+
+# Send queue configuration
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", OVERFLOW_DROP_OLDEST)
+
+if OVERFLOW_POLICY not in OVERFLOW_POLICIES:
+    raise ValueError(f"WS_OVERFLOW_POLICY must be one of {OVERFLOW_POLICIES}, got {OVERFLOW_POLICY!r}")
+
+SEND_FAILURES = REGISTRY.counter(
+    "whiteboard_ws_send_failures_total", "Outbound payloads that were not delivered, by reason", ["reason"]
+)
+SEND_ERRORS = SEND_FAILURES.labels("send_error")
+SEND_DROPPED = SEND_FAILURES.labels("dropped")
+SEND_SLOW_CONSUMER = SEND_FAILURES.labels("slow_consumer")
+
+
+class ConnectionSender:
+    """Bounded outbound queue with a dedicated writer task for one WebSocket.
+
+    Producers call ``enqueue`` which never awaits, so a slow client only
+    backs up its own queue instead of the whole room.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        on_failure: Callable[[str, str], None],
+        max_size: int = SEND_QUEUE_SIZE,
+        overflow_policy: str = OVERFLOW_POLICY,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.websocket = websocket
+        self.user_id = user_id
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self._on_failure = on_failure
+        # Each item is (coalesce_key, payload)
+        self._queue: Deque[Tuple[Optional[str], Any]] = deque()
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.last_error: Optional[str] = None
+
+        # Counters
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    def start(self):
+        """Start the writer task"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._writer())
+
+    def enqueue(self, payload: Any, coalesce_key: Optional[str] = None) -> bool:
+        """Queue a payload for sending without blocking
+
+        Returns False if the payload was not queued.
+        """
+        if self.closed:
+            return False
+
+        if len(self._queue) >= self.max_size:
+            if not self._handle_overflow(payload, coalesce_key):
+                return False
+        else:
+            self._queue.append((coalesce_key, payload))
+
+        self.max_depth = max(self.max_depth, len(self._queue))
+        self._ready.set()
+        return True
+
+    def _handle_overflow(self, payload: Any, coalesce_key: Optional[str]) -> bool:
+        """Apply the overflow policy to a full queue"""
+        if self.overflow_policy == OVERFLOW_DISCONNECT:
+            self.dropped += 1
+            SEND_SLOW_CONSUMER.inc()
+            self.last_error = f"send queue full ({self.max_size})"
+            logger.debug("Send queue full for user %s, disconnecting slow consumer", self.user_id)
+            self.close()
+            self._on_failure(self.user_id, "overflow")
+            return False
+
+        if self.overflow_policy == OVERFLOW_COALESCE and coalesce_key is not None:
+            # Replace the newest queued payload with the same key
+            for index in range(len(self._queue) - 1, -1, -1):
+                if self._queue[index][0] == coalesce_key:
+                    self._queue[index] = (coalesce_key, payload)
+                    self.coalesced += 1
+                    return True
+
+        # Drop the oldest payload to make room
+        self._queue.popleft()
+        self._queue.append((coalesce_key, payload))
+        self.dropped += 1
+        SEND_DROPPED.inc()
+        return True
+
+    async def _writer(self):
+        """Drain the queue onto the WebSocket"""
+        try:
+            while not self.closed:
+                if not self._queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+
+                _, payload = self._queue.popleft()
+                if isinstance(payload, bytes):
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The manager aggregates failures per room; this is for debugging only
+            SEND_ERRORS.inc()
+            self.last_error = repr(e)
+            logger.debug("Error sending message to user %s: %r", self.user_id, e)
+            self.close()
+            self._on_failure(self.user_id, "send_error")
+
+    def close(self):
+        """Stop the writer task and discard queued payloads"""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        self._ready.set()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    @property
+    def depth(self) -> int:
+        """Number of payloads waiting to be sent"""
+        return len(self._queue)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and counters for this connection"""
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "capacity": self.max_size,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "overflow_policy": self.overflow_policy,
+        }
@@ -0,0 +1,90 @@
+import json
+import math
+from datetime import datetime
+from typing import Any, Union
+from .compact_stroke import CompactElement
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+
+def _default(value: Any):
+    """Serialize datetimes the way orjson does, and stored elements in their public shape"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, CompactElement):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _finite(value: Any) -> Any:
+    """A copy of value with NaN and infinities replaced by None, as orjson writes them"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(item) for item in value]
+    return value
+
+
+def _reject_constant(name: str):
+    raise ValueError(f"Invalid JSON number {name}")
+
+
+def _dumps_stdlib(message: Any) -> bytes:
+    """Encode with the stdlib using the same compact output as orjson
+
+    Strings, integers, datetimes and non-finite floats (null) come out
+    byte for byte the same. Floats are written with repr, so exponents
+    can be spelled differently (1e-07 rather than 1e-7); they decode to
+    the same values.
+    """
+    try:
+        encoded = json.dumps(
+            message,
+            separators=(",", ":"),
+            ensure_ascii=False,
+            allow_nan=False,
+            default=_default,
+        )
+    except ValueError:
+        # Only messages holding NaN or infinity pay for the copy
+        encoded = json.dumps(
+            _finite(message),
+            separators=(",", ":"),
+            ensure_ascii=False,
+            allow_nan=False,
+            default=lambda value: _finite(_default(value)),
+        )
+    return encoded.encode("utf-8")
+
+
+def _loads_stdlib(data: Union[str, bytes]) -> Any:
+    """Decode with the stdlib, rejecting NaN and Infinity like orjson"""
+    return json.loads(data, parse_constant=_reject_constant)
+
+
+if orjson is not None:
+    def dumps(message: Any) -> bytes:
+        """Encode a message to UTF-8 JSON bytes"""
+        return orjson.dumps(message, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(data: Union[str, bytes]) -> Any:
+        """Decode a JSON message"""
+        return orjson.loads(data)
+else:
+    dumps = _dumps_stdlib
+    loads = _loads_stdlib
+
+
+def encode_message(message: Any) -> str:
+    """Encode a message once for sending as a WebSocket text frame
+
+    The result is shared by every recipient of a broadcast.
+    """
+    return dumps(message).decode("utf-8")
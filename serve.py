@@ -0,0 +1,248 @@
+"""Multi-core serving: a supervisor running shared-nothing uvicorn workers.
+
+Every worker is a separate process with its own event loop, MongoDB pool
+and room state. All workers accept on one shared listen socket. With
+--pin-rooms (the default), each worker also listens on its own port, and
+the shard map redirects a board's WebSocket clients to the worker that
+owns it, so room fan-out never leaves that process. The supervisor
+restarts crashed workers and drains them on shutdown (SIGTERM/SIGINT) or
+one by one on SIGHUP.
+
+Run from the backend directory:
+
+    python -m app.serve --workers 4 --port 8000 --public-host whiteboard.example.com
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import Dict, List, Optional
+
+import uvicorn
+
+logger = logging.getLogger("app.serve")
+
+# A worker that dies sooner than this after starting is restarted with backoff
+MIN_WORKER_UPTIME = 5.0
+MAX_RESTART_DELAY = 30.0
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    """Open a listening socket that worker processes can inherit"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def worker_nodes(workers: int, scheme: str, public_host: str, base_port: int) -> Dict[str, str]:
+    """Shard map entries pointing clients at each worker's own port"""
+    return {f"worker-{index}": f"{scheme}://{public_host}:{base_port + index}" for index in range(workers)}
+
+
+def run_worker(sockets: List[socket.socket], env: Dict[str, str], log_level: str, drain_timeout: int):
+    """Worker process entry point"""
+    # Set before the app is imported, since its modules read config at import
+    os.environ.update(env)
+    from .services.rate_limit import WS_MAX_FRAME_BYTES
+    config = uvicorn.Config(
+        "app.main:app",
+        log_level=log_level,
+        timeout_graceful_shutdown=drain_timeout,
+        ws_max_size=WS_MAX_FRAME_BYTES,
+    )
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+class Supervisor:
+    """Starts, watches, restarts and drains worker processes"""
+
+    def __init__(
+        self,
+        workers: int,
+        host: str,
+        port: int,
+        worker_base_port: Optional[int],
+        public_host: str,
+        public_scheme: str = "ws",
+        db_pool_size: Optional[int] = None,
+        drain_timeout: int = 30,
+        log_level: str = "info",
+    ):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.worker_base_port = worker_base_port
+        self.nodes = (
+            worker_nodes(workers, public_scheme, public_host, worker_base_port)
+            if worker_base_port is not None else {}
+        )
+        self.db_pool_size = db_pool_size
+        self.drain_timeout = drain_timeout
+        self.log_level = log_level
+        self.context = multiprocessing.get_context("spawn")
+        self.shared_socket: Optional[socket.socket] = None
+        self.worker_sockets: List[Optional[socket.socket]] = []
+        self.processes: List[Optional[multiprocessing.Process]] = []
+        self.started_at: List[float] = []
+        self.restart_delay: List[float] = []
+        self.should_exit = False
+        self.should_reload = False
+
+    def worker_env(self, index: int) -> Dict[str, str]:
+        """Environment that makes a worker its own node in the shard map"""
+        env = {"NODE_ID": f"worker-{index}"}
+        if self.nodes:
+            env["WHITEBOARD_NODES"] = ",".join(f"{node}={url}" for node, url in self.nodes.items())
+        if self.db_pool_size is not None:
+            env["MONGO_MAX_POOL_SIZE"] = str(self.db_pool_size)
+        return env
+
+    def spawn(self, index: int):
+        """Start the worker for a slot, reusing its sockets"""
+        sockets = [self.shared_socket]
+        if self.worker_sockets[index] is not None:
+            sockets.append(self.worker_sockets[index])
+        process = self.context.Process(
+            target=run_worker,
+            args=(sockets, self.worker_env(index), self.log_level, self.drain_timeout),
+            name=f"whiteboard-worker-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+        logger.info("Started worker %d (pid %d)", index, process.pid)
+
+    def drain(self, index: int):
+        """Stop a worker gracefully, killing it if it overruns the drain timeout"""
+        process = self.processes[index]
+        if process is None or not process.is_alive():
+            return
+        # uvicorn stops accepting, closes WebSockets with 1012 and runs
+        # the app's shutdown hooks, which flush buffered strokes
+        process.terminate()
+        process.join(self.drain_timeout + 5)
+        if process.is_alive():
+            logger.warning("Worker %d did not drain in time, killing it", index)
+            process.kill()
+            process.join()
+
+    def start(self):
+        """Bind the sockets and start every worker"""
+        self.shared_socket = bind_socket(self.host, self.port)
+        self.worker_sockets = [
+            bind_socket(self.host, self.worker_base_port + index) if self.worker_base_port is not None else None
+            for index in range(self.workers)
+        ]
+        self.processes = [None] * self.workers
+        self.started_at = [0.0] * self.workers
+        self.restart_delay = [0.0] * self.workers
+        if self.workers > 1 and os.getenv("BACKPLANE_URL", "memory://").startswith("memory"):
+            logger.warning(
+                "BACKPLANE_URL is in-memory: presence and signaling won't cross workers. "
+                "Use Redis unless every client follows room redirects."
+            )
+        for index in range(self.workers):
+            self.spawn(index)
+
+    def check_workers(self):
+        """Restart workers that exited, backing off if they keep crashing"""
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process is None or process.is_alive():
+                continue
+            if process.exitcode is not None:
+                logger.error("Worker %d (pid %d) exited with code %s", index, process.pid, process.exitcode)
+                uptime = now - self.started_at[index]
+                if uptime < MIN_WORKER_UPTIME:
+                    self.restart_delay[index] = min(max(self.restart_delay[index] * 2, 0.5), MAX_RESTART_DELAY)
+                else:
+                    self.restart_delay[index] = 0.0
+                self.started_at[index] = now + self.restart_delay[index]
+                self.processes[index] = process = None
+            if self.processes[index] is None and now >= self.started_at[index]:
+                self.spawn(index)
+
+    def reload(self):
+        """Replace workers one at a time so the others keep serving"""
+        logger.info("Reloading workers")
+        for index in range(self.workers):
+            if self.should_exit:
+                return
+            self.drain(index)
+            self.spawn(index)
+
+    def run(self):
+        """Supervise until SIGTERM or SIGINT"""
+        signal.signal(signal.SIGTERM, self._handle_exit)
+        signal.signal(signal.SIGINT, self._handle_exit)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._handle_reload)
+        self.start()
+        try:
+            while not self.should_exit:
+                if self.should_reload:
+                    self.should_reload = False
+                    self.reload()
+                self.check_workers()
+                time.sleep(0.5)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Drain every worker, then release the sockets"""
+        logger.info("Draining workers")
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for index in range(self.workers):
+            self.drain(index)
+        for sock in [self.shared_socket, *self.worker_sockets]:
+            if sock is not None:
+                sock.close()
+
+    def _handle_exit(self, signum, frame):
+        self.should_exit = True
+
+    def _handle_reload(self, signum, frame):
+        self.should_reload = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000, help="shared port for REST and first WebSocket connects")
+    parser.add_argument("--worker-base-port", type=int, default=None,
+                        help="first per-worker port (default: port + 1)")
+    parser.add_argument("--no-pin-rooms", action="store_true",
+                        help="don't give workers their own ports, e.g. when nginx hashes boards to workers")
+    parser.add_argument("--public-host", default="localhost", help="host clients use to reach the workers")
+    parser.add_argument("--public-scheme", default="ws", choices=["ws", "wss"])
+    parser.add_argument("--db-pool-size", type=int, default=None, help="MongoDB pool size per worker")
+    parser.add_argument("--drain-timeout", type=int, default=30, help="seconds a worker gets to drain")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper())
+    worker_base_port = None if args.no_pin_rooms else (args.worker_base_port or args.port + 1)
+    Supervisor(
+        workers=args.workers,
+        host=args.host,
+        port=args.port,
+        worker_base_port=worker_base_port,
+        public_host=args.public_host,
+        public_scheme=args.public_scheme,
+        db_pool_size=args.db_pool_size,
+        drain_timeout=args.drain_timeout,
+        log_level=args.log_level,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,37 @@
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from ..models.whiteboard import Whiteboard, WhiteboardCreate, WhiteboardUpdate, DrawingElement
+from fastapi.responses import Response
+from pydantic import BaseModel
+from ..models.whiteboard import Whiteboard, WhiteboardCreate, WhiteboardUpdate, WhiteboardSummary, DrawingElement, ElementDelta
 from ..models.user import User
 from ..services.whiteboard_service import (
     create_whiteboard,
     get_whiteboard,
-    get_user_whiteboards,
+    get_board_access,
+    list_user_whiteboards,
     update_whiteboard,
     add_drawing_element,
-    add_collaborator
+    add_collaborator,
+    load_board_elements,
+    get_element_delta,
+    get_elements_in_bounds
 )
-from ..services.auth_service import get_current_user
+from ..services.serialization import dumps
+from ..services.spatial_index import parse_bbox
+from ..services.auth_service import get_current_user, get_user_by_username
 from ..database.mongodb import get_db
 
 router = APIRouter()
 
+def _elements_response(model: BaseModel) -> Response:
+    """Encode a response holding stored elements directly
+
+    The elements are kept compact until here, so re-validating them
+    against response_model would rebuild a dict per point for nothing.
+    """
+    return Response(dumps(model.dict()), media_type="application/json")
+
 @router.post("/", response_model=Whiteboard, status_code=status.HTTP_201_CREATED)
 async def create_whiteboard_session(
     whiteboard: WhiteboardCreate,
@@ -30,17 +47,18 @@ async def create_whiteboard_session(
             detail=f"Failed to create whiteboard: {str(e)}"
         )
 
-@router.get("/", response_model=List[Whiteboard])
+@router.get("/", response_model=List[WhiteboardSummary])
 async def get_user_sessions(
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
+    before: Optional[datetime] = Query(None, description="updated_at of the last session on the previous page"),
+    before_id: Optional[str] = Query(None, description="id of the last session on the previous page"),
     current_user: User = Depends(get_current_user),
     db=Depends(get_db)
 ):
     """Get all whiteboard sessions for the current user"""
     try:
-        whiteboards = await get_user_whiteboards(db, current_user.id)
-        return whiteboards[skip:skip + limit]
+        return await list_user_whiteboards(db, current_user.id, skip, limit, before, before_id)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -50,6 +68,7 @@ async def get_user_sessions(
 @router.get("/{session_id}", response_model=Whiteboard)
 async def get_session(
     session_id: str,
+    include_elements: bool = Query(False, description="Set to true to also load every drawing element; page through /elements instead on large boards"),
     current_user: User = Depends(get_current_user),
     db=Depends(get_db)
 ):
@@ -68,7 +87,47 @@ async def get_session(
             detail="Not authorized to access this whiteboard"
         )
     
-    return whiteboard
+    if include_elements:
+        whiteboard.elements = await load_board_elements(db, session_id)
+    return _elements_response(whiteboard)
+
+@router.get("/{session_id}/elements", response_model=ElementDelta)
+async def get_session_elements(
+    session_id: str,
+    since: int = Query(0, ge=0, description="Return elements with a sequence number above this"),
+    limit: int = Query(1000, ge=1, le=5000),
+    bbox: Optional[str] = Query(None, description="min_x,min_y,max_x,max_y; only return elements intersecting it"),
+    current_user: User = Depends(get_current_user),
+    db=Depends(get_db)
+):
+    """Get the drawing elements added to a whiteboard since a sequence number, optionally within a bbox"""
+    bounds = None
+    if bbox is not None:
+        try:
+            bounds = parse_bbox(bbox)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+    
+    access = await get_board_access(db, session_id)
+    if not access:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Whiteboard not found"
+        )
+    
+    # Check if user has access to this whiteboard
+    if not access.can_edit(current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to access this whiteboard"
+        )
+    
+    if bounds is not None:
+        return _elements_response(await get_elements_in_bounds(db, session_id, bounds, since, limit))
+    return _elements_response(await get_element_delta(db, session_id, since, limit))
 
 @router.put("/{session_id}", response_model=Whiteboard)
 async def update_session(
@@ -78,15 +137,15 @@ async def update_session(
     db=Depends(get_db)
 ):
     """Update a whiteboard session"""
-    whiteboard = await get_whiteboard(db, session_id)
-    if not whiteboard:
+    access = await get_board_access(db, session_id)
+    if not access:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Whiteboard not found"
         )
     
     # Check if user is the owner
-    if whiteboard.owner_id != current_user.id:
+    if access.owner_id != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only the owner can update the whiteboard"
@@ -99,7 +158,8 @@ async def update_session(
             detail="Failed to update whiteboard"
         )
     
-    return updated_whiteboard
+    updated_whiteboard.elements = await load_board_elements(db, session_id)
+    return _elements_response(updated_whiteboard)
 
 @router.post("/{session_id}/elements", status_code=status.HTTP_201_CREATED)
 async def add_element(
@@ -109,15 +169,15 @@ async def add_element(
     db=Depends(get_db)
 ):
     """Add a drawing element to a whiteboard"""
-    whiteboard = await get_whiteboard(db, session_id)
-    if not whiteboard:
+    access = await get_board_access(db, session_id)
+    if not access:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Whiteboard not found"
         )
     
     # Check if user has access to this whiteboard
-    if whiteboard.owner_id != current_user.id and current_user.id not in whiteboard.collaborators:
+    if not access.can_edit(current_user.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to modify this whiteboard"
@@ -140,23 +200,29 @@ async def add_collaborator_to_session(
     db=Depends(get_db)
 ):
     """Add a collaborator to a whiteboard session"""
-    whiteboard = await get_whiteboard(db, session_id)
-    if not whiteboard:
+    access = await get_board_access(db, session_id)
+    if not access:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Whiteboard not found"
         )
     
     # Check if user is the owner
-    if whiteboard.owner_id != current_user.id:
+    if access.owner_id != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only the owner can add collaborators"
         )
     
-    # For simplicity, we're using username as user_id
-    # In a real implementation, you'd want to look up the user ID
-    success = await add_collaborator(db, session_id, collaborator_username)
+    # Access checks compare user IDs, so store the ID rather than the username
+    collaborator = await get_user_by_username(db, collaborator_username)
+    if not collaborator:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
+    success = await add_collaborator(db, session_id, collaborator.id)
     if not success:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
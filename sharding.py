@@ -0,0 +1,85 @@
+import hashlib
+import os
+from typing import Dict, Optional
+from dotenv import load_dotenv
+from .backplane import NODE_ID
+
+load_dotenv()
+
+# Room affinity: comma-separated node_id=ws://host:port entries, empty to disable
+WHITEBOARD_NODES = os.getenv("WHITEBOARD_NODES", "")
+# How long clients of a handed-off room get to reconnect before being closed
+ROOM_HANDOFF_GRACE_SECONDS = float(os.getenv("ROOM_HANDOFF_GRACE_SECONDS", "2"))
+
+
+def parse_nodes(spec: str) -> Dict[str, str]:
+    """Parse a node_id=url list; the URL is where clients reach the node"""
+    nodes = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        node_id, _, url = entry.partition("=")
+        nodes[node_id.strip()] = url.strip().rstrip("/")
+    return nodes
+
+
+def _score(node_id: str, whiteboard_id: str) -> int:
+    digest = hashlib.blake2b(f"{node_id}\0{whiteboard_id}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def rendezvous_owner(whiteboard_id: str, node_ids) -> Optional[str]:
+    """Pick the node with the highest hash for a board
+
+    Adding or removing a node only moves the boards that node wins or
+    held, so a membership change hands off as few rooms as possible.
+    """
+    return max(node_ids, key=lambda node_id: _score(node_id, whiteboard_id), default=None)
+
+
+class ShardMap:
+    """Which node owns each whiteboard's room"""
+
+    def __init__(self, nodes: Optional[Dict[str, str]] = None, node_id: str = NODE_ID):
+        self.node_id = node_id
+        self.nodes: Dict[str, str] = dict(nodes or {})
+        self.version = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Affinity applies only when this node is part of the map"""
+        return self.node_id in self.nodes
+
+    def owner(self, whiteboard_id: str) -> Optional[str]:
+        """Node that should host a board's room"""
+        return rendezvous_owner(whiteboard_id, self.nodes)
+
+    def is_local(self, whiteboard_id: str) -> bool:
+        """Whether this node should host a board's room"""
+        return not self.enabled or self.owner(whiteboard_id) == self.node_id
+
+    def redirect_for(self, whiteboard_id: str) -> Optional[Dict[str, str]]:
+        """Where to send clients of a board this node does not own
+
+        Returns None when the room should stay here, including when the
+        owner has no client-facing URL and the backplane must bridge.
+        """
+        if self.is_local(whiteboard_id):
+            return None
+        owner = self.owner(whiteboard_id)
+        if not self.nodes.get(owner):
+            return None
+        return {"node": owner, "url": self.nodes[owner]}
+
+    def update(self, nodes: Dict[str, str]):
+        """Replace the node list"""
+        self.nodes = dict(nodes)
+        self.version += 1
+
+    def to_dict(self) -> Dict:
+        """Current map for diagnostics"""
+        return {"node_id": self.node_id, "enabled": self.enabled, "version": self.version, "nodes": self.nodes}
+
+
+shard_map = ShardMap(parse_nodes(WHITEBOARD_NODES))
@@ -0,0 +1,256 @@
+import math
+import os
+from typing import Any, Dict, List, Optional, Sequence
+from dotenv import load_dotenv
+from ..models.whiteboard import DrawingElement
+from .metrics import REGISTRY
+from .stroke_codec import HEADER, decode_stroke, encode_stroke
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional dependency
+    numpy = None
+
+load_dotenv()
+
+# Ramer-Douglas-Peucker tolerance in canvas pixels (0 disables simplification)
+STROKE_SIMPLIFY_TOLERANCE = float(os.getenv("STROKE_SIMPLIFY_TOLERANCE", "0"))
+# Coordinates are rounded to multiples of this many pixels (0 disables quantization)
+STROKE_QUANTIZE_STEP = float(os.getenv("STROKE_QUANTIZE_STEP", "0"))
+# Strokes with at least this many points are simplified with NumPy when it is installed
+STROKE_SIMPLIFY_NUMPY_MIN_POINTS = int(os.getenv("STROKE_SIMPLIFY_NUMPY_MIN_POINTS", "64"))
+
+SIMPLIFY_ENABLED = STROKE_SIMPLIFY_TOLERANCE > 0 or STROKE_QUANTIZE_STEP > 0
+
+# Freehand tools; shapes are defined by exact control points and left alone
+SIMPLIFY_TOOLS = {"pen", "eraser"}
+
+STROKE_POINTS_RECEIVED = REGISTRY.counter(
+    "whiteboard_stroke_points_received_total", "Points in freehand strokes before simplification"
+)
+STROKE_POINTS_KEPT = REGISTRY.counter(
+    "whiteboard_stroke_points_kept_total", "Points in freehand strokes after simplification"
+)
+
+
+def _rdp_python(xs: Sequence[float], ys: Sequence[float], tolerance: float) -> List[int]:
+    """Indices of the points Ramer-Douglas-Peucker keeps"""
+    count = len(xs)
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    limit = tolerance * tolerance
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        x0, y0 = xs[start], ys[start]
+        dx, dy = xs[end] - x0, ys[end] - y0
+        norm = dx * dx + dy * dy
+        farthest, index = -1.0, start
+        for i in range(start + 1, end):
+            px, py = xs[i] - x0, ys[i] - y0
+            if norm:
+                cross = dx * py - dy * px
+                distance = cross * cross / norm
+            else:
+                distance = px * px + py * py
+            if distance > farthest:
+                farthest, index = distance, i
+        if farthest > limit:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return [i for i in range(count) if keep[i]]
+
+
+def _simplify_numpy(strokes: List[List[Dict[str, Any]]], tolerance: float, step: float) -> List[List[Dict[str, Any]]]:
+    """Simplify a batch of strokes with NumPy, one vectorized pass per split level
+
+    The strokes' points are concatenated with every stroke's end points
+    kept. Each pass measures every remaining point against the segment
+    between its kept neighbours and splits all segments at once, so the
+    work per pass doesn't depend on how many strokes are in the batch.
+    """
+    lengths = numpy.array([len(stroke) for stroke in strokes])
+    total = int(lengths.sum())
+    xs = numpy.fromiter((point["x"] for stroke in strokes for point in stroke), float, total)
+    ys = numpy.fromiter((point["y"] for stroke in strokes for point in stroke), float, total)
+    starts = numpy.concatenate(([0], numpy.cumsum(lengths)[:-1]))
+    ends = starts + lengths - 1
+    valid = numpy.logical_and.reduceat(numpy.isfinite(xs) & numpy.isfinite(ys), starts)
+
+    if step > 0:
+        xs = numpy.round(numpy.round(xs / step) * step, 6)
+        ys = numpy.round(numpy.round(ys / step) * step, 6)
+    alive = numpy.ones(total, dtype=bool)
+    if step > 0:
+        alive[1:] = (xs[1:] != xs[:-1]) | (ys[1:] != ys[:-1])
+    alive[starts] = alive[ends] = True
+    positions = numpy.flatnonzero(alive)
+    x, y = xs[positions], ys[positions]
+    keep = numpy.full(len(positions), tolerance <= 0)
+    keep[numpy.searchsorted(positions, starts)] = keep[numpy.searchsorted(positions, ends)] = True
+
+    if tolerance > 0:
+        limit = tolerance * tolerance
+        points = numpy.arange(len(positions))
+        # Strokes with non-finite points are returned unchanged, so their NaNs don't matter
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            while True:
+                kept = numpy.flatnonzero(keep)
+                segment = numpy.searchsorted(kept, points, side="right") - 1
+                first = kept[segment]
+                last = kept[numpy.minimum(segment + 1, len(kept) - 1)]
+                dx, dy = x[last] - x[first], y[last] - y[first]
+                px, py = x - x[first], y - y[first]
+                norm = dx * dx + dy * dy
+                cross = dx * py - dy * px
+                distance = numpy.where(norm > 0, cross * cross / numpy.where(norm > 0, norm, 1), px * px + py * py)
+                distance[keep] = -1
+                farthest = numpy.maximum.reduceat(distance, kept)
+                split = farthest > limit
+                if not split.any():
+                    break
+                candidates = numpy.flatnonzero(split[segment] & (distance == farthest[segment]))
+                _, firsts = numpy.unique(segment[candidates], return_index=True)
+                keep[candidates[firsts]] = True
+
+    kept_positions = positions[keep]
+    bounds = numpy.searchsorted(kept_positions, numpy.append(starts, total)).tolist()
+    kept_positions = kept_positions.tolist()
+    xs, ys = xs.tolist(), ys.tolist()
+    simplified = []
+    for index, (stroke, offset) in enumerate(zip(strokes, starts.tolist())):
+        if not valid[index]:
+            simplified.append(stroke)
+            continue
+        simplified.append([
+            dict(stroke[i - offset], x=xs[i], y=ys[i])
+            for i in kept_positions[bounds[index]:bounds[index + 1]]
+        ])
+    return simplified
+
+
+def _quantize(values: List[float], step: float) -> List[float]:
+    # Rounding again drops float noise like 0.30000000000000004
+    return [round(round(value / step) * step, 6) for value in values]
+
+
+def _simplify_python(coordinates: List[Dict[str, Any]], tolerance: float, step: float) -> List[Dict[str, Any]]:
+    try:
+        xs = [float(point["x"]) for point in coordinates]
+        ys = [float(point["y"]) for point in coordinates]
+    except (KeyError, TypeError, ValueError):
+        return coordinates
+    if not all(math.isfinite(value) for value in xs + ys):
+        return coordinates
+
+    indices = range(len(coordinates))
+    if step > 0:
+        xs, ys = _quantize(xs, step), _quantize(ys, step)
+        last = len(coordinates) - 1
+        indices = [i for i in indices if i == 0 or i == last or (xs[i], ys[i]) != (xs[i - 1], ys[i - 1])]
+        xs, ys = [xs[i] for i in indices], [ys[i] for i in indices]
+    if tolerance > 0 and len(xs) > 2:
+        kept = _rdp_python(xs, ys, tolerance)
+        indices = [indices[i] for i in kept]
+        xs, ys = [xs[i] for i in kept], [ys[i] for i in kept]
+    return [dict(coordinates[i], x=x, y=y) for i, x, y in zip(indices, xs, ys)]
+
+
+def simplify_strokes(
+    strokes: List[List[Dict[str, Any]]],
+    tolerance: Optional[float] = None,
+    step: Optional[float] = None,
+    use_numpy: Optional[bool] = None,
+) -> List[List[Dict[str, Any]]]:
+    """Quantize polylines' points and drop the ones within tolerance of them
+
+    The first and last points of each stroke are always kept. Points that
+    quantize onto the previous one are dropped. Strokes with coordinates
+    that aren't finite numbers are returned unchanged. Batches of at
+    least STROKE_SIMPLIFY_NUMPY_MIN_POINTS points use NumPy when it is
+    installed. Tolerance and step default to the configured settings.
+    """
+    tolerance = STROKE_SIMPLIFY_TOLERANCE if tolerance is None else tolerance
+    step = STROKE_QUANTIZE_STEP if step is None else step
+    todo = [index for index, stroke in enumerate(strokes) if len(stroke) >= 2]
+    if not todo:
+        return strokes
+    batch = [strokes[index] for index in todo]
+    points = sum(len(stroke) for stroke in batch)
+    if use_numpy is None:
+        use_numpy = numpy is not None and points >= STROKE_SIMPLIFY_NUMPY_MIN_POINTS
+    simplified = None
+    if use_numpy:
+        try:
+            simplified = _simplify_numpy(batch, tolerance, step)
+        except (KeyError, TypeError, ValueError):
+            # Some point isn't numeric; the per-stroke path leaves just that stroke alone
+            simplified = None
+    if simplified is None:
+        simplified = [_simplify_python(stroke, tolerance, step) for stroke in batch]
+
+    STROKE_POINTS_RECEIVED.inc(points)
+    STROKE_POINTS_KEPT.inc(sum(len(stroke) for stroke in simplified))
+    result = list(strokes)
+    for index, stroke in zip(todo, simplified):
+        result[index] = stroke
+    return result
+
+
+def simplify_coordinates(
+    coordinates: List[Dict[str, Any]],
+    tolerance: Optional[float] = None,
+    step: Optional[float] = None,
+    use_numpy: Optional[bool] = None,
+) -> List[Dict[str, Any]]:
+    """Simplify a single polyline, see simplify_strokes"""
+    return simplify_strokes([coordinates], tolerance, step, use_numpy)[0]
+
+
+def _simplifiable(drawing_data: Any) -> bool:
+    return (
+        isinstance(drawing_data, dict)
+        and drawing_data.get("tool") in SIMPLIFY_TOOLS
+        and isinstance(drawing_data.get("coordinates"), list)
+    )
+
+
+def simplify_drawing_data(drawing_data: Any) -> Any:
+    """Simplify live drawing data from a client, if simplification is enabled"""
+    if not SIMPLIFY_ENABLED or not _simplifiable(drawing_data):
+        return drawing_data
+    return dict(drawing_data, coordinates=simplify_coordinates(drawing_data["coordinates"]))
+
+
+def simplify_drawing_items(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Simplify the drawing data of drawing_batch items as one batch, e.g. after merging segments"""
+    if not SIMPLIFY_ENABLED:
+        return items
+    freehand = [item for item in items if _simplifiable(item["data"])]
+    simplified = simplify_strokes([item["data"]["coordinates"] for item in freehand])
+    for item, coordinates in zip(freehand, simplified):
+        item["data"] = dict(item["data"], coordinates=coordinates)
+    return items
+
+
+def simplify_elements(elements: List[DrawingElement]) -> List[DrawingElement]:
+    """Simplify freehand drawing elements before they are persisted"""
+    if not SIMPLIFY_ENABLED:
+        return elements
+    freehand = [index for index, element in enumerate(elements) if element.type in SIMPLIFY_TOOLS]
+    simplified = simplify_strokes([elements[index].coordinates for index in freehand])
+    elements = list(elements)
+    for index, coordinates in zip(freehand, simplified):
+        elements[index] = elements[index].copy(update={"coordinates": coordinates})
+    return elements
+
+
+def simplify_stroke_frame(frame: bytes) -> bytes:
+    """Re-encode a binary stroke frame with its points simplified, at the same scale"""
+    data = decode_stroke(frame)
+    if data.get("tool") not in SIMPLIFY_TOOLS:
+        return frame
+    return encode_stroke(simplify_drawing_data(data), scale=HEADER.unpack_from(frame)[2])
@@ -0,0 +1,73 @@
+import math
+import os
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+from .geometry import Bounds, element_bounds
+
+load_dotenv()
+
+# Side of a grid cell in canvas pixels; strokes are indexed by the cells they touch
+SPATIAL_CELL_SIZE = float(os.getenv("SPATIAL_CELL_SIZE", "1024"))
+# Elements touching more cells than this are indexed as large and match every query
+SPATIAL_MAX_ELEMENT_CELLS = int(os.getenv("SPATIAL_MAX_ELEMENT_CELLS", "64"))
+# Viewports covering more cells than this are matched on bounding boxes alone
+SPATIAL_MAX_QUERY_CELLS = int(os.getenv("SPATIAL_MAX_QUERY_CELLS", "1024"))
+
+LARGE_ELEMENT_CELL = "*"
+
+
+def parse_bbox(value: str) -> Bounds:
+    """Parse min_x,min_y,max_x,max_y"""
+    try:
+        min_x, min_y, max_x, max_y = (float(part) for part in value.split(","))
+    except ValueError:
+        raise ValueError("bbox must be min_x,min_y,max_x,max_y")
+    if not all(math.isfinite(v) for v in (min_x, min_y, max_x, max_y)) or min_x > max_x or min_y > max_y:
+        raise ValueError("bbox must be finite with min_x <= max_x and min_y <= max_y")
+    return min_x, min_y, max_x, max_y
+
+
+def grid_cells(bounds: Bounds, cell_size: float = SPATIAL_CELL_SIZE, limit: int = SPATIAL_MAX_ELEMENT_CELLS) -> Optional[List[str]]:
+    """Keys of the grid cells a box touches, or None if there are more than limit
+
+    Boxes with non-finite edges count as touching too many cells.
+    """
+    if not all(math.isfinite(edge / cell_size) for edge in bounds):
+        return None
+    first_x, last_x = math.floor(bounds[0] / cell_size), math.floor(bounds[2] / cell_size)
+    first_y, last_y = math.floor(bounds[1] / cell_size), math.floor(bounds[3] / cell_size)
+    # Count before building ranges, which can't be longer than a C ssize_t
+    if (last_x - first_x + 1) * (last_y - first_y + 1) > limit:
+        return None
+    return [f"{x}:{y}" for x in range(first_x, last_x + 1) for y in range(first_y, last_y + 1)]
+
+
+def spatial_fields(element: Dict[str, Any], cell_size: float = SPATIAL_CELL_SIZE) -> Dict[str, Any]:
+    """Bounding box and grid cells to store on a stroke document
+
+    Elements without points, like clear, get no cells and never match a
+    spatial query on their own.
+    """
+    bounds = element_bounds(element)
+    if bounds is None:
+        return {"cells": []}
+    cells = grid_cells(bounds, cell_size)
+    return {"bbox": list(bounds), "cells": cells if cells is not None else [LARGE_ELEMENT_CELL]}
+
+
+def spatial_filter(bounds: Bounds, cell_size: float = SPATIAL_CELL_SIZE) -> Dict[str, Any]:
+    """Strokes query matching elements whose bounding box intersects bounds
+
+    The cell match narrows the search through the grid index; the bbox
+    conditions drop strokes that only share a cell with the viewport.
+    """
+    query: Dict[str, Any] = {
+        "bbox.0": {"$lte": bounds[2]},
+        "bbox.1": {"$lte": bounds[3]},
+        "bbox.2": {"$gte": bounds[0]},
+        "bbox.3": {"$gte": bounds[1]},
+    }
+    cells = grid_cells(bounds, cell_size, SPATIAL_MAX_QUERY_CELLS)
+    if cells is not None:
+        query["cells"] = {"$in": cells + [LARGE_ELEMENT_CELL]}
+    return query
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from .simplify import simplify_drawing_items
+
+load_dotenv()
+
+# Default tick for new rooms in milliseconds, 0 relays every frame immediately
+DEFAULT_TICK_MS = int(os.getenv("WS_DRAWING_TICK_MS", "0"))
+MIN_TICK_MS = 5
+MAX_TICK_MS = 1000
+
+# Tools whose consecutive segments can be joined into one polyline
+MERGEABLE_TOOLS = {"pen", "eraser"}
+
+
+def _can_merge(previous: Dict[str, Any], current: Dict[str, Any]) -> bool:
+    """Check whether current continues the stroke in previous"""
+    prev_data, data = previous["data"], current["data"]
+    if data.get("tool") not in MERGEABLE_TOOLS or prev_data.get("tool") != data.get("tool"):
+        return False
+    if prev_data.get("style") != data.get("style"):
+        return False
+    prev_coords, coords = prev_data.get("coordinates") or [], data.get("coordinates") or []
+    return bool(prev_coords) and bool(coords) and prev_coords[-1] == coords[0]
+
+
+def merge_drawing_items(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Coalesce consecutive segments of the same stroke per sender
+
+    Items are {"user_id", "data", "timestamp"} dicts in arrival order. A
+    segment is only ever appended to its sender's latest item, so the
+    order of each sender's strokes is preserved.
+    """
+    merged: List[Dict[str, Any]] = []
+    last_by_sender: Dict[str, Dict[str, Any]] = {}
+    for item in items:
+        previous = last_by_sender.get(item["user_id"])
+        if previous is not None and _can_merge(previous, item):
+            # Skip the shared joint point
+            previous["data"]["coordinates"].extend(item["data"]["coordinates"][1:])
+            previous["timestamp"] = item["timestamp"]
+            continue
+        item = {
+            "user_id": item["user_id"],
+            "data": dict(item["data"], coordinates=list(item["data"].get("coordinates") or [])),
+            "timestamp": item["timestamp"],
+        }
+        merged.append(item)
+        last_by_sender[item["user_id"]] = item
+    return merged
+
+
+class RoomBatcher:
+    """Collects drawing_data for one room and flushes it once per tick"""
+
+    def __init__(self, whiteboard_id: str, tick_ms: int, flush: Callable[[str, List[Dict[str, Any]]], None]):
+        self.whiteboard_id = whiteboard_id
+        self.tick_ms = tick_ms
+        self._flush = flush
+        self._pending: List[Dict[str, Any]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def add(self, user_id: str, data: Dict[str, Any], timestamp: str):
+        """Queue drawing data for the next tick"""
+        self._pending.append({"user_id": user_id, "data": data, "timestamp": timestamp})
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.tick_ms / 1000, self.flush)
+
+    def flush(self):
+        """Send everything collected during the current tick"""
+        self._timer = None
+        if not self._pending:
+            return
+        items, self._pending = self._pending, []
+        # Segments joined into one polyline can be simplified as a whole
+        self._flush(self.whiteboard_id, simplify_drawing_items(merge_drawing_items(items)))
+
+    def close(self):
+        """Flush pending data and stop the timer"""
+        if self._timer is not None:
+            self._timer.cancel()
+        self.flush()
+
+
+class BatchingStats:
+    """Frames and bytes saved by tick batching"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.frames_in = 0
+        self.frames_unbatched = 0
+        self.frames_out = 0
+        self.bytes_unbatched = 0
+        self.bytes_out = 0
+
+    def record_incoming(self, encoded_size: int, recipients: int):
+        """Record a frame that would have been relayed individually"""
+        self.frames_in += 1
+        self.frames_unbatched += recipients
+        self.bytes_unbatched += encoded_size * recipients
+
+    def record_outgoing(self, encoded_size: int, recipients: int):
+        """Record a batched frame sent to some recipients"""
+        self.frames_out += recipients
+        self.bytes_out += encoded_size * recipients
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Totals and per-second savings since startup"""
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        frames_saved = self.frames_unbatched - self.frames_out
+        bytes_saved = self.bytes_unbatched - self.bytes_out
+        return {
+            "frames_in": self.frames_in,
+            "frames_unbatched": self.frames_unbatched,
+            "frames_out": self.frames_out,
+            "bytes_unbatched": self.bytes_unbatched,
+            "bytes_out": self.bytes_out,
+            "frames_saved": frames_saved,
+            "bytes_saved": bytes_saved,
+            "frames_saved_per_sec": frames_saved / elapsed,
+            "bytes_saved_per_sec": bytes_saved / elapsed,
+        }
@@ -0,0 +1,151 @@
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from typing import Any, Dict, List, Optional, Union
+
+# WebSocket subprotocols
+JSON_SUBPROTOCOL = "whiteboard.json"
+BINARY_SUBPROTOCOL = "whiteboard.bin.v1"
+SUBPROTOCOLS = (BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL)
+
+# Frame kinds
+FRAME_STROKE = 1  # client -> server
+FRAME_RELAYED_STROKE = 2  # server -> client, prefixed with the sender id
+
+# Header flags
+FLAG_WIDE_DELTAS = 0x01  # deltas are int32 instead of int16
+FLAG_HAS_COLOR = 0x02
+FLAG_HAS_WIDTH = 0x04
+
+TOOL_CODES = {"pen": 1, "eraser": 2, "line": 3, "rectangle": 4, "circle": 5, "clear": 6}
+TOOL_NAMES = {code: name for name, code in TOOL_CODES.items()}
+
+# Coordinates are stored as round(value * scale)
+DEFAULT_SCALE = 4
+
+# kind, tool, scale, flags, color (0xRRGGBB00), width (1/10 px), point count
+HEADER = struct.Struct("<BBBBIHH")
+FIRST_POINT = struct.Struct("<ii")
+RELAY_PREFIX = struct.Struct("<BB")
+
+INT16_MIN, INT16_MAX = -(2 ** 15), 2 ** 15 - 1
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class StrokeCodecError(ValueError):
+    """Raised for strokes that can't be encoded or malformed frames"""
+
+
+def _to_little_endian(values: array) -> array:
+    """Byte-swap an array in place on big-endian hosts"""
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def parse_subprotocol(requested: List[str]) -> Optional[str]:
+    """Pick the subprotocol to accept from a client's offer"""
+    for subprotocol in SUBPROTOCOLS:
+        if subprotocol in requested:
+            return subprotocol
+    return None
+
+
+def encode_stroke(data: Dict[str, Any], scale: int = DEFAULT_SCALE) -> bytes:
+    """Encode drawing data as a packed, delta-encoded stroke frame"""
+    tool = TOOL_CODES.get(data.get("tool"))
+    if tool is None:
+        raise StrokeCodecError(f"Unknown tool: {data.get('tool')!r}")
+
+    style = data.get("style") or {}
+    if set(style) - {"color", "width"}:
+        raise StrokeCodecError("Only color and width styles can be encoded")
+
+    flags = 0
+    color = 0
+    if "color" in style:
+        flags |= FLAG_HAS_COLOR
+        hex_color = str(style["color"]).lstrip("#")
+        try:
+            if len(hex_color) != 6:
+                raise ValueError(hex_color)
+            color = int(hex_color, 16) << 8
+        except ValueError:
+            raise StrokeCodecError(f"Only #rrggbb colors can be encoded: {style['color']!r}")
+    width = 0
+    if "width" in style:
+        flags |= FLAG_HAS_WIDTH
+        width = round(float(style["width"]) * 10)
+        if not 0 <= width <= 0xFFFF:
+            raise StrokeCodecError(f"Width out of range: {style['width']!r}")
+
+    coordinates = data.get("coordinates") or []
+    if len(coordinates) > 0xFFFF:
+        raise StrokeCodecError("Too many points in one stroke")
+    xs = [round(point["x"] * scale) for point in coordinates]
+    ys = [round(point["y"] * scale) for point in coordinates]
+    deltas = []
+    for i in range(1, len(coordinates)):
+        deltas.append(xs[i] - xs[i - 1])
+        deltas.append(ys[i] - ys[i - 1])
+    if deltas and not INT16_MIN <= min(deltas) <= max(deltas) <= INT16_MAX:
+        flags |= FLAG_WIDE_DELTAS
+
+    frame = bytearray(HEADER.pack(FRAME_STROKE, tool, scale, flags, color, width, len(coordinates)))
+    if coordinates:
+        frame += FIRST_POINT.pack(xs[0], ys[0])
+        frame += _to_little_endian(array("i" if flags & FLAG_WIDE_DELTAS else "h", deltas)).tobytes()
+    return bytes(frame)
+
+
+def stroke_frame_size(frame: Buffer) -> int:
+    """Validate a stroke frame header and return its expected length"""
+    if len(frame) < HEADER.size:
+        raise StrokeCodecError("Frame too short")
+    kind, tool, scale, flags, _, _, count = HEADER.unpack_from(frame)
+    if kind != FRAME_STROKE or tool not in TOOL_NAMES or scale == 0:
+        raise StrokeCodecError("Malformed stroke header")
+    if count == 0:
+        return HEADER.size
+    delta_size = 4 if flags & FLAG_WIDE_DELTAS else 2
+    return HEADER.size + FIRST_POINT.size + (count - 1) * 2 * delta_size
+
+
+def validate_stroke_frame(frame: Buffer):
+    """Check a client stroke frame without decoding its points"""
+    if len(frame) != stroke_frame_size(frame):
+        raise StrokeCodecError("Frame length doesn't match point count")
+
+
+def decode_stroke(frame: Buffer) -> Dict[str, Any]:
+    """Decode a stroke frame into the JSON drawing data shape"""
+    validate_stroke_frame(frame)
+    _, tool, scale, flags, color, width, count = HEADER.unpack_from(frame)
+
+    style: Dict[str, Any] = {}
+    if flags & FLAG_HAS_COLOR:
+        style["color"] = "#{:06x}".format(color >> 8)
+    if flags & FLAG_HAS_WIDTH:
+        style["width"] = width / 10
+
+    coordinates = []
+    if count:
+        x0, y0 = FIRST_POINT.unpack_from(frame, HEADER.size)
+        deltas = array("i" if flags & FLAG_WIDE_DELTAS else "h")
+        deltas.frombytes(bytes(frame[HEADER.size + FIRST_POINT.size:]))
+        _to_little_endian(deltas)
+        xs = accumulate(deltas[0::2], initial=x0)
+        ys = accumulate(deltas[1::2], initial=y0)
+        coordinates = [{"x": x / scale, "y": y / scale} for x, y in zip(xs, ys)]
+
+    return {"tool": TOOL_NAMES[tool], "coordinates": coordinates, "style": style}
+
+
+def relay_frame(user_id: str, frame: Buffer) -> bytes:
+    """Prefix a client stroke frame with its sender for relaying as-is"""
+    sender = user_id.encode("utf-8")
+    if len(sender) > 255:
+        raise StrokeCodecError("User id too long to relay")
+    return RELAY_PREFIX.pack(FRAME_RELAYED_STROKE, len(sender)) + sender + bytes(frame)
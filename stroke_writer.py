@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from pydantic import ValidationError
+from pymongo.errors import PyMongoError
+from pymongo.write_concern import WriteConcern
+from dotenv import load_dotenv
+from ..models.whiteboard import DrawingElement
+from ..database.mongodb import get_db
+from .metrics import REGISTRY
+from .structured_logging import RoomErrorAggregator
+from .whiteboard_service import assign_stroke_seqs, insert_stroke_documents, stroke_document
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Write-behind configuration
+PERSIST_LIVE_STROKES = os.getenv("PERSIST_LIVE_STROKES", "true").lower() == "true"
+STROKE_FLUSH_MAX_BATCH = int(os.getenv("STROKE_FLUSH_MAX_BATCH", "200"))
+STROKE_FLUSH_INTERVAL_MS = int(os.getenv("STROKE_FLUSH_INTERVAL_MS", "250"))
+STROKE_BUFFER_MAX_PENDING = int(os.getenv("STROKE_BUFFER_MAX_PENDING", "10000"))
+# Times a board's unwritten strokes are requeued after transient database errors before they are dropped
+STROKE_FLUSH_MAX_RETRIES = int(os.getenv("STROKE_FLUSH_MAX_RETRIES", "5"))
+
+# Durability of buffered stroke writes: w may be a number or "majority"
+_write_w = os.getenv("STROKE_WRITE_CONCERN_W", "1")
+STROKE_WRITE_CONCERN = WriteConcern(
+    w=int(_write_w) if _write_w.isdigit() else _write_w,
+    j=os.getenv("STROKE_WRITE_JOURNAL", "false").lower() == "true"
+)
+
+
+def drawing_data_to_element(drawing_data: Dict[str, Any]) -> Optional[DrawingElement]:
+    """Convert live drawing_data from the WebSocket into a DrawingElement"""
+    try:
+        return DrawingElement(
+            type=drawing_data.get("tool"),
+            coordinates=drawing_data.get("coordinates") or [],
+            style=drawing_data.get("style") or {}
+        )
+    except ValidationError:
+        return None
+
+
+class StrokeWriteBuffer:
+    """Buffers live strokes per board and persists them in batches
+
+    A board is flushed when it reaches max_batch pending strokes or when
+    the periodic flush runs, whichever comes first. Strokes are retried
+    only after transient database errors, and at most max_retries times.
+    A stroke keeps the seq it was given across retries, so a retry after
+    a write that partly succeeded stores nothing twice and leaves no gap.
+    """
+
+    def __init__(
+        self,
+        max_batch: int = STROKE_FLUSH_MAX_BATCH,
+        interval_ms: int = STROKE_FLUSH_INTERVAL_MS,
+        max_pending: int = STROKE_BUFFER_MAX_PENDING,
+        write_concern: WriteConcern = STROKE_WRITE_CONCERN,
+        max_retries: int = STROKE_FLUSH_MAX_RETRIES,
+    ):
+        self.max_batch = max_batch
+        self.interval_ms = interval_ms
+        self.max_pending = max_pending
+        self.write_concern = write_concern
+        self.max_retries = max_retries
+        self._pending: Dict[str, List[DrawingElement]] = {}
+        # Built stroke documents of a failed write, retried before anything newer
+        self._unwritten: Dict[str, List[dict]] = {}
+        self._attempts: Dict[str, int] = {}
+        # Awaited with (whiteboard_id, first_seq, last_seq) after each batch is stored
+        self.persist_hooks: List[Callable[[str, int, int], Awaitable[Any]]] = []
+        self._flushing: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.errors = RoomErrorAggregator(logger)
+
+        # Counters
+        self.buffered = 0
+        self.persisted = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def start(self):
+        """Start the periodic flush loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def add(self, whiteboard_id: str, element: DrawingElement):
+        """Buffer a stroke for a board without waiting for the write"""
+        pending = self._pending.setdefault(whiteboard_id, [])
+        pending.append(element)
+        self.buffered += 1
+
+        overflow = len(pending) - self.max_pending
+        if overflow > 0:
+            # The database is falling behind, shed the oldest strokes
+            del pending[:overflow]
+            self.dropped += overflow
+            self.errors.record(whiteboard_id, "stroke_buffer_full", f"dropped {overflow} oldest strokes")
+
+        if len(pending) >= self.max_batch:
+            self._schedule_flush(whiteboard_id)
+
+    def _schedule_flush(self, whiteboard_id: str):
+        """Start a flush for a board unless one is already running"""
+        if whiteboard_id not in self._flushing:
+            task = asyncio.create_task(self.flush(whiteboard_id))
+            self._flushing[whiteboard_id] = task
+            task.add_done_callback(lambda _: self._flushing.pop(whiteboard_id, None))
+
+    async def flush_board(self, whiteboard_id: str):
+        """Persist everything buffered for a board, one flush at a time
+
+        Waits for a flush of the board that is already running, then runs
+        the next one as the board's scheduled flush, so writes for a board
+        never overlap and keep their order.
+        """
+        running = self._flushing.get(whiteboard_id)
+        if running is not None:
+            await asyncio.wait([running])
+        if whiteboard_id in self._pending or whiteboard_id in self._unwritten:
+            self._schedule_flush(whiteboard_id)
+        task = self._flushing.get(whiteboard_id)
+        if task is not None:
+            await asyncio.wait([task])
+
+    async def flush(self, whiteboard_id: str):
+        """Persist everything buffered for a board"""
+        documents = self._unwritten.pop(whiteboard_id, [])
+        elements = self._pending.pop(whiteboard_id, None)
+        if elements:
+            documents += self._build(whiteboard_id, elements)
+        if not documents:
+            return
+
+        db = get_db()
+        while documents:
+            batch = documents[:self.max_batch]
+            try:
+                # Strokes retried from a failed write already hold their seqs
+                written = await assign_stroke_seqs(db, whiteboard_id, [document for document in batch if not document["seq"]])
+                rejected = await insert_stroke_documents(db, batch, self.write_concern) if written else []
+            except PyMongoError as e:
+                await self._retry_later(whiteboard_id, documents, e)
+                return
+            except Exception as e:
+                self.failures += 1
+                self.dropped += len(documents)
+                self._attempts.pop(whiteboard_id, None)
+                self.errors.record(whiteboard_id, "stroke_persist_failed", f"dropped {len(documents)} strokes: {e!r}")
+                await self._announce(whiteboard_id, documents)
+                return
+            if written:
+                self.persisted += len(batch) - len(rejected)
+                self.batches += 1
+                if rejected:
+                    self.dropped += len(rejected)
+                    self.errors.record(whiteboard_id, "stroke_rejected", f"the server rejected {len(rejected)} strokes")
+                # A rejected stroke's seq is never stored, so it leaves no gap to wait for
+                await self._announce(whiteboard_id, batch)
+            else:
+                logger.warning("Dropping %d strokes for missing whiteboard %s", len(batch), whiteboard_id)
+                self.dropped += len(batch)
+            documents = documents[len(batch):]
+        self._attempts.pop(whiteboard_id, None)
+
+    async def _announce(self, whiteboard_id: str, documents: List[dict]):
+        """Run the persist hooks for each run of consecutive seqs the documents were given"""
+        seqs = [document["seq"] for document in documents if document["seq"]]
+        runs: List[Tuple[int, int]] = []
+        for seq in seqs:
+            if runs and seq == runs[-1][1] + 1:
+                runs[-1] = (runs[-1][0], seq)
+            else:
+                runs.append((seq, seq))
+        for first_seq, last_seq in runs:
+            for hook in self.persist_hooks:
+                try:
+                    await hook(whiteboard_id, first_seq, last_seq)
+                except Exception as e:
+                    logger.error("Persist hook failed for whiteboard %s: %s", whiteboard_id, e)
+
+    def _build(self, whiteboard_id: str, elements: List[DrawingElement]) -> List[dict]:
+        """Stroke documents for elements, dropping any that can't be stored"""
+        built = []
+        for element in elements:
+            try:
+                # The seq is filled in when the batch is written
+                built.append(stroke_document(whiteboard_id, 0, element))
+            except Exception as e:
+                self.dropped += 1
+                self.errors.record(whiteboard_id, "stroke_invalid", f"dropped a {element.type} stroke: {e!r}")
+        return built
+
+    async def _retry_later(self, whiteboard_id: str, documents: List[dict], error: Exception):
+        """Keep unwritten strokes, seqs included, in front of anything newer, up to max_retries times"""
+        self.failures += 1
+        attempts = self._attempts.get(whiteboard_id, 0) + 1
+        if attempts > self.max_retries:
+            self._attempts.pop(whiteboard_id, None)
+            self.dropped += len(documents)
+            self.errors.record(
+                whiteboard_id, "stroke_persist_failed", f"dropped {len(documents)} strokes after {attempts} attempts: {error!r}"
+            )
+            # Clients drew these live; let them move past the seqs that will never be filled
+            await self._announce(whiteboard_id, documents)
+            return
+        self._attempts[whiteboard_id] = attempts
+        self.errors.record(whiteboard_id, "stroke_persist_failed", f"{len(documents)} strokes requeued: {error!r}")
+        self._unwritten[whiteboard_id] = documents
+
+    async def flush_all(self):
+        """Persist everything buffered for every board"""
+        # Let in-flight flushes finish first so strokes stay in order
+        if self._flushing:
+            await asyncio.gather(*self._flushing.values(), return_exceptions=True)
+        await asyncio.gather(*(self.flush(whiteboard_id) for whiteboard_id in {*self._pending, *self._unwritten}))
+
+    async def close(self):
+        """Stop the flush loop and persist anything still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_all()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_ms / 1000)
+            for whiteboard_id in {*self._pending, *self._unwritten}:
+                self._schedule_flush(whiteboard_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Buffer depth and write counters"""
+        return {
+            "pending": sum(map(len, self._pending.values())) + sum(map(len, self._unwritten.values())),
+            "boards": len({*self._pending, *self._unwritten}),
+            "buffered": self.buffered,
+            "persisted": self.persisted,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+        }
+
+
+stroke_buffer = StrokeWriteBuffer()
+REGISTRY.callback(
+    "whiteboard_stroke_buffer_pending", "Live strokes waiting to be persisted",
+    lambda: stroke_buffer.stats()["pending"]
+)
+REGISTRY.callback(
+    "whiteboard_stroke_buffer_strokes_total", "Live strokes by persistence outcome",
+    lambda: {("persisted",): stroke_buffer.persisted, ("dropped",): stroke_buffer.dropped},
+    kind="counter", labelnames=["outcome"]
+)
+REGISTRY.callback(
+    "whiteboard_stroke_buffer_flush_failures_total", "Stroke batches that failed to persist",
+    lambda: stroke_buffer.failures, kind="counter"
+)
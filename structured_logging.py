@@ -0,0 +1,227 @@
+import asyncio
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from .metrics import REGISTRY
+
+load_dotenv()
+
+# Log output: text (message then key=value fields) or json (one object per line)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Records waiting for the writer thread; more than this are dropped, not waited on
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Sampled hot-path logs: at most LOG_SAMPLE_BURST records per event per interval
+LOG_SAMPLE_INTERVAL_SECONDS = float(os.getenv("LOG_SAMPLE_INTERVAL_SECONDS", "10"))
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "20"))
+# Repeated errors in a room are summarized once per window
+ROOM_ERROR_WINDOW_SECONDS = float(os.getenv("ROOM_ERROR_WINDOW_SECONDS", "10"))
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Render a record with the fields passed through extra="""
+
+    def __init__(self, output: str = "text"):
+        super().__init__()
+        self.json = output == "json"
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+        message = record.getMessage()
+        if self.json:
+            payload = {
+                "ts": self.formatTime(record),
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": message,
+                **fields,
+            }
+            if record.exc_info:
+                payload["exc"] = self.formatException(record.exc_info)
+            return json.dumps(payload, default=str)
+        text = f"{self.formatTime(record)} {record.levelname} {record.name}: {message}"
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        return text
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hand records to the writer thread without ever blocking the caller
+
+    Records are queued as they are, so message formatting also happens
+    on the writer thread. When the queue is full the record is counted
+    and dropped.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+queue_handler: Optional[DroppingQueueHandler] = None
+
+REGISTRY.callback(
+    "whiteboard_log_records_dropped_total", "Log records dropped because the log queue was full",
+    lambda: queue_handler.dropped if queue_handler is not None else 0, kind="counter"
+)
+
+
+def configure_logging(level: str = LOG_LEVEL, output: str = LOG_FORMAT) -> DroppingQueueHandler:
+    """Route the root logger through a queue to a writer thread
+
+    The event loop only pays for putting a record on the queue; the
+    stream write happens on the listener's thread. Safe to call twice.
+    """
+    global _listener, queue_handler
+    if queue_handler is not None:
+        return queue_handler
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(StructuredFormatter(output))
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return queue_handler
+
+
+def stop_logging():
+    """Write out queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class SampledLogger:
+    """Let a burst of records per event through each interval, count the rest
+
+    The number suppressed is attached as a field to the next record that
+    gets through for the same event, so floods stay visible without
+    every record costing a write.
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float = LOG_SAMPLE_INTERVAL_SECONDS,
+                 burst: int = LOG_SAMPLE_BURST):
+        self.logger = logger
+        self.interval = interval
+        self.burst = burst
+        # event -> [window start, emitted, suppressed]
+        self._windows: Dict[str, List[float]] = {}
+
+    def log(self, level: int, event: str, msg: str, *args: Any, **fields: Any):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        window = self._windows.get(event)
+        suppressed = 0
+        if window is None or now - window[0] >= self.interval:
+            if window is not None:
+                suppressed = window[2]
+            window = self._windows[event] = [now, 0, 0]
+        if window[1] >= self.burst:
+            window[2] += 1
+            return
+        window[1] += 1
+        if suppressed:
+            fields["suppressed"] = int(suppressed)
+        self.logger.log(level, msg, *args, extra={"event": event, **fields})
+
+    def debug(self, event: str, msg: str, *args: Any, **fields: Any):
+        self.log(logging.DEBUG, event, msg, *args, **fields)
+
+    def info(self, event: str, msg: str, *args: Any, **fields: Any):
+        self.log(logging.INFO, event, msg, *args, **fields)
+
+    def warning(self, event: str, msg: str, *args: Any, **fields: Any):
+        self.log(logging.WARNING, event, msg, *args, **fields)
+
+    def error(self, event: str, msg: str, *args: Any, **fields: Any):
+        self.log(logging.ERROR, event, msg, *args, **fields)
+
+
+class RoomErrorAggregator:
+    """Collapse repeated errors of one kind in a room into a summary
+
+    The first error of a kind in a room is logged at once. Repeats within
+    the window are only counted, and logged as one line when it closes.
+    """
+
+    def __init__(self, logger: logging.Logger, window: float = ROOM_ERROR_WINDOW_SECONDS):
+        self.logger = logger
+        self.window = window
+        # (whiteboard_id, kind) -> [repeats, last detail]
+        self._errors: Dict[Tuple[str, str], List[Any]] = {}
+        self._window_started = 0.0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def record(self, whiteboard_id: Optional[str], kind: str, detail: Any = ""):
+        """Count an error for a room, logging it if it is the first in the window"""
+        whiteboard_id = whiteboard_id or "-"
+        now = time.monotonic()
+        if self._errors and now - self._window_started >= self.window:
+            self.flush()
+        entry = self._errors.get((whiteboard_id, kind))
+        if entry is not None:
+            entry[0] += 1
+            entry[1] = detail
+            return
+        if not self._errors:
+            self._window_started = now
+        self._errors[(whiteboard_id, kind)] = [0, detail]
+        self.logger.warning("%s in whiteboard %s: %s", kind, whiteboard_id, detail,
+                            extra={"event": kind, "whiteboard_id": whiteboard_id})
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No loop to flush from; the next record after the window does it
+            return
+        self._flush_handle = loop.call_later(self.window, self.flush)
+
+    def flush(self):
+        """Log a summary for every room with repeated errors and start a new window"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        errors, self._errors = self._errors, {}
+        for (whiteboard_id, kind), (repeats, detail) in errors.items():
+            if repeats:
+                self.logger.warning(
+                    "%s repeated %d times in whiteboard %s, last: %s", kind, repeats, whiteboard_id, detail,
+                    extra={"event": kind, "whiteboard_id": whiteboard_id, "repeats": repeats}
+                )
+
+    def pending(self) -> int:
+        """Rooms and kinds being counted in the current window"""
+        return len(self._errors)
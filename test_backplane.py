@@ -0,0 +1,341 @@
+import asyncio
+import json
+import time
+import pytest
+from app.services.backplane import (
+    InMemoryBackplane,
+    InMemoryHub,
+    RedisBackplane,
+    create_backplane,
+    decode_envelope,
+    encode_envelope,
+    read_reply,
+)
+from app.services.stroke_codec import BINARY_SUBPROTOCOL, encode_stroke
+from app.services.webrtc_service import WebRTCManager
+
+class FakeWebSocket:
+    """WebSocket stand-in that records sent frames"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        self.sent.append(data)
+
+    async def send_bytes(self, data: bytes):
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        pass
+
+    def messages(self):
+        return [json.loads(frame) for frame in self.sent if isinstance(frame, str)]
+
+def _resp(value) -> bytes:
+    """Encode a reply the way Redis would"""
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(_resp(item) for item in value)
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+class StandInRedis:
+    """Just enough of a Redis server for pub/sub and expiring presence hashes and sets"""
+
+    def __init__(self):
+        self.subscribers = {}
+        self.hashes = {}
+        self.sets = {}
+        self.expiry = {}
+        self.connections = set()
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for writer in list(self.connections):
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    def drop_subscribers(self):
+        """Cut every subscriber connection, as a Redis restart would"""
+        for writer in {writer for writers in self.subscribers.values() for writer in writers}:
+            writer.close()
+        self.subscribers.clear()
+
+    async def _handle(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                command = await read_reply(reader)
+                name, args = command[0].upper(), command[1:]
+                writer.write(self._execute(name, args, writer))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            for writers in self.subscribers.values():
+                writers.discard(writer)
+
+    def _execute(self, name: bytes, args, writer) -> bytes:
+        now = time.monotonic()
+        for key, deadline in list(self.expiry.items()):
+            if deadline <= now:
+                self._delete(key)
+        if name in (b"PING", b"AUTH", b"SELECT"):
+            return _resp("OK")
+        if name == b"SUBSCRIBE":
+            replies = []
+            for channel in args:
+                self.subscribers.setdefault(channel, set()).add(writer)
+                replies.append(_resp([b"subscribe", channel, 1]))
+            return b"".join(replies)
+        if name == b"UNSUBSCRIBE":
+            for channel in args:
+                self.subscribers.get(channel, set()).discard(writer)
+            return b"".join(_resp([b"unsubscribe", channel, 0]) for channel in args)
+        if name == b"PUBLISH":
+            channel, message = args
+            receivers = self.subscribers.get(channel, set())
+            for receiver in receivers:
+                receiver.write(_resp([b"message", channel, message]))
+            return _resp(len(receivers))
+        if name == b"HSET":
+            self.hashes.setdefault(args[0], {})[args[1]] = args[2]
+            return _resp(1)
+        if name == b"HDEL":
+            return _resp(1 if self.hashes.get(args[0], {}).pop(args[1], None) is not None else 0)
+        if name == b"HGETALL":
+            return _resp([item for pair in self.hashes.get(args[0], {}).items() for item in pair])
+        if name == b"SADD":
+            self.sets.setdefault(args[0], set()).update(args[1:])
+            return _resp(1)
+        if name == b"SREM":
+            self.sets.get(args[0], set()).difference_update(args[1:])
+            return _resp(1)
+        if name == b"SMEMBERS":
+            return _resp(sorted(self.sets.get(args[0], ())))
+        if name == b"PEXPIRE":
+            self.expiry[args[0]] = time.monotonic() + int(args[1]) / 1000
+            return _resp(1)
+        if name == b"DEL":
+            for key in args:
+                self._delete(key)
+            return _resp(len(args))
+        return b"-ERR unknown command\r\n"
+
+    def _delete(self, key: bytes):
+        self.hashes.pop(key, None)
+        self.sets.pop(key, None)
+        self.expiry.pop(key, None)
+
+async def _settle():
+    """Let published messages travel through the backplane"""
+    for _ in range(5):
+        await asyncio.sleep(0.01)
+
+async def _two_nodes(first: WebRTCManager, second: WebRTCManager):
+    """Put alice on the first node and bob on the second, in the same room"""
+    await first.start()
+    await second.start()
+    sockets = {"alice": FakeWebSocket(), "bob": FakeWebSocket()}
+    await first.connect(sockets["alice"], "alice")
+    await second.connect(sockets["bob"], "bob", subprotocol=BINARY_SUBPROTOCOL)
+    await first.join_whiteboard("alice", "board")
+    await second.join_whiteboard("bob", "board")
+    await _settle()
+    return sockets
+
+async def _assert_room_spans_nodes(first: WebRTCManager, second: WebRTCManager, sockets):
+    # Presence covers both nodes
+    assert sorted(await first.get_session_users("board")) == ["alice", "bob"]
+    assert [user["user_id"] for user in sockets["bob"].messages()[0]["users"]] == ["alice"]
+    assert sockets["alice"].messages()[-1]["type"] == "user_joined"
+
+    # Drawing data crosses nodes once and never echoes back to the sender
+    sockets["alice"].sent.clear()
+    await first.broadcast_drawing_data("alice", {"tool": "pen", "coordinates": [{"x": 1, "y": 2}]})
+    await _settle()
+    drawings = [message for message in sockets["bob"].messages() if message["type"] == "drawing_data"]
+    assert len(drawings) == 1 and drawings[0]["user_id"] == "alice"
+    assert sockets["alice"].sent == []
+
+    # Binary strokes are relayed raw to binary clients and decoded for JSON clients
+    await second.broadcast_binary_stroke("bob", encode_stroke({"tool": "pen", "coordinates": [{"x": 3, "y": 4}]}))
+    await _settle()
+    assert sockets["alice"].messages()[-1]["data"]["coordinates"] == [{"x": 3.0, "y": 4.0}]
+
+    # Signaling reaches a user connected to the other node
+    await second.handle_webrtc_signaling("bob", {"type": "offer", "target_user_id": "alice", "sdp": "x"})
+    await _settle()
+    assert sockets["alice"].messages()[-1]["source_user_id"] == "bob"
+
+    # Leaving removes the user from presence everywhere
+    await second.leave_whiteboard("bob")
+    await _settle()
+    assert await first.get_session_users("board") == ["alice"]
+    first.disconnect("alice")
+    second.disconnect("bob")
+
+def test_envelope_round_trip():
+    """Test that text and binary bodies survive the backplane framing"""
+    header, body = decode_envelope(encode_envelope({"k": "room", "w": "b"}, 'line one\n{"x":1}'))
+    assert header == {"k": "room", "w": "b"} and body == 'line one\n{"x":1}'
+    header, body = decode_envelope(encode_envelope({"k": "stroke"}, b"\x01\n\x00"))
+    assert header["k"] == "stroke" and body == b"\x01\n\x00"
+
+def test_create_backplane_from_url():
+    """Test that BACKPLANE_URL selects the implementation"""
+    assert isinstance(create_backplane("memory://"), InMemoryBackplane)
+    redis = create_backplane("redis://:secret@cache:6380/2")
+    assert (redis.host, redis.port, redis.db, redis.password) == ("cache", 6380, 2, "secret")
+    with pytest.raises(ValueError):
+        create_backplane("kafka://broker")
+
+@pytest.mark.asyncio
+async def test_in_memory_backplane_spans_managers():
+    """Test that managers sharing a hub behave like one room"""
+    hub = InMemoryHub()
+    first = WebRTCManager(InMemoryBackplane(hub), node_id="node-1")
+    second = WebRTCManager(InMemoryBackplane(hub), node_id="node-2")
+    sockets = await _two_nodes(first, second)
+    await _assert_room_spans_nodes(first, second, sockets)
+
+@pytest.mark.asyncio
+async def test_board_revocation_reaches_every_node():
+    """Test that an access change on one node drops cached access and room members on the others"""
+    hub = InMemoryHub()
+    first = WebRTCManager(InMemoryBackplane(hub), node_id="node-1")
+    second = WebRTCManager(InMemoryBackplane(hub), node_id="node-2")
+    invalidated = []
+    second.access_hooks.append(invalidated.append)
+    await first.start()
+    await second.start()
+    websocket = FakeWebSocket()
+    await second.connect(websocket, "b")
+    second.set_authorized("b", "board")
+    await second.join_whiteboard("b", "board")
+
+    await first.publish_access_change("board")
+    await asyncio.sleep(0.01)
+    assert invalidated == ["board"] and second.is_authorized("b", "board")
+
+    await first.publish_access_change("board", revoked=True)
+    await asyncio.sleep(0.01)
+    assert not second.is_authorized("b", "board")
+    assert second.get_user_session("b") is None
+    assert json.loads(websocket.sent[-1])["type"] == "access_revoked"
+    second.disconnect("b")
+
+@pytest.mark.asyncio
+async def test_room_settings_follow_the_board():
+    """Test that stored settings apply when a room opens and changes reach nodes already serving it"""
+    hub = InMemoryHub()
+    first = WebRTCManager(InMemoryBackplane(hub), node_id="node-1")
+    second = WebRTCManager(InMemoryBackplane(hub), node_id="node-2")
+    stored = {"board": {"tick_ms": 20, "rate_limits": {"drawing": [5, 10]}}}
+
+    async def load(whiteboard_id):
+        return stored.get(whiteboard_id)
+
+    second.settings_loader = load
+    await first.start()
+    await second.start()
+    await second.connect(FakeWebSocket(), "b")
+    await second.join_whiteboard("b", "board")
+    assert second.room_ticks["board"] == 20
+    assert second.rate_limits_for("board")["drawing"] == (5, 10)
+
+    first.set_room_tick("board", 0)
+    await first.publish_room_settings("board", {"tick_ms": 0, "rate_limits": {}})
+    await asyncio.sleep(0.01)
+    assert second.room_ticks["board"] == 0
+    assert "board" not in second.room_rate_limits
+    second.disconnect("b")
+
+@pytest.mark.asyncio
+async def test_redis_backplane_spans_managers():
+    """Test cross-node fan-out over the RESP client against a stand-in server"""
+    server = StandInRedis()
+    port = await server.start()
+    first = WebRTCManager(RedisBackplane(port=port, node_id="node-1"), node_id="node-1")
+    second = WebRTCManager(RedisBackplane(port=port, node_id="node-2"), node_id="node-2")
+    try:
+        sockets = await _two_nodes(first, second)
+        await _assert_room_spans_nodes(first, second, sockets)
+    finally:
+        await first.stop()
+        await second.stop()
+        await server.stop()
+
+@pytest.mark.asyncio
+async def test_redis_subscriber_resubscribes_after_disconnect():
+    """Test that room subscriptions come back after the connection drops"""
+    server = StandInRedis()
+    port = await server.start()
+    first = WebRTCManager(RedisBackplane(port=port, node_id="node-1"), node_id="node-1")
+    second = WebRTCManager(RedisBackplane(port=port, node_id="node-2"), node_id="node-2")
+    try:
+        sockets = await _two_nodes(first, second)
+        server.drop_subscribers()
+        await asyncio.sleep(0.3)
+
+        await first.broadcast_to_whiteboard("board", {"type": "ping"}, exclude_user="alice")
+        await _settle()
+        assert sockets["bob"].messages()[-1] == {"type": "ping"}
+        first.disconnect("alice")
+        second.disconnect("bob")
+    finally:
+        await first.stop()
+        await second.stop()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_redis_presence_expires_with_its_node():
+    """Test that a node's users outlive it only until its heartbeat lapses, or until it restarts"""
+    server = StandInRedis()
+    port = await server.start()
+    live = RedisBackplane(port=port, node_id="node-1", presence_ttl=0.3)
+    crashed = RedisBackplane(port=port, node_id="node-2", presence_ttl=0.3)
+    try:
+        for backplane in (live, crashed):
+            await backplane.start(lambda channel, data: None)
+        await live.set_presence("board", "alice", {"node": "node-1"})
+        await crashed.set_presence("board", "bob", {"node": "node-2"})
+        await crashed.set_presence("other", "carol", {"node": "node-2"})
+        await _settle()
+        assert sorted(await live.get_presence("board")) == ["alice", "bob"]
+
+        # A restart of the same node clears what its last run left behind
+        restarted = RedisBackplane(port=port, node_id="node-2", presence_ttl=0.3)
+        await restarted.start(lambda channel, data: None)
+        assert list(await live.get_presence("other")) == []
+        await restarted.close()
+
+        # Without heartbeats the dead node's entries expire; the live node's are kept
+        await crashed.set_presence("board", "bob", {"node": "node-2"})
+        await _settle()
+        crashed._heartbeat.cancel()
+        await asyncio.sleep(0.5)
+        assert list(await live.get_presence("board")) == ["alice"]
+        await _settle()
+        assert server.sets[b"whiteboard:presence-nodes:board"] == {b"node-1"}
+
+        # A clean shutdown removes a node's entries at once
+        await live.close()
+        await _settle()
+        assert await crashed.get_presence("board") == {}
+    finally:
+        await live.close()
+        await crashed.close()
+        await server.stop()
\ No newline at end of file
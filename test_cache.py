@@ -0,0 +1,97 @@
+import time
+import pytest
+from app.models.whiteboard import WhiteboardCreate, WhiteboardUpdate
+from app.services import whiteboard_service
+from app.services.cache import TTLCache
+
+def test_hits_and_misses_are_counted():
+    """Test that lookups update the hit-rate counters"""
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.get("alice") is None
+    cache.set("alice", "principal")
+    assert cache.get("alice") == "principal"
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+def test_least_recently_used_entry_is_evicted():
+    """Test that the cache stays within maxsize"""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.evictions == 1
+
+def test_entry_ttl_is_capped_by_the_cache_default():
+    """Test that a per-entry TTL can shorten but not extend an entry's life"""
+    cache = TTLCache(maxsize=10, ttl=0.05)
+    cache.set("short", 1, ttl=0.01)
+    cache.set("long", 2, ttl=3600)
+    time.sleep(0.06)
+
+    assert cache.get("short") is None
+    assert cache.get("long") is None
+    assert cache.expirations == 2
+
+def test_expired_ttl_is_not_stored():
+    """Test that entries for already expired tokens are never cached"""
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("alice", "principal", ttl=-1)
+    assert len(cache) == 0
+
+def test_invalidate_drops_entry():
+    """Test that invalidation forces the next lookup to miss"""
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("alice", "principal")
+    cache.invalidate("alice")
+    assert cache.get("alice") is None
+    assert cache.invalidations == 1
+
+@pytest.mark.asyncio
+async def test_board_access_is_cached_until_the_board_changes(monkeypatch):
+    """Test that ACL checks skip the database until an ACL write invalidates them"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    changes = []
+
+    async def record_change(whiteboard_id, revoked):
+        changes.append(revoked)
+
+    monkeypatch.setattr(whiteboard_service, "access_change_hooks", [record_change])
+    db = mongomock_motor.AsyncMongoMockClient()["acl_test"]
+    cache = whiteboard_service.board_access_cache
+    cache.clear()
+    board = await whiteboard_service.create_whiteboard(db, WhiteboardCreate(name="acl"), "owner")
+
+    access = await whiteboard_service.get_board_access(db, board.id)
+    assert access.can_edit("owner") and not access.can_edit("bob")
+    hits = cache.hits
+    assert await whiteboard_service.get_board_access(db, board.id) is access
+    assert cache.hits == hits + 1
+
+    await whiteboard_service.add_collaborator(db, board.id, "bob")
+    assert (await whiteboard_service.get_board_access(db, board.id)).can_edit("bob")
+    await whiteboard_service.update_whiteboard(db, board.id, WhiteboardUpdate(name="renamed"))
+    assert board.id not in cache._entries
+    await whiteboard_service.delete_whiteboard(db, board.id, "owner")
+    assert await whiteboard_service.get_board_access(db, board.id) is None
+    assert changes == [False, True]
+    assert await whiteboard_service.get_board_access(db, "not-an-id") is None
+
+@pytest.mark.asyncio
+async def test_board_access_load_racing_an_invalidation_is_not_cached(monkeypatch):
+    """Test that an ACL read from before a concurrent change isn't kept"""
+    whiteboard_service.board_access_cache.clear()
+    stale = whiteboard_service.BoardAccess("owner", frozenset())
+
+    async def load_during_change(db, whiteboard_id):
+        whiteboard_service.invalidate_board_access(whiteboard_id)
+        return stale
+
+    monkeypatch.setattr(whiteboard_service, "_load_board_access", load_during_change)
+    board_id = "0123456789abcdef01234567"
+    assert await whiteboard_service.get_board_access(None, board_id) is stale
+    assert whiteboard_service.board_access_cache.get(board_id) is None
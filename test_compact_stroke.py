@@ -0,0 +1,64 @@
+import json
+import bson
+import pytest
+from app.models.whiteboard import DrawingElement, WhiteboardCreate
+from app.services import compact_stroke
+from app.services.compact_stroke import CompactElement, decode_points, element_document, encode_points, pack_points
+from app.services.geometry import element_bounds
+from app.services.serialization import dumps
+
+def pen(*points):
+    return DrawingElement(type="pen", coordinates=[{"x": x, "y": y} for x, y in points], style={"width": 2})
+
+def stored(document):
+    """A document as the driver returns it"""
+    return bson.decode(bson.encode(document))
+
+def test_points_round_trip_exactly():
+    """Test that float32 is only used when every coordinate survives it"""
+    assert pack_points([{"x": 1, "y": 2.5}, {"x": -3, "y": 4096}]).typecode == "f"
+    assert pack_points([{"x": 0.1, "y": 2}]).typecode == "d"
+    assert pack_points([{"x": 1e300, "y": 0}]).typecode == "d"
+    for points in ([(1, 2.5), (-3, 4096)], [(0.1, 1 / 3)]):
+        element = CompactElement.from_document(stored(element_document(pen(*points))))
+        assert element.coordinates == pen(*points).coordinates
+    with pytest.raises(ValueError):
+        decode_points(b"q" + encode_points(pack_points([{"x": 1, "y": 2}]))[1:])
+
+def test_points_with_other_fields_stay_as_dicts():
+    """Test that points carrying more than x and y are stored and served unchanged"""
+    element = DrawingElement(type="pen", coordinates=[{"x": 1, "y": 2, "p": 0.5}])
+    document = element_document(element)
+    assert "points" not in document
+    assert CompactElement.from_document(stored(document)).coordinates == [{"x": 1, "y": 2, "p": 0.5}]
+
+def test_packed_documents_have_bounds():
+    """Test that compaction and spatial indexing read packed points"""
+    document = stored(element_document(pen((0, 0), (10, 4))))
+    assert element_bounds(document) == (-1, -1, 11, 5)
+    assert element_bounds(stored(element_document(DrawingElement(type="clear", coordinates=[])))) is None
+
+def test_legacy_documents_and_json_shape(monkeypatch):
+    """Test that array documents still load and both serialize like DrawingElement"""
+    monkeypatch.setattr(compact_stroke, "STROKE_PACKED_POINTS", False)
+    legacy = stored(dict(element_document(pen((1, 2), (3, 4))), seq=7))
+    assert "coordinates" in legacy
+    element = CompactElement.from_document(legacy)
+    assert element.point_count == 2
+    assert json.loads(dumps({"elements": [element]})) == {"elements": [pen((1, 2), (3, 4)).copy(update={"seq": 7}).dict()]}
+
+@pytest.mark.asyncio
+async def test_board_loads_compact_elements():
+    """Test that stored strokes come back compact from the service"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from app.services.whiteboard_service import append_drawing_elements, create_whiteboard, get_element_delta
+
+    db = mongomock_motor.AsyncMongoMockClient()["compact_test"]
+    board = await create_whiteboard(db, WhiteboardCreate(name="packed"), "owner")
+    await append_drawing_elements(db, board.id, [pen((0, 0), (1.5, 2)), pen((0.1, 0.2), (5, 5))])
+    stroke = await db.strokes.find_one({"seq": 1})
+    assert "coordinates" not in stroke and stroke["points"][0:1] == b"f"
+
+    delta = await get_element_delta(db, board.id)
+    assert all(isinstance(element, CompactElement) for element in delta.elements)
+    assert json.loads(dumps(delta.dict()))["elements"][1]["coordinates"] == [{"x": 0.1, "y": 0.2}, {"x": 5.0, "y": 5.0}]
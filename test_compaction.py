@@ -0,0 +1,118 @@
+import bson
+import pytest
+from bson import ObjectId
+from app.models.whiteboard import DrawingElement, WhiteboardCreate
+from app.services import compaction_service
+from app.services.compact_stroke import element_document
+from app.services.compaction_service import (
+    CompactionWorker,
+    chunk_elements,
+    compact_elements,
+    compact_whiteboard,
+    find_compaction_candidates,
+)
+from app.services.sharding import ShardMap, rendezvous_owner
+
+def stroke(seq, points=2):
+    element = DrawingElement(type="pen", coordinates=[{"x": i + 0.1, "y": i} for i in range(points)], style={"width": 2})
+    return dict(element_document(element), seq=seq)
+
+def element(seq, type, *points, width=2):
+    return {"type": type, "coordinates": [{"x": x, "y": y} for x, y in points], "style": {"width": width}, "seq": seq}
+
+def seqs(elements):
+    return [element["seq"] for element in elements]
+
+def test_compaction_starts_at_the_last_clear():
+    """Test that everything before the last clear goes and the clear itself stays"""
+    elements = [
+        element(1, "pen", (0, 0), (5, 5)),
+        element(2, "clear"),
+        element(3, "pen", (0, 0), (5, 5)),
+        element(4, "clear"),
+        element(5, "pen", (1, 1), (2, 2)),
+    ]
+    assert seqs(compact_elements(elements)) == [4, 5]
+    assert seqs(compact_elements(elements[:1])) == [1]
+
+def test_erasers_that_touch_nothing_are_dropped():
+    """Test that an eraser only survives if it overlaps something drawn before it"""
+    elements = [
+        element(1, "eraser", (0, 0), (5, 5)),
+        element(2, "pen", (0, 0), (10, 10)),
+        element(3, "eraser", (500, 500), (510, 510)),
+        element(4, "eraser", (8, 8), (20, 20)),
+        element(5, "clear"),
+        element(6, "eraser", (0, 0), (5, 5)),
+    ]
+    assert seqs(compact_elements(elements[:4])) == [2, 4]
+    assert seqs(compact_elements(elements)) == [5]
+
+def test_circles_are_bounded_by_their_radius():
+    """Test that a circle covers its whole disc, not just its two points"""
+    circle = element(1, "circle", (0, 0), (100, 0))
+    inside_circle = element(2, "eraser", (0, 90), (0, 95), width=0)
+    outside_circle = element(3, "eraser", (0, 110), (0, 120), width=0)
+    assert seqs(compact_elements([circle, inside_circle, outside_circle])) == [1, 2]
+
+def test_chunks_are_split_by_encoded_size():
+    """Test that snapshot chunks stay under the byte budget as well as the element count"""
+    elements = [stroke(seq, points=1000) for seq in range(1, 11)]
+    size = len(bson.encode(elements[0]))
+    chunks = chunk_elements(elements, max_bytes=3 * size, max_count=1000)
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+    assert [element["seq"] for chunk in chunks for element in chunk] == list(range(1, 11))
+
+    assert [len(chunk) for chunk in chunk_elements(elements, max_bytes=10 ** 9, max_count=4)] == [4, 4, 2]
+    # An element over the budget still gets a chunk of its own
+    assert [len(chunk) for chunk in chunk_elements(elements[:2], max_bytes=1)] == [1, 1]
+    assert chunk_elements([]) == []
+
+async def busy_board(db, strokes=4):
+    from app.services.whiteboard_service import append_drawing_elements, create_whiteboard
+    board = await create_whiteboard(db, WhiteboardCreate(name="busy"), "owner")
+    pen = DrawingElement(type="pen", coordinates=[{"x": 0, "y": 0}, {"x": 1, "y": 1}], style={"width": 2})
+    await append_drawing_elements(db, board.id, [pen] * strokes)
+    return board.id
+
+@pytest.mark.asyncio
+async def test_compaction_that_loses_the_swap_leaves_no_trace(monkeypatch):
+    """Test that a compaction beaten by another one removes its chunks and changes nothing"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    db = mongomock_motor.AsyncMongoMockClient()["compaction_test"]
+    board_id = await busy_board(db)
+    winner = ObjectId()
+
+    load_previous = compaction_service.get_snapshot_elements
+    async def raced(db, snapshot_id):
+        # Another worker switches the board to its snapshot while this one works
+        await db.whiteboards.update_one({"_id": ObjectId(board_id)}, {"$set": {"snapshot_id": winner, "snapshot_seq": 4}})
+        return await load_previous(db, snapshot_id)
+    monkeypatch.setattr(compaction_service, "get_snapshot_elements", raced)
+
+    assert await compact_whiteboard(db, board_id) is None
+    whiteboard = await db.whiteboards.find_one({"_id": ObjectId(board_id)})
+    assert whiteboard["snapshot_id"] == winner
+    assert whiteboard["strokes_since_snapshot"] == 4
+    assert await db.snapshot_chunks.count_documents({}) == 0
+
+@pytest.mark.asyncio
+async def test_candidates_come_from_the_counter_and_the_shard_map(monkeypatch):
+    """Test that busy boards are found by their counter and only their owner compacts them"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    db = mongomock_motor.AsyncMongoMockClient()["compaction_test"]
+    busy = compaction_service.COMPACTION_MIN_NEW_STROKES
+    board_id = await busy_board(db, strokes=busy)
+    quiet_id = await busy_board(db, strokes=1)
+    assert await find_compaction_candidates(db) == [board_id]
+    monkeypatch.setattr(compaction_service, "get_db", lambda: db)
+
+    nodes = {"a": "", "b": ""}
+    owner = rendezvous_owner(board_id, nodes)
+    other = "b" if owner == "a" else "a"
+    assert await CompactionWorker(shard_map=ShardMap(nodes, other)).run_once() == 0
+    assert await CompactionWorker(shard_map=ShardMap(nodes, owner)).run_once() == 1
+
+    whiteboard = await db.whiteboards.find_one({"_id": ObjectId(board_id)})
+    assert (whiteboard["snapshot_seq"], whiteboard["strokes_since_snapshot"]) == (busy, 0)
+    assert await find_compaction_candidates(db, min_new_strokes=1) == [quiet_id]
\ No newline at end of file
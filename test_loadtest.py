@@ -0,0 +1,14 @@
+import pytest
+from benchmarks.loadtest import Scenario, run_scenario
+
+pytest.importorskip("mongomock_motor")
+
+def test_small_load_run_delivers_strokes():
+    """Test that a tiny scenario relays every drawer's strokes to the others"""
+    result = run_scenario(Scenario(rooms=2, drawers=3, rate=20, duration=1.5, warmup=0.5, binary=True))
+    summary = result.summary()
+
+    assert result.strokes_sent > 0
+    assert summary["delivery_ratio"] > 0.8
+    assert summary["latency_ms"]["p50"] < 1000
+    assert summary["server_queue_drops"] == 0
@@ -0,0 +1,68 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.services.metrics import DB_OPERATION_SECONDS, HTTP_REQUEST_SECONDS, MetricsMiddleware, Registry, timed_db_operation
+
+def test_counter_and_histogram_exposition():
+    """Test that samples render in the Prometheus text format"""
+    registry = Registry()
+    messages = registry.counter("ws_messages_total", "Messages", ["type"])
+    latency = registry.histogram("op_seconds", "Latency", buckets=(0.1, 1.0))
+    registry.callback("rooms", "Rooms", lambda: 3)
+    messages.labels("drawing_data").inc()
+    messages.labels("drawing_data").inc(2)
+    messages.labels('say "hi"').inc()
+    for value in (0.05, 0.1, 0.5, 5):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE ws_messages_total counter" in lines
+    assert 'ws_messages_total{type="drawing_data"} 3' in lines
+    assert 'ws_messages_total{type="say \\"hi\\""} 1' in lines
+    assert 'op_seconds_bucket{le="0.1"} 2' in lines
+    assert 'op_seconds_bucket{le="1.0"} 3' in lines
+    assert 'op_seconds_bucket{le="+Inf"} 4' in lines
+    assert "op_seconds_count 4" in lines
+    assert "rooms 3" in lines
+
+def test_labels_must_match():
+    """Test that a wrong label count is rejected"""
+    registry = Registry()
+    counter = registry.counter("events_total", "Events", ["kind"])
+    with pytest.raises(ValueError):
+        counter.labels("a", "b")
+    with pytest.raises(ValueError):
+        registry.counter("events_total", "Events again")
+
+@pytest.mark.asyncio
+async def test_timed_db_operation_records_outcome():
+    """Test that service functions are timed separately on success and failure"""
+    @timed_db_operation
+    async def lookup(fail: bool):
+        if fail:
+            raise RuntimeError("boom")
+        return 1
+
+    assert await lookup(False) == 1
+    with pytest.raises(RuntimeError):
+        await lookup(True)
+    operation = f"{__name__.rsplit('.', 1)[-1]}.lookup"
+    assert sum(DB_OPERATION_SECONDS.labels(operation, "ok").counts) == 1
+    assert sum(DB_OPERATION_SECONDS.labels(operation, "error").counts) == 1
+
+def test_middleware_labels_route_templates():
+    """Test that request latency is labelled by route, not raw path"""
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/boards/{board_id}")
+    async def board(board_id: str):
+        return {"id": board_id}
+
+    client = TestClient(app)
+    client.get("/boards/1")
+    client.get("/boards/2")
+    client.get("/missing")
+
+    assert sum(HTTP_REQUEST_SECONDS.labels("GET", "/boards/{board_id}", 200).counts) == 2
+    assert sum(HTTP_REQUEST_SECONDS.labels("GET", "unmatched", 404).counts) == 1
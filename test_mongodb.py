@@ -0,0 +1,44 @@
+import pytest
+from app.database import migrations, mongodb
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["mongodb_test"]
+    monkeypatch.setattr(mongodb, "db", database)
+    return database
+
+@pytest.mark.asyncio
+async def test_indexes_are_created_through_the_async_driver(db):
+    """Test that index creation awaits the driver and makes stroke seqs unique per board"""
+    await mongodb.create_indexes()
+    assert mongodb.get_db() is db
+
+    strokes = await db.strokes.index_information()
+    assert strokes["whiteboard_id_1_seq_1"]["unique"]
+    assert "strokes_since_snapshot_1" in await db.whiteboards.index_information()
+    assert (await db.users.index_information())["username_1"]["unique"]
+
+@pytest.mark.asyncio
+async def test_migrations_move_embedded_elements(db):
+    """Test that the async migrations split embedded elements and can be re-run"""
+    await db.whiteboards.insert_one({
+        "name": "old",
+        "stroke_seq": 0,
+        "elements": [
+            {"type": "pen", "coordinates": [{"x": 0, "y": 0}, {"x": 4, "y": 4}], "style": {"width": 2}},
+            {"type": "clear", "coordinates": [], "style": {}},
+        ],
+    })
+    assert await migrations.split_embedded_elements(db) == 1
+    assert await migrations.split_embedded_elements(db) == 0
+    assert await migrations.index_stroke_bounds(db) == 2
+    assert await migrations.count_strokes_since_snapshot(db) == 1
+
+    whiteboard = await db.whiteboards.find_one({})
+    assert "elements" not in whiteboard
+    assert (whiteboard["stroke_seq"], whiteboard["strokes_since_snapshot"]) == (2, 2)
+    strokes = [stroke async for stroke in db.strokes.find({}).sort("seq", 1)]
+    assert [(stroke["seq"], stroke["type"]) for stroke in strokes] == [(1, "pen"), (2, "clear")]
+    assert strokes[0]["bbox"] == [-1, -1, 5, 5]
\ No newline at end of file
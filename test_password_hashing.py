@@ -0,0 +1,44 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from app.services import auth_service
+from app.services.auth_service import hash_password, verify_and_update_password
+
+@pytest.mark.asyncio
+async def test_hashing_does_not_block_the_event_loop():
+    """Test that other coroutines keep running while bcrypt works"""
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.001)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    hashed = await hash_password("correct horse")
+    task.cancel()
+
+    assert ticks > 1
+    assert (await verify_and_update_password("correct horse", hashed))[0]
+
+@pytest.mark.asyncio
+async def test_outdated_cost_factor_is_rehashed(monkeypatch):
+    """Test that a hash made with other rounds comes back with a replacement"""
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("secret")
+    monkeypatch.setattr(auth_service, "pwd_context", CryptContext(schemes=["bcrypt"], bcrypt__rounds=5))
+
+    verified, new_hash = await verify_and_update_password("secret", old_hash)
+    assert verified
+    assert new_hash.startswith("$2b$05$")
+    assert await verify_and_update_password("wrong", old_hash) == (False, None)
+
+@pytest.mark.asyncio
+async def test_password_queue_is_bounded(monkeypatch):
+    """Test that work past the pending cap is refused instead of queued"""
+    monkeypatch.setattr(auth_service, "PASSWORD_HASH_MAX_PENDING", 0)
+    with pytest.raises(HTTPException) as exc_info:
+        await hash_password("secret")
+    assert exc_info.value.status_code == 503
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import pytest
+from app.services.rate_limit import (
+    ADMIT,
+    DISCONNECT,
+    DROP,
+    HOLD,
+    POLICY_COALESCE,
+    POLICY_DISCONNECT,
+    POLICY_DROP,
+    InboundThrottle,
+    TokenBucket,
+    message_category,
+    parse_limits,
+)
+from app.services.webrtc_service import CLOSE_POLICY_VIOLATION, WebRTCManager
+
+class FakeWebSocket:
+    """Minimal WebSocket stand-in that records sent frames"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        self.close_code = code
+
+LIMITS = {"drawing": (20.0, 2.0), "other": (1.0, 1.0)}
+
+def pen(x):
+    return {"tool": "pen", "coordinates": [{"x": x, "y": 0}, {"x": x + 1, "y": 0}],
+            "style": {"color": "#000000", "width": 2}}
+
+def test_parse_limits():
+    """Test that limits parse as rate:burst, with burst defaulting to the rate"""
+    assert parse_limits("drawing=120:240, session=5") == {"drawing": (120.0, 240.0), "session": (5.0, 5.0)}
+    with pytest.raises(ValueError):
+        parse_limits("strokes=10:20")
+    with pytest.raises(ValueError):
+        parse_limits("drawing=0:10")
+
+def test_message_category():
+    """Test that message types map to their buckets"""
+    assert message_category("drawing_data") == "drawing"
+    assert message_category("ice_candidate") == "signaling"
+    assert message_category("join_session") == "session"
+    assert message_category(None) == "other"
+
+def test_token_bucket_refills():
+    """Test that a bucket allows a burst, then refills at its rate"""
+    bucket = TokenBucket(rate=1000, burst=2)
+    assert bucket.take() and bucket.take()
+    assert not bucket.take()
+    assert 0 < bucket.wait_time() <= 0.001
+    bucket.updated -= 0.01
+    assert bucket.take()
+
+def test_drop_policy_drops_over_limit():
+    """Test that messages over the burst are dropped and counted once per episode"""
+    throttle = InboundThrottle("u1", POLICY_DROP)
+    decisions = [throttle.admit("drawing", LIMITS) for _ in range(4)]
+    assert decisions == [ADMIT, ADMIT, DROP, DROP]
+    assert throttle.dropped == 2
+    assert throttle.episodes == 1
+
+def test_unlisted_category_uses_other_limit():
+    """Test that categories missing from the limits fall back to other"""
+    throttle = InboundThrottle("u1", POLICY_DISCONNECT)
+    assert throttle.admit("session", LIMITS) == ADMIT
+    assert throttle.admit("session", LIMITS) == DISCONNECT
+
+@pytest.mark.asyncio
+async def test_coalesce_policy_releases_merged_drawing():
+    """Test that held segments of a stroke are relayed as one item when tokens return"""
+    throttle = InboundThrottle("u1", POLICY_COALESCE)
+    released = []
+    assert throttle.admit("drawing", LIMITS) == ADMIT
+    assert throttle.admit("drawing", LIMITS) == ADMIT
+    for x in (1, 2):
+        assert throttle.admit("drawing", LIMITS) == HOLD
+        data = pen(x)
+        data["coordinates"][0]["x"] = x  # join the segments end to start
+        throttle.hold(data, released.append)
+    assert throttle.admit("other", LIMITS) == ADMIT
+    assert throttle.admit("other", LIMITS) == DROP
+    assert throttle.pending == 1
+    await asyncio.sleep(0.1)
+    assert throttle.pending == 0
+    assert len(released) == 1
+    assert len(released[0]) == 1
+    assert len(released[0][0]["data"]["coordinates"]) == 3
+    throttle.close()
+
+@pytest.mark.asyncio
+async def test_manager_room_limits_and_notification():
+    """Test that room overrides apply and the client hears about throttling once"""
+    manager = WebRTCManager()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, "u1")
+    await manager.join_whiteboard("u1", "wb1")
+    with pytest.raises(ValueError):
+        manager.set_room_rate_limits("wb1", {"strokes": (1.0, 1.0)})
+    manager.set_room_rate_limits("wb1", {"drawing": (1.0, 1.0)})
+    assert manager.rate_limits_for("wb1")["drawing"] == (1.0, 1.0)
+    assert manager.rate_limits_for("wb2")["signaling"] == manager.rate_limits_for("wb1")["signaling"]
+    assert manager.throttle_message("u1", "drawing") == ADMIT
+    assert manager.throttle_message("u1", "drawing") == HOLD
+    assert manager.throttle_message("u1", "drawing") == HOLD
+    await asyncio.sleep(0.01)
+    notices = [json.loads(frame) for frame in websocket.sent if "rate_limited" in frame]
+    assert notices == [{"type": "rate_limited", "category": "drawing", "action": "hold",
+                        "retry_after_ms": notices[0]["retry_after_ms"]}]
+    assert manager.get_throttle_stats()["total_throttled"] == 2
+    manager.set_room_rate_limits("wb1", {})
+    assert "wb1" not in manager.room_rate_limits
+    manager.disconnect("u1")
+    assert "u1" not in manager.throttles
+
+@pytest.mark.asyncio
+async def test_manager_disconnect_policy_closes_connection():
+    """Test that the disconnect policy ends the connection with a policy violation"""
+    manager = WebRTCManager()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, "u1")
+    manager.throttles["u1"] = InboundThrottle("u1", POLICY_DISCONNECT)
+    manager.set_room_rate_limits("wb1", {"signaling": (1.0, 1.0)})
+    await manager.join_whiteboard("u1", "wb1")
+    assert manager.throttle_message("u1", "signaling") == ADMIT
+    assert manager.throttle_message("u1", "signaling") == DISCONNECT
+    await asyncio.sleep(0.01)
+    assert websocket.closed
+    assert websocket.close_code == CLOSE_POLICY_VIOLATION
+    assert manager.rate_limit_disconnects == 1
@@ -0,0 +1,25 @@
+from app.serve import Supervisor, worker_nodes
+from app.services.sharding import ShardMap, parse_nodes
+
+def test_workers_form_a_shard_map():
+    """Test that each worker gets its own node in a shared map"""
+    supervisor = Supervisor(workers=3, host="127.0.0.1", port=8000, worker_base_port=8001,
+                            public_host="wb.example.com", db_pool_size=20)
+    envs = [supervisor.worker_env(index) for index in range(3)]
+
+    assert [env["NODE_ID"] for env in envs] == ["worker-0", "worker-1", "worker-2"]
+    assert all(env["MONGO_MAX_POOL_SIZE"] == "20" for env in envs)
+    nodes = parse_nodes(envs[0]["WHITEBOARD_NODES"])
+    assert nodes == worker_nodes(3, "ws", "wb.example.com", 8001)
+    assert nodes["worker-2"] == "ws://wb.example.com:8003"
+
+    # Every board is hosted by exactly one worker
+    maps = [ShardMap(parse_nodes(env["WHITEBOARD_NODES"]), env["NODE_ID"]) for env in envs]
+    for board in ("a", "b", "c", "d"):
+        assert sum(shards.is_local(board) for shards in maps) == 1
+
+def test_unpinned_workers_share_rooms():
+    """Test that without worker ports no worker redirects"""
+    supervisor = Supervisor(workers=2, host="127.0.0.1", port=8000, worker_base_port=None, public_host="localhost")
+    assert "WHITEBOARD_NODES" not in supervisor.worker_env(0)
+    assert "MONGO_MAX_POOL_SIZE" not in supervisor.worker_env(0)
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import pytest
+from app.services import webrtc_service
+from app.services.backplane import InMemoryBackplane, InMemoryHub
+from app.services.sharding import ShardMap, parse_nodes, rendezvous_owner
+from app.services.webrtc_service import CLOSE_MIGRATED, WebRTCManager
+
+class FakeWebSocket:
+    """WebSocket stand-in that records sent frames"""
+
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        self.sent.append(data)
+
+    async def send_bytes(self, data: bytes):
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+BOARDS = [f"board-{i}" for i in range(2000)]
+
+def test_parse_nodes():
+    """Test that node lists keep their client-facing URLs"""
+    assert parse_nodes("a=ws://10.0.0.1:8000/, b ,") == {"a": "ws://10.0.0.1:8000", "b": ""}
+
+def test_removing_a_node_only_moves_its_boards():
+    """Test that rendezvous hashing keeps other boards where they are"""
+    before = {board: rendezvous_owner(board, ["a", "b", "c"]) for board in BOARDS}
+    after = {board: rendezvous_owner(board, ["a", "b"]) for board in BOARDS}
+
+    moved = [board for board in BOARDS if before[board] != after[board]]
+    assert moved and all(before[board] == "c" for board in moved)
+    assert 500 < sum(owner == "a" for owner in before.values()) < 850
+
+def test_redirect_only_to_reachable_owner():
+    """Test that boards stay local when affinity is off or the owner has no URL"""
+    assert ShardMap({}, "a").redirect_for("board-1") is None
+
+    shards = ShardMap({"a": "ws://a", "b": "ws://b"}, "a")
+    remote = next(board for board in BOARDS if shards.owner(board) == "b")
+    assert shards.redirect_for(remote) == {"node": "b", "url": "ws://b"}
+
+    shards.update({"a": "ws://a", "b": ""})
+    assert shards.redirect_for(remote) is None
+
+@pytest.mark.asyncio
+async def test_shard_map_change_hands_off_rooms(monkeypatch):
+    """Test that a published map change moves rooms on every node"""
+    monkeypatch.setattr(webrtc_service, "ROOM_HANDOFF_GRACE_SECONDS", 0.01)
+    hub = InMemoryHub()
+    first = WebRTCManager(InMemoryBackplane(hub), node_id="a", shard_map=ShardMap({"a": "ws://a"}, "a"))
+    second = WebRTCManager(InMemoryBackplane(hub), node_id="b", shard_map=ShardMap({"a": "ws://a"}, "b"))
+    await first.start()
+    await second.start()
+    flushed = []
+
+    async def flush(whiteboard_id):
+        flushed.append(whiteboard_id)
+
+    first.handoff_hooks.append(flush)
+    moving = next(board for board in BOARDS if rendezvous_owner(board, ["a", "b"]) == "b")
+    staying = next(board for board in BOARDS if rendezvous_owner(board, ["a", "b"]) == "a")
+    sockets = {"alice": FakeWebSocket(), "carol": FakeWebSocket()}
+    await first.connect(sockets["alice"], "alice")
+    await first.connect(sockets["carol"], "carol")
+    await first.join_whiteboard("alice", moving)
+    await first.join_whiteboard("carol", staying)
+
+    # The change is made on the node that is gaining the board
+    await second.publish_shard_map({"a": "ws://a", "b": "ws://b"})
+    await asyncio.sleep(0.05)
+
+    assert first.shard_map.nodes == {"a": "ws://a", "b": "ws://b"}
+    assert flushed == [moving]
+    migrate = json.loads(sockets["alice"].sent[-1])
+    assert migrate == {"type": "migrate", "whiteboard_id": moving, "node": "b", "url": "ws://b"}
+    assert sockets["alice"].close_code == CLOSE_MIGRATED
+    assert sockets["carol"].close_code is None
+    assert first.room_handoffs == 1
+    first.disconnect("carol")
@@ -0,0 +1,85 @@
+import json
+import math
+import random
+import pytest
+from app.models.whiteboard import DrawingElement
+from app.services import simplify
+from app.services.simplify import numpy, simplify_coordinates, simplify_stroke_frame, simplify_strokes
+from app.services.stroke_codec import decode_stroke, encode_stroke
+from app.services.stroke_batcher import RoomBatcher
+
+def wobbly(points, seed):
+    rng = random.Random(seed)
+    x, y, heading = 0.0, 0.0, rng.uniform(0, 2 * math.pi)
+    coordinates = []
+    for _ in range(points):
+        heading += rng.gauss(0, 0.1)
+        x, y = x + 2 * math.cos(heading), y + 2 * math.sin(heading)
+        coordinates.append({"x": x + rng.gauss(0, 0.2), "y": y + rng.gauss(0, 0.2)})
+    return coordinates
+
+def test_collinear_points_are_dropped():
+    """Test that a straight run keeps only its end points"""
+    line = [{"x": i, "y": 2 * i} for i in range(10)]
+    assert simplify_coordinates(line, tolerance=0.5, step=0) == [{"x": 0, "y": 0}, {"x": 9, "y": 18}]
+
+def test_corners_and_extra_fields_are_kept():
+    """Test that points off the line survive with their other fields"""
+    corner = [{"x": 0, "y": 0}, {"x": 5, "y": 0.1}, {"x": 10, "y": 0, "p": 0.5}, {"x": 10, "y": 10}]
+    assert simplify_coordinates(corner, tolerance=1, step=0) == [
+        {"x": 0, "y": 0}, {"x": 10, "y": 0, "p": 0.5}, {"x": 10, "y": 10}
+    ]
+
+def test_quantize_merges_nearby_points():
+    """Test that quantization rounds coordinates and drops repeated points"""
+    points = [{"x": 0.04, "y": 0.31}, {"x": 0.03, "y": 0.29}, {"x": 0.71, "y": 0.2}]
+    assert simplify_coordinates(points, tolerance=0, step=0.1) == [
+        {"x": 0.0, "y": 0.3}, {"x": 0.7, "y": 0.2}
+    ]
+
+def test_bad_coordinates_are_left_alone():
+    """Test that strokes with unusable points pass through unchanged"""
+    for bad in ([{"x": 0, "y": 0}, {"x": 1}], [{"x": 0, "y": 0}, {"x": float("nan"), "y": 1}, {"x": 2, "y": 0}]):
+        assert simplify_coordinates(bad, tolerance=1, step=0.1, use_numpy=False) is bad
+    if numpy is not None:
+        good = wobbly(50, 0)
+        results = simplify_strokes([good, [{"x": 0, "y": 0}, {"x": "a", "y": 0}]], 1, 0.1, use_numpy=True)
+        assert results[0] == simplify_coordinates(good, 1, 0.1, use_numpy=False)
+        assert results[1] == [{"x": 0, "y": 0}, {"x": "a", "y": 0}]
+
+@pytest.mark.skipif(numpy is None, reason="NumPy is not installed")
+def test_numpy_batches_match_python():
+    """Test that one NumPy batch keeps the same points as per-stroke Python"""
+    strokes = [wobbly(points, seed) for seed, points in enumerate([2, 3, 40, 200, 1, 120])]
+    strokes.append([{"x": 1, "y": 1}] * 5)
+    strokes.append([{"x": 0, "y": 0}, {"x": float("inf"), "y": 0}, {"x": 1, "y": 1}])
+    for tolerance, step in ((0.5, 0), (1, 0.1), (0, 0.5), (3, 1)):
+        expected = [simplify_coordinates(stroke, tolerance, step, use_numpy=False) for stroke in strokes]
+        assert simplify_strokes(strokes, tolerance, step, use_numpy=True) == expected
+
+def test_binary_frames_keep_their_scale(monkeypatch):
+    """Test that a simplified binary stroke decodes to the simplified points"""
+    monkeypatch.setattr(simplify, "SIMPLIFY_ENABLED", True)
+    monkeypatch.setattr(simplify, "STROKE_SIMPLIFY_TOLERANCE", 0.5)
+    data = {"tool": "pen", "coordinates": [{"x": i, "y": 0} for i in range(20)], "style": {"color": "#000000", "width": 2}}
+    decoded = decode_stroke(simplify_stroke_frame(encode_stroke(data, scale=4)))
+    assert decoded["coordinates"] == [{"x": 0, "y": 0}, {"x": 19, "y": 0}]
+
+def test_elements_and_tick_batches_are_simplified(monkeypatch):
+    """Test that saved pen elements and merged segments are simplified, shapes are not"""
+    monkeypatch.setattr(simplify, "SIMPLIFY_ENABLED", True)
+    monkeypatch.setattr(simplify, "STROKE_SIMPLIFY_TOLERANCE", 0.5)
+    line = [{"x": i, "y": i} for i in range(5)]
+    pen = DrawingElement(type="pen", coordinates=line, style={"color": "#000000", "width": 2})
+    shape = DrawingElement(type="line", coordinates=line, style={"color": "#000000", "width": 2})
+    simplified = simplify.simplify_elements([pen, shape])
+    assert simplified[0].coordinates == [{"x": 0, "y": 0}, {"x": 4, "y": 4}]
+    assert simplified[1].coordinates == line and pen.coordinates == line
+
+    flushed = []
+    batcher = RoomBatcher("board", 10, lambda board, items: flushed.extend(items))
+    for i in range(4):
+        segment = [{"x": i, "y": i}, {"x": i + 1, "y": i + 1}]
+        batcher._pending.append({"user_id": "u1", "data": {"tool": "pen", "coordinates": segment}, "timestamp": str(i)})
+    batcher.flush()
+    assert json.loads(json.dumps(flushed))[0]["data"]["coordinates"] == [{"x": 0, "y": 0}, {"x": 4, "y": 4}]
@@ -0,0 +1,57 @@
+import pytest
+from app.models.whiteboard import DrawingElement, WhiteboardCreate
+from app.services.spatial_index import LARGE_ELEMENT_CELL, grid_cells, parse_bbox, spatial_fields
+
+def line(x1, y1, x2, y2, width=2):
+    return DrawingElement(type="line", coordinates=[{"x": x1, "y": y1}, {"x": x2, "y": y2}], style={"width": width})
+
+def test_parse_bbox():
+    """Test that a bbox parses and bad ones are rejected"""
+    assert parse_bbox("0,-10,100.5,20") == (0, -10, 100.5, 20)
+    for bad in ("1,2,3", "a,b,c,d", "10,0,0,10", "0,0,inf,10"):
+        with pytest.raises(ValueError):
+            parse_bbox(bad)
+
+def test_grid_cells_cover_box():
+    """Test that a box maps to every cell it touches, including negative ones"""
+    assert grid_cells((-1, 0, 1, 99), cell_size=100) == ["-1:0", "0:0"]
+    assert grid_cells((0, 0, 1000, 1000), cell_size=100, limit=10) is None
+
+def test_spatial_fields():
+    """Test that strokes get a padded bbox and pointless elements get no cells"""
+    fields = spatial_fields(line(10, 10, 20, 30).dict(), cell_size=100)
+    assert fields == {"bbox": [9, 9, 21, 31], "cells": ["0:0"]}
+    assert spatial_fields({"type": "clear", "coordinates": []}) == {"cells": []}
+    huge = spatial_fields(line(0, 0, 1e6, 1e6).dict(), cell_size=100)
+    assert huge["cells"] == [LARGE_ELEMENT_CELL]
+    assert spatial_fields(line(0, 0, 1e300, 1e300).dict())["cells"] == [LARGE_ELEMENT_CELL]
+    assert grid_cells((0, 0, float("inf"), 10)) is None
+    with pytest.raises(ValueError):
+        line(0, 0, float("inf"), 10)
+
+@pytest.mark.asyncio
+async def test_elements_in_bounds():
+    """Test that a viewport query returns intersecting strokes drawn since the last clear"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from app.services.whiteboard_service import append_drawing_elements, create_whiteboard, get_elements_in_bounds
+
+    db = mongomock_motor.AsyncMongoMockClient()["spatial_test"]
+    board = await create_whiteboard(db, WhiteboardCreate(name="infinite"), "owner")
+    await append_drawing_elements(db, board.id, [
+        line(0, 0, 10, 10),
+        DrawingElement(type="clear", coordinates=[]),
+        line(0, 0, 10, 10),
+        line(5000, 5000, 5010, 5010),
+        line(-1e6, 50, 1e6, 50),
+    ])
+
+    delta = await get_elements_in_bounds(db, board.id, (0, 0, 100, 100))
+    assert [element.seq for element in delta.elements] == [2, 3, 5]
+    assert delta.elements[0].type == "clear"
+
+    delta = await get_elements_in_bounds(db, board.id, (0, 0, 100, 100), since=2, limit=1)
+    assert [element.seq for element in delta.elements] == [3]
+    assert delta.has_more
+
+    delta = await get_elements_in_bounds(db, board.id, (4900, 4900, 4990, 4990))
+    assert [element.seq for element in delta.elements] == [2]
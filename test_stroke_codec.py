@@ -0,0 +1,94 @@
+import asyncio
+import json
+import pytest
+from app.services.stroke_codec import (
+    BINARY_SUBPROTOCOL,
+    JSON_SUBPROTOCOL,
+    FLAG_WIDE_DELTAS,
+    HEADER,
+    StrokeCodecError,
+    decode_stroke,
+    encode_stroke,
+    parse_subprotocol,
+    relay_frame,
+    validate_stroke_frame,
+)
+from app.services.webrtc_service import WebRTCManager
+
+class FakeWebSocket:
+    """WebSocket stand-in that records sent frames"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        self.subprotocol = subprotocol
+
+    async def send_text(self, data: str):
+        self.sent.append(data)
+
+    async def send_bytes(self, data: bytes):
+        self.sent.append(data)
+
+PEN_STROKE = {
+    "tool": "pen",
+    "coordinates": [{"x": 10.25, "y": 20.5}, {"x": 11.0, "y": 19.75}, {"x": 15.5, "y": 25.0}],
+    "style": {"color": "#1a2b3c", "width": 2.5},
+}
+
+def test_round_trip_pen_stroke():
+    """Test that quantized strokes decode to the original points"""
+    frame = encode_stroke(PEN_STROKE)
+    assert decode_stroke(frame) == PEN_STROKE
+    # 12-byte header, 8-byte first point, 2 int16 deltas per extra point
+    assert len(frame) == 12 + 8 + 2 * 2 * 2
+
+def test_large_deltas_switch_to_wide_encoding():
+    """Test that deltas outside int16 range are still encoded exactly"""
+    stroke = {"tool": "line", "coordinates": [{"x": 0.0, "y": 0.0}, {"x": 20000.0, "y": -20000.0}], "style": {}}
+    frame = encode_stroke(stroke)
+    assert HEADER.unpack_from(frame)[3] & FLAG_WIDE_DELTAS
+    assert decode_stroke(frame) == stroke
+
+def test_clear_has_no_points():
+    """Test encoding a clear event"""
+    frame = encode_stroke({"tool": "clear", "coordinates": []})
+    assert decode_stroke(frame) == {"tool": "clear", "coordinates": [], "style": {}}
+
+def test_rejects_malformed_frames():
+    """Test that truncated frames and unknown styles are rejected"""
+    frame = encode_stroke(PEN_STROKE)
+    with pytest.raises(StrokeCodecError):
+        validate_stroke_frame(frame[:-1])
+    with pytest.raises(StrokeCodecError):
+        encode_stroke(dict(PEN_STROKE, style={"dash": [1, 2]}))
+
+def test_subprotocol_negotiation_prefers_binary():
+    """Test subprotocol selection from a client's offer"""
+    assert parse_subprotocol([JSON_SUBPROTOCOL, BINARY_SUBPROTOCOL]) == BINARY_SUBPROTOCOL
+    assert parse_subprotocol([JSON_SUBPROTOCOL]) == JSON_SUBPROTOCOL
+    assert parse_subprotocol([]) is None
+
+@pytest.mark.asyncio
+async def test_binary_stroke_relayed_as_is_and_decoded_for_json_clients():
+    """Test relaying a binary stroke to binary and JSON members"""
+    manager = WebRTCManager()
+    drawer, binary_peer, json_peer = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    await manager.connect(drawer, "drawer", subprotocol=BINARY_SUBPROTOCOL)
+    await manager.connect(binary_peer, "binary", subprotocol=BINARY_SUBPROTOCOL)
+    await manager.connect(json_peer, "json")
+    for user_id in ["drawer", "binary", "json"]:
+        await manager.join_whiteboard(user_id, "board")
+    await asyncio.sleep(0.01)
+
+    frame = encode_stroke(PEN_STROKE)
+    await manager.broadcast_binary_stroke("drawer", frame)
+    await asyncio.sleep(0.01)
+
+    assert binary_peer.sent[-1] == relay_frame("drawer", frame)
+    message = json.loads(json_peer.sent[-1])
+    assert message["type"] == "drawing_data"
+    assert message["data"] == PEN_STROKE
+
+    for user_id in ["drawer", "binary", "json"]:
+        manager.disconnect(user_id)
@@ -0,0 +1,273 @@
+import asyncio
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+from app.models.whiteboard import DrawingElement, WhiteboardCreate
+from app.services import stroke_writer
+from app.services.compact_stroke import CompactElement
+from app.services.stroke_writer import StrokeWriteBuffer, drawing_data_to_element
+
+class FakeStrokeLog:
+    """Stands in for assign_stroke_seqs and insert_stroke_documents and records each batch"""
+
+    def __init__(self, fail_times: int = 0, error: Exception = AutoReconnect("primary stepped down")):
+        self.batches = []
+        self.seqs = {}
+        self.reserved = 0
+        self.fail_times = fail_times
+        self.error = error
+        self.rejected = []
+        self.delay = 0.0
+        self.writing = 0
+        self.overlapped = False
+
+    async def assign(self, db, whiteboard_id, documents):
+        for document in documents:
+            self.reserved += 1
+            self.seqs[whiteboard_id] = document["seq"] = self.seqs.get(whiteboard_id, 0) + 1
+        return True
+
+    async def insert(self, db, documents, write_concern=None):
+        self.overlapped = self.overlapped or self.writing > 0
+        self.writing += 1
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.writing -= 1
+        if self.fail_times:
+            self.fail_times -= 1
+            raise self.error
+        self.batches.append((documents[0]["whiteboard_id"], [CompactElement.from_document(document) for document in documents]))
+        return self.rejected
+
+@pytest.fixture
+def stroke_log(monkeypatch):
+    log = FakeStrokeLog()
+    monkeypatch.setattr(stroke_writer, "assign_stroke_seqs", log.assign)
+    monkeypatch.setattr(stroke_writer, "insert_stroke_documents", log.insert)
+    monkeypatch.setattr(stroke_writer, "get_db", lambda: None)
+    return log
+
+def pen(x: float) -> DrawingElement:
+    return DrawingElement(type="pen", coordinates=[{"x": x, "y": 0}, {"x": x + 1, "y": 1}], style={})
+
+def test_drawing_data_to_element_rejects_unknown_tools():
+    """Test that only valid drawing data is persisted"""
+    assert drawing_data_to_element({"tool": "pen", "coordinates": [{"x": 1, "y": 2}]}).type == "pen"
+    assert drawing_data_to_element({"tool": "laser", "coordinates": []}) is None
+
+@pytest.mark.asyncio
+async def test_flushes_when_batch_is_full(stroke_log):
+    """Test that a full batch is written in one insert without waiting for the timer"""
+    buffer = StrokeWriteBuffer(max_batch=3, interval_ms=60000)
+    for x in range(3):
+        buffer.add("board", pen(x))
+    await asyncio.sleep(0.01)
+
+    assert len(stroke_log.batches) == 1
+    assert [element.coordinates[0]["x"] for element in stroke_log.batches[0][1]] == [0, 1, 2]
+    assert buffer.stats()["pending"] == 0
+
+@pytest.mark.asyncio
+async def test_flushes_on_interval(stroke_log):
+    """Test that a partial batch is written by the periodic flush"""
+    buffer = StrokeWriteBuffer(max_batch=100, interval_ms=10)
+    buffer.start()
+    buffer.add("board", pen(0))
+    await asyncio.sleep(0.05)
+    await buffer.close()
+
+    assert len(stroke_log.batches) == 1
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_in_order(stroke_log):
+    """Test that strokes survive a failed write, keep their order and keep their seqs"""
+    stroke_log.fail_times = 1
+    buffer = StrokeWriteBuffer(max_batch=100, interval_ms=60000)
+    buffer.add("board", pen(0))
+    await buffer.flush("board")
+    assert buffer.stats()["pending"] == 1
+    buffer.add("board", pen(1))
+    await buffer.close()
+
+    assert buffer.failures == 1
+    assert [element.coordinates[0]["x"] for element in stroke_log.batches[0][1]] == [0, 1]
+    assert [element.seq for element in stroke_log.batches[0][1]] == [1, 2]
+    assert stroke_log.reserved == 2
+
+@pytest.mark.asyncio
+async def test_rejected_stroke_in_a_batch_is_announced_with_it(stroke_log):
+    """Test that the rest of a batch is stored around a rejected stroke and its seqs are all announced"""
+    stroke_log.rejected = [1]
+    announced = []
+
+    async def announce(whiteboard_id, first_seq, last_seq):
+        announced.append((first_seq, last_seq))
+
+    buffer = StrokeWriteBuffer(max_batch=3, interval_ms=60000)
+    buffer.persist_hooks.append(announce)
+    for x in range(4):
+        buffer.add("board", pen(x))
+    await buffer.close()
+
+    assert announced == [(1, 3), (4, 4)]
+    assert stroke_log.reserved == 4
+    assert buffer.persisted == 2 and buffer.dropped == 2
+
+@pytest.mark.asyncio
+async def test_retries_are_capped(stroke_log):
+    """Test that strokes are dropped once a board runs out of retries"""
+    stroke_log.fail_times = 10
+    buffer = StrokeWriteBuffer(max_batch=100, interval_ms=60000, max_retries=2)
+    buffer.add("board", pen(0))
+    for _ in range(3):
+        await buffer.flush("board")
+
+    assert buffer.failures == 3
+    assert buffer.dropped == 1 and buffer.stats()["pending"] == 0
+
+@pytest.mark.asyncio
+async def test_non_transient_errors_are_not_retried(stroke_log):
+    """Test that only database errors put strokes back in the buffer"""
+    stroke_log.fail_times, stroke_log.error = 1, TypeError("not a document")
+    buffer = StrokeWriteBuffer(max_batch=100, interval_ms=60000)
+    buffer.add("board", pen(0))
+    await buffer.flush("board")
+
+    assert buffer.dropped == 1 and buffer.stats()["pending"] == 0
+
+@pytest.mark.asyncio
+async def test_unstorable_strokes_are_dropped(stroke_log):
+    """Test that a stroke that can't be built doesn't hold back the rest of the board"""
+    buffer = StrokeWriteBuffer(max_batch=100, interval_ms=60000)
+    buffer.add("board", pen(0))
+    buffer.add("board", DrawingElement(type="pen", coordinates=[{"x": 1, "y": 1}], style={"width": "wide"}))
+    buffer.add("board", pen(2))
+    await buffer.flush("board")
+
+    assert [element.coordinates[0]["x"] for element in stroke_log.batches[0][1]] == [0, 2]
+    assert buffer.dropped == 1 and buffer.persisted == 2
+
+@pytest.mark.asyncio
+async def test_retry_after_a_partial_write_stores_each_stroke_once(monkeypatch):
+    """Test that a write that failed partway is retried with the same seqs and no duplicates"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from app.services.whiteboard_service import create_whiteboard, insert_stroke_documents
+
+    db = mongomock_motor.AsyncMongoMockClient()["stroke_writer_test"]
+    await db.strokes.create_index([("whiteboard_id", 1), ("seq", 1)], unique=True)
+    board = await create_whiteboard(db, WhiteboardCreate(name="retry"), "owner")
+    announced = []
+
+    async def announce(whiteboard_id, first_seq, last_seq):
+        announced.append((first_seq, last_seq))
+
+    async def cut_off(db, documents, write_concern=None):
+        # The first stroke reaches the server before the connection drops
+        monkeypatch.setattr(stroke_writer, "insert_stroke_documents", insert_stroke_documents)
+        await db.strokes.insert_one(dict(documents[0]))
+        raise AutoReconnect("connection reset")
+
+    monkeypatch.setattr(stroke_writer, "get_db", lambda: db)
+    monkeypatch.setattr(stroke_writer, "insert_stroke_documents", cut_off)
+    buffer = StrokeWriteBuffer(max_batch=100, interval_ms=60000, write_concern=None)
+    buffer.persist_hooks.append(announce)
+    for x in range(3):
+        buffer.add(board.id, pen(x))
+    await buffer.flush(board.id)
+    buffer.add(board.id, pen(3))
+    await buffer.close()
+
+    assert [stroke["seq"] async for stroke in db.strokes.find({}).sort("seq", 1)] == [1, 2, 3, 4]
+    assert (await db.whiteboards.find_one({}))["stroke_seq"] == 4
+    assert announced == [(1, 4)]
+    assert buffer.persisted == 4 and buffer.failures == 1
+
+@pytest.mark.asyncio
+async def test_only_duplicates_count_as_stored():
+    """Test that an insert reports strokes the server rejected, but not ones it already had"""
+    from app.services.whiteboard_service import insert_stroke_documents
+
+    class RejectingStrokes:
+        async def insert_many(self, documents, ordered=True):
+            assert not ordered
+            raise BulkWriteError({"writeErrors": [
+                {"index": 0, "code": 11000, "errmsg": "duplicate key"},
+                {"index": 2, "code": 2, "errmsg": "bad value"},
+            ], "nInserted": 1})
+
+    class FakeDb:
+        strokes = RejectingStrokes()
+
+    assert await insert_stroke_documents(FakeDb(), [{}, {}, {}]) == [2]
+
+@pytest.mark.asyncio
+async def test_bad_elements_reserve_no_seqs():
+    """Test that a batch that fails to build leaves the board's sequence untouched"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from app.services.whiteboard_service import append_drawing_elements, create_whiteboard
+
+    db = mongomock_motor.AsyncMongoMockClient()["stroke_writer_test"]
+    board = await create_whiteboard(db, WhiteboardCreate(name="seqs"), "owner")
+    bad = DrawingElement(type="pen", coordinates=[{"x": 1, "y": 1}], style={"width": "wide"})
+    with pytest.raises(ValueError):
+        await append_drawing_elements(db, board.id, [pen(0), bad])
+    await append_drawing_elements(db, board.id, [pen(0)])
+
+    assert [stroke["seq"] async for stroke in db.strokes.find({})] == [1]
+
+@pytest.mark.asyncio
+async def test_board_flush_waits_for_the_running_flush(stroke_log):
+    """Test that a handoff flush never writes alongside a scheduled one"""
+    stroke_log.delay = 0.02
+    buffer = StrokeWriteBuffer(max_batch=2, interval_ms=60000)
+    buffer.add("board", pen(0))
+    buffer.add("board", pen(1))
+    await asyncio.sleep(0)
+    buffer.add("board", pen(2))
+    await buffer.flush_board("board")
+
+    assert not stroke_log.overlapped
+    assert [element.coordinates[0]["x"] for _, batch in stroke_log.batches for element in batch] == [0, 1, 2]
+    assert buffer.stats()["pending"] == 0
+
+@pytest.mark.asyncio
+async def test_stored_batches_are_announced(monkeypatch):
+    """Test that persist hooks hear the seqs each stored batch got"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from app.services.whiteboard_service import create_whiteboard
+
+    db = mongomock_motor.AsyncMongoMockClient()["stroke_writer_test"]
+    board = await create_whiteboard(db, WhiteboardCreate(name="seqs"), "owner")
+    announced = []
+
+    async def announce(whiteboard_id, first_seq, last_seq):
+        announced.append((whiteboard_id, first_seq, last_seq))
+
+    monkeypatch.setattr(stroke_writer, "get_db", lambda: db)
+    buffer = StrokeWriteBuffer(max_batch=2, interval_ms=60000, write_concern=None)
+    buffer.persist_hooks.append(announce)
+    for x in range(3):
+        buffer.add(board.id, pen(x))
+    await buffer.close()
+    assert announced == [(board.id, 1, 2), (board.id, 3, 3)]
+
+@pytest.mark.asyncio
+async def test_close_flushes_every_board(stroke_log):
+    """Test that shutdown persists everything still buffered"""
+    buffer = StrokeWriteBuffer(max_batch=100, interval_ms=60000)
+    buffer.start()
+    buffer.add("a", pen(0))
+    buffer.add("b", pen(1))
+    await buffer.close()
+
+    assert sorted(whiteboard_id for whiteboard_id, _ in stroke_log.batches) == ["a", "b"]
+    assert buffer.stats()["persisted"] == 2
+
+def test_oldest_strokes_are_shed_past_the_cap():
+    """Test that the buffer stays bounded when the database falls behind"""
+    buffer = StrokeWriteBuffer(max_batch=100, interval_ms=60000, max_pending=2)
+    for x in range(5):
+        buffer.add("board", pen(x))
+
+    assert buffer.stats()["pending"] == 2
+    assert buffer.dropped == 3
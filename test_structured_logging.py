@@ -0,0 +1,63 @@
+import asyncio
+import json
+import logging
+import queue
+import pytest
+from app.services.structured_logging import (
+    DroppingQueueHandler,
+    RoomErrorAggregator,
+    SampledLogger,
+    StructuredFormatter,
+)
+
+def test_formatter_renders_extra_fields():
+    """Test that fields passed through extra= end up in the output"""
+    record = logging.makeLogRecord({
+        "name": "app", "levelname": "WARNING", "msg": "User %s left", "args": ("alice",),
+        "event": "user_left", "whiteboard_id": "b1"
+    })
+    assert StructuredFormatter().format(record).endswith("app: User alice left event=user_left whiteboard_id=b1")
+    payload = json.loads(StructuredFormatter("json").format(record))
+    assert payload["msg"] == "User alice left" and payload["whiteboard_id"] == "b1"
+
+def test_queue_handler_drops_instead_of_blocking():
+    """Test that a full log queue drops records rather than waiting"""
+    handler = DroppingQueueHandler(queue.Queue(2))
+    for index in range(5):
+        handler.handle(logging.makeLogRecord({"msg": "m%d", "args": (index,)}))
+    assert handler.queue.qsize() == 2 and handler.dropped == 3
+
+def test_sampled_logger_reports_suppressed(caplog, monkeypatch):
+    """Test that a burst gets through per interval and the rest is counted"""
+    now = [0.0]
+    monkeypatch.setattr("app.services.structured_logging.time.monotonic", lambda: now[0])
+    logger = logging.getLogger("test.sampled")
+    sampled = SampledLogger(logger, interval=10, burst=3)
+    with caplog.at_level(logging.INFO, logger="test.sampled"):
+        for index in range(10):
+            sampled.info("user_disconnected", "User %s disconnected", index)
+        now[0] = 11
+        sampled.info("user_disconnected", "User %s disconnected", "late")
+
+    assert [record.getMessage() for record in caplog.records] == [
+        "User 0 disconnected", "User 1 disconnected", "User 2 disconnected", "User late disconnected"
+    ]
+    assert caplog.records[-1].suppressed == 7
+
+@pytest.mark.asyncio
+async def test_room_errors_are_summarized(caplog):
+    """Test that repeats of an error in a room become one summary line"""
+    logger = logging.getLogger("test.rooms")
+    errors = RoomErrorAggregator(logger, window=0.05)
+    with caplog.at_level(logging.WARNING, logger="test.rooms"):
+        for index in range(50):
+            errors.record("board-1", "send_error", f"error {index}")
+        errors.record("board-2", "send_error", "only once")
+        await asyncio.sleep(0.1)
+
+    assert [record.getMessage() for record in caplog.records] == [
+        "send_error in whiteboard board-1: error 0",
+        "send_error in whiteboard board-2: only once",
+        "send_error repeated 49 times in whiteboard board-1, last: error 49",
+    ]
+    assert errors.pending() == 0
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import pytest
+from app.services.stroke_codec import BINARY_SUBPROTOCOL, encode_stroke
+from app.services.viewport import ViewportFilter, drawing_bounds, parse_viewport
+from app.services.webrtc_service import WebRTCManager
+
+class FakeWebSocket:
+    """Minimal WebSocket stand-in that records sent frames"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        self.sent.append(data)
+
+    async def send_bytes(self, data: bytes):
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        pass
+
+def pen(x, y):
+    return {"tool": "pen", "coordinates": [{"x": x, "y": y}, {"x": x + 10, "y": y + 10}],
+            "style": {"color": "#000000", "width": 2}}
+
+async def room(*user_ids, protocols=None):
+    manager = WebRTCManager()
+    sockets = {}
+    for user_id in user_ids:
+        sockets[user_id] = FakeWebSocket()
+        await manager.connect(sockets[user_id], user_id, subprotocol=(protocols or {}).get(user_id))
+        await manager.join_whiteboard(user_id, "board")
+    await asyncio.sleep(0.01)
+    for websocket in sockets.values():
+        websocket.sent.clear()
+    return manager, sockets
+
+def drawing(websocket):
+    """Drawing items a client received, in order"""
+    items = []
+    for frame in websocket.sent:
+        message = json.loads(frame)
+        if message["type"] == "drawing_data":
+            items.append(message["data"])
+        elif message["type"] == "drawing_batch":
+            items.extend(item["data"] for item in message["items"])
+    return items
+
+def test_parse_viewport():
+    """Test that only four ordered numbers make a viewport"""
+    assert parse_viewport([0, 0, 800, 600]) == (0, 0, 800, 600)
+    for bad in (None, [0, 0, 800], [0, 0, "800", 600], [800, 0, 0, 600], [True, 0, 1, 1]):
+        assert parse_viewport(bad) is None
+
+def test_drawing_bounds_tolerates_bad_data():
+    """Test that malformed drawing data is treated as unbounded"""
+    assert drawing_bounds(pen(0, 0)) == (-1, -1, 11, 11)
+    assert drawing_bounds({"tool": "pen", "coordinates": [{"x": 1}]}) is None
+    assert drawing_bounds({"tool": "clear"}) is None
+    assert drawing_bounds("pen") is None
+
+def test_filter_overflow_asks_for_resync():
+    """Test that too many held items are dropped and reported on the next viewport"""
+    viewports = ViewportFilter(margin=0, max_deferred=2)
+    viewports.set_viewport("u1", (0, 0, 100, 100))
+    for x in range(3):
+        viewports.defer("u1", {"data": x}, (1000 + x, 0, 1001 + x, 1))
+    assert viewports.pending() == 1
+    visible, resync = viewports.set_viewport("u1", (900, 0, 1100, 100))
+    assert resync
+    assert visible == [{"data": 2}]
+
+@pytest.mark.asyncio
+async def test_offscreen_strokes_are_held_until_panned_to():
+    """Test that strokes outside a viewport arrive in one batch after panning"""
+    manager, sockets = await room("drawer", "viewer", "everything")
+    manager.set_viewport("viewer", (0, 0, 800, 600))
+
+    await manager.broadcast_drawing_data("drawer", pen(100, 100))
+    await manager.broadcast_drawing_data("drawer", pen(5000, 5000))
+    await manager.broadcast_drawing_data("drawer", pen(5100, 5000))
+    await asyncio.sleep(0.01)
+    assert drawing(sockets["viewer"]) == [pen(100, 100)]
+    assert len(drawing(sockets["everything"])) == 3
+    assert manager.viewport_filter.pending() == 2
+
+    sockets["viewer"].sent.clear()
+    manager.set_viewport("viewer", (4800, 4800, 5600, 5400))
+    await asyncio.sleep(0.01)
+    assert [json.loads(frame)["type"] for frame in sockets["viewer"].sent] == ["drawing_batch"]
+    assert drawing(sockets["viewer"]) == [pen(5000, 5000), pen(5100, 5000)]
+    assert manager.viewport_filter.pending() == 0
+
+@pytest.mark.asyncio
+async def test_clear_drops_held_strokes():
+    """Test that a clear reaches everyone and discards what was held back"""
+    manager, sockets = await room("drawer", "viewer")
+    manager.set_viewport("viewer", (0, 0, 800, 600))
+    await manager.broadcast_drawing_data("drawer", pen(5000, 5000))
+    await manager.broadcast_drawing_data("drawer", {"tool": "clear", "coordinates": []})
+    await asyncio.sleep(0.01)
+    assert drawing(sockets["viewer"]) == [{"tool": "clear", "coordinates": []}]
+    assert manager.viewport_filter.pending() == 0
+
+@pytest.mark.asyncio
+async def test_tick_batches_are_filtered_per_recipient():
+    """Test that batched drawing only carries the items each member can see"""
+    manager, sockets = await room("drawer", "viewer", "everything")
+    manager.set_room_tick("board", 10)
+    manager.set_viewport("viewer", (0, 0, 800, 600))
+    await manager.broadcast_drawing_data("drawer", pen(100, 100))
+    await manager.broadcast_drawing_data("drawer", {**pen(5000, 5000), "tool": "line"})
+    await asyncio.sleep(0.05)
+    assert drawing(sockets["viewer"]) == [pen(100, 100)]
+    assert len(drawing(sockets["everything"])) == 2
+    assert manager.viewport_filter.pending() == 1
+
+@pytest.mark.asyncio
+async def test_stored_seqs_skip_members_missing_strokes():
+    """Test that members only hear about stored seqs once they have drawn the strokes"""
+    manager, sockets = await room("drawer", "viewer", "everything")
+    manager.set_room_tick("board", 1000)
+    manager.set_viewport("viewer", (0, 0, 800, 600))
+    await manager.broadcast_drawing_data("drawer", pen(100, 100))
+    await manager.broadcast_drawing_data("drawer", pen(5000, 5000))
+    await manager.announce_persisted("board", 1, 2)
+    await asyncio.sleep(0.01)
+
+    # The tick batch goes out ahead of the seqs it covers
+    types = [json.loads(frame)["type"] for frame in sockets["everything"].sent]
+    assert types == ["drawing_batch", "strokes_persisted"]
+    assert json.loads(sockets["everything"].sent[-1])["first_seq"] == 1
+    assert "strokes_persisted" not in [json.loads(frame)["type"] for frame in sockets["viewer"].sent]
+
+    manager.set_viewport("viewer", (4800, 4800, 5600, 5400))
+    await manager.announce_persisted("board", 3, 3)
+    await asyncio.sleep(0.01)
+    assert json.loads(sockets["viewer"].sent[-1])["last_seq"] == 3
+
+@pytest.mark.asyncio
+async def test_binary_strokes_are_filtered():
+    """Test that binary strokes outside a viewport are held back as JSON items"""
+    manager, sockets = await room("drawer", "viewer", protocols={"viewer": BINARY_SUBPROTOCOL})
+    manager.set_viewport("viewer", (0, 0, 800, 600))
+    await manager.broadcast_binary_stroke("drawer", encode_stroke(pen(5000, 5000)))
+    await asyncio.sleep(0.01)
+    assert sockets["viewer"].sent == []
+    manager.set_viewport("viewer", (4800, 4800, 5600, 5400))
+    await asyncio.sleep(0.01)
+    assert drawing(sockets["viewer"])[0]["coordinates"][0] == {"x": 5000, "y": 5000}
+    manager.disconnect("viewer")
+    assert "viewer" not in manager.viewport_filter.viewports
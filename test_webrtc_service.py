@@ -0,0 +1,246 @@
+import asyncio
+import json
+from datetime import datetime
+import pytest
+from app.services.send_queue import (
+    ConnectionSender,
+    OVERFLOW_COALESCE,
+    OVERFLOW_DISCONNECT,
+    OVERFLOW_DROP_OLDEST,
+)
+from app.services import serialization
+from app.services.serialization import _dumps_stdlib, _loads_stdlib
+from app.services.stroke_batcher import merge_drawing_items
+from app.services.webrtc_service import CLOSE_REPLACED, CLOSE_SESSION_EXPIRED, WebRTCManager
+
+class FakeWebSocket:
+    """Minimal WebSocket stand-in that records sent frames"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.sent = []
+        self.closed = False
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(data)
+
+    async def send_bytes(self, data: bytes):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        self.close_code = code
+
+@pytest.mark.asyncio
+async def test_drop_oldest_keeps_newest_payloads():
+    """Test that a full queue drops its oldest payloads"""
+    failures = []
+    sender = ConnectionSender(FakeWebSocket(), "u1", lambda *args: failures.append(args),
+                              max_size=2, overflow_policy=OVERFLOW_DROP_OLDEST)
+    for payload in ["a", "b", "c"]:
+        assert sender.enqueue(payload)
+    assert sender.depth == 2
+    assert sender.dropped == 1
+    sender.start()
+    await asyncio.sleep(0.01)
+    assert sender.websocket.sent == ["b", "c"]
+    assert not failures
+    sender.close()
+
+@pytest.mark.asyncio
+async def test_coalesce_replaces_payload_with_same_key():
+    """Test that coalescing replaces a queued payload with the same key"""
+    sender = ConnectionSender(FakeWebSocket(), "u1", lambda *args: None,
+                              max_size=2, overflow_policy=OVERFLOW_COALESCE)
+    sender.enqueue("users-1", coalesce_key="current_users")
+    sender.enqueue("stroke")
+    sender.enqueue("users-2", coalesce_key="current_users")
+    assert sender.coalesced == 1
+    assert sender.dropped == 0
+    sender.start()
+    await asyncio.sleep(0.01)
+    assert sender.websocket.sent == ["users-2", "stroke"]
+    sender.close()
+
+@pytest.mark.asyncio
+async def test_disconnect_policy_reports_slow_consumer():
+    """Test that the disconnect policy closes a full queue"""
+    failures = []
+    sender = ConnectionSender(FakeWebSocket(), "u1", lambda *args: failures.append(args),
+                              max_size=1, overflow_policy=OVERFLOW_DISCONNECT)
+    assert sender.enqueue("a")
+    assert not sender.enqueue("b")
+    assert sender.closed
+    assert failures == [("u1", "overflow")]
+
+@pytest.mark.asyncio
+async def test_slow_client_does_not_block_broadcast():
+    """Test that a stalled member does not delay delivery to the rest of the room"""
+    manager = WebRTCManager()
+    slow, fast, sender = FakeWebSocket(delay=10), FakeWebSocket(), FakeWebSocket()
+    await manager.connect(slow, "slow")
+    await manager.connect(fast, "fast")
+    await manager.connect(sender, "sender")
+    for user_id in ["slow", "fast", "sender"]:
+        await manager.join_whiteboard(user_id, "board")
+
+    await asyncio.wait_for(
+        manager.broadcast_to_whiteboard("board", {"type": "ping"}, exclude_user="sender"),
+        timeout=0.1,
+    )
+    await asyncio.sleep(0.01)
+    assert json.loads(fast.sent[-1]) == {"type": "ping"}
+    assert manager.get_queue_stats()["connections"]["slow"]["depth"] >= 1
+
+    for user_id in ["slow", "fast", "sender"]:
+        manager.disconnect(user_id)
+
+@pytest.mark.asyncio
+async def test_dropped_connection_close_is_kept_until_done():
+    """Test that closing a slow consumer's socket runs as a held background task"""
+    manager = WebRTCManager()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, "slow")
+    manager._drop_connection("slow", "overflow")
+
+    assert any(not task.done() for task in manager._background)
+    await asyncio.sleep(0.01)
+    assert websocket.closed
+    assert not manager._background
+    assert manager.slow_consumer_disconnects == 1
+
+def test_stdlib_encoder_matches_fast_backend():
+    """Test that the stdlib fallback produces the same wire output as orjson"""
+    orjson = pytest.importorskip("orjson")
+    message = {
+        "type": "drawing_data",
+        "user_id": "\u00e9l\u00e8ve",
+        "data": {"tool": "pen", "coordinates": [{"x": 1.5, "y": -2.25}, {"x": float("nan"), "y": float("inf")}]},
+        "style": {"width": 2, 3: None},
+        "timestamp": datetime(2024, 1, 1, 12, 30, 0, 5),
+    }
+    assert _dumps_stdlib(message) == orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS)
+    assert json.loads(_dumps_stdlib(message))["data"]["coordinates"][1] == {"x": None, "y": None}
+
+    # Exponents may be spelled differently, the values may not
+    floats = [1e16, 1e-7, 1e-5, 0.1, -0.0, 1 / 3, 5e-324, 1.7976931348623157e308]
+    assert _loads_stdlib(_dumps_stdlib(floats)) == orjson.loads(orjson.dumps(floats)) == floats
+
+def test_non_finite_numbers_are_rejected_on_decode():
+    """Test that both backends refuse NaN and Infinity, which browsers can't parse"""
+    for data in ('{"x": NaN}', '[Infinity]', '[-Infinity]'):
+        with pytest.raises(ValueError):
+            _loads_stdlib(data)
+        with pytest.raises(ValueError):
+            serialization.loads(data)
+
+def _segment(user_id, start, end, tool="pen"):
+    return {
+        "user_id": user_id,
+        "data": {"tool": tool, "coordinates": [start, end], "style": {"color": "#000", "width": 2}},
+        "timestamp": "t",
+    }
+
+def test_merge_concatenates_consecutive_segments_per_sender():
+    """Test that a sender's consecutive pen segments are joined in order"""
+    p = [{"x": float(i), "y": float(i)} for i in range(4)]
+    items = [
+        _segment("a", p[0], p[1]),
+        _segment("b", p[3], p[2]),
+        _segment("a", p[1], p[2]),
+        _segment("a", p[2], p[3]),
+        _segment("a", p[0], p[1], tool="eraser"),
+    ]
+    merged = merge_drawing_items(items)
+    assert [item["user_id"] for item in merged] == ["a", "b", "a"]
+    assert merged[0]["data"]["coordinates"] == p
+    assert merged[2]["data"]["tool"] == "eraser"
+    # Inputs are left untouched
+    assert items[0]["data"]["coordinates"] == [p[0], p[1]]
+
+@pytest.mark.asyncio
+async def test_tick_mode_sends_one_batch_per_recipient():
+    """Test that a room in tick mode relays a single batched frame"""
+    manager = WebRTCManager()
+    sockets = {user_id: FakeWebSocket() for user_id in ["a", "b", "viewer"]}
+    for user_id, websocket in sockets.items():
+        await manager.connect(websocket, user_id)
+        await manager.join_whiteboard(user_id, "board")
+    manager.set_room_tick("board", 10)
+    await asyncio.sleep(0.01)
+    for websocket in sockets.values():
+        websocket.sent.clear()
+
+    p = [{"x": float(i), "y": 0.0} for i in range(3)]
+    for start, end in [(p[0], p[1]), (p[1], p[2])]:
+        await manager.broadcast_drawing_data("a", _segment("a", start, end)["data"])
+    await manager.broadcast_drawing_data("b", _segment("b", p[0], p[1])["data"])
+    await asyncio.sleep(0.05)
+
+    viewer_frames = [json.loads(frame) for frame in sockets["viewer"].sent]
+    assert len(viewer_frames) == 1
+    assert viewer_frames[0]["type"] == "drawing_batch"
+    assert [item["user_id"] for item in viewer_frames[0]["items"]] == ["a", "b"]
+    assert viewer_frames[0]["items"][0]["data"]["coordinates"] == p
+    a_frames = [json.loads(frame) for frame in sockets["a"].sent]
+    assert [item["user_id"] for item in a_frames[0]["items"]] == ["b"]
+    assert manager.batching_stats.to_dict()["frames_saved"] > 0
+
+    for user_id in sockets:
+        manager.disconnect(user_id)
+
+
+@pytest.mark.asyncio
+async def test_reconnect_replaces_previous_connection():
+    """Test that a stale connection's disconnect leaves the new one alone"""
+    manager = WebRTCManager()
+    old, new = FakeWebSocket(), FakeWebSocket()
+    await manager.connect(old, "a")
+    await manager.connect(new, "a")
+    await asyncio.sleep(0.01)
+
+    assert old.close_code == CLOSE_REPLACED
+    manager.disconnect("a", old)
+    assert manager.active_connections["a"] is new
+    manager.disconnect("a", new)
+    assert "a" not in manager.active_connections
+
+@pytest.mark.asyncio
+async def test_expired_token_is_pushed_and_closed():
+    """Test that token expiry closes the connection without a per-frame check"""
+    manager = WebRTCManager()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, "a")
+    manager.set_authorized("a", "board")
+    manager.schedule_expiry("a", 0)
+    await asyncio.sleep(0.01)
+
+    assert json.loads(websocket.sent[-1]) == {"type": "session_expired"}
+    assert websocket.close_code == CLOSE_SESSION_EXPIRED
+    assert "a" not in manager.active_connections
+    assert "a" not in manager.authorized_boards
+
+@pytest.mark.asyncio
+async def test_revoked_board_access_removes_user_from_room():
+    """Test that revoking board access drops the cached check and the room"""
+    manager = WebRTCManager()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, "a")
+    manager.set_authorized("a", "board")
+    await manager.join_whiteboard("a", "board")
+
+    await manager.revoke_whiteboard_access("board")
+    await asyncio.sleep(0.01)
+
+    assert not manager.is_authorized("a", "board")
+    assert manager.get_user_session("a") is None
+    assert json.loads(websocket.sent[-1])["type"] == "access_revoked"
+    manager.disconnect("a")
\ No newline at end of file
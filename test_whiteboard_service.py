@@ -0,0 +1,140 @@
+import pytest
+from datetime import datetime, timedelta
+from app.models.whiteboard import DrawingElement, WhiteboardCreate, WhiteboardUpdate
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from app.services.compaction_service import compact_whiteboard
+from app.services.whiteboard_service import (
+    add_drawing_element,
+    append_drawing_elements,
+    create_whiteboard,
+    get_element_delta,
+    get_whiteboard,
+    list_user_whiteboards,
+    load_board_elements,
+    reserve_stroke_seqs,
+    update_whiteboard,
+)
+
+def pen(x):
+    return DrawingElement(type="pen", coordinates=[{"x": x, "y": 0}, {"x": x + 1, "y": 1}], style={"width": 2})
+
+async def new_board(name="board"):
+    db = mongomock_motor.AsyncMongoMockClient()["whiteboard_service_test"]
+    board = await create_whiteboard(db, WhiteboardCreate(name=name), "owner")
+    return db, board.id
+
+@pytest.mark.asyncio
+async def test_elements_are_appended_to_the_stroke_log():
+    """Test that elements get consecutive seqs in db.strokes and the board only keeps metadata"""
+    db, board_id = await new_board()
+    assert await append_drawing_elements(db, board_id, [pen(0), pen(1)])
+    assert await add_drawing_element(db, board_id, pen(2))
+
+    strokes = [stroke async for stroke in db.strokes.find({"whiteboard_id": board_id}).sort("seq", 1)]
+    assert [stroke["seq"] for stroke in strokes] == [1, 2, 3]
+    whiteboard = await db.whiteboards.find_one({})
+    assert "elements" not in whiteboard and whiteboard["stroke_seq"] == 3
+    assert (await get_whiteboard(db, board_id)).elements == []
+
+    # Replacing the elements appends a clear instead of rewriting the log
+    await update_whiteboard(db, board_id, WhiteboardUpdate(elements=[pen(5)]))
+    assert [(element.seq, element.type) for element in await load_board_elements(db, board_id)] == [
+        (1, "pen"), (2, "pen"), (3, "pen"), (4, "clear"), (5, "pen")
+    ]
+
+@pytest.mark.asyncio
+async def test_appending_to_a_missing_board_writes_nothing():
+    """Test that strokes for an unknown or invalid board id are refused"""
+    db, _ = await new_board()
+    assert not await append_drawing_elements(db, "0123456789ab0123456789ab", [pen(0)])
+    assert not await append_drawing_elements(db, "not-an-id", [pen(0)])
+    assert await db.strokes.count_documents({}) == 0
+
+@pytest.mark.asyncio
+async def test_listing_pages_with_a_keyset_cursor():
+    """Test that keyset pages cover owned and shared boards once each, ties included"""
+    db = mongomock_motor.AsyncMongoMockClient()["whiteboard_service_test"]
+    for index in range(5):
+        await create_whiteboard(db, WhiteboardCreate(name=f"board {index}"), "owner" if index != 2 else "someone")
+    await create_whiteboard(db, WhiteboardCreate(name="private"), "someone")
+    await db.whiteboards.update_one({"name": "board 2"}, {"$set": {"collaborators": ["owner"]}})
+    # Boards 1 to 3 were updated in the same instant
+    now = datetime.utcnow().replace(microsecond=0)
+    for index, offset in enumerate([0, 1, 1, 1, 2]):
+        await db.whiteboards.update_one({"name": f"board {index}"}, {"$set": {"updated_at": now + timedelta(seconds=offset)}})
+
+    pages, before, before_id = [], None, None
+    while True:
+        page = await list_user_whiteboards(db, "owner", limit=2, before=before, before_id=before_id)
+        if not page:
+            break
+        pages.append([summary.name for summary in page])
+        before, before_id = page[-1].updated_at, page[-1].id
+    assert pages == [["board 4", "board 3"], ["board 2", "board 1"], ["board 0"]]
+
+    skipped = await list_user_whiteboards(db, "owner", skip=3, limit=10)
+    assert [summary.name for summary in skipped] == ["board 1", "board 0"]
+    assert "elements" not in skipped[0].dict()
+
+@pytest.mark.asyncio
+async def test_delta_pages_with_has_more():
+    """Test that a delta returns limit elements at a time and says when more are left"""
+    db, board_id = await new_board()
+    await append_drawing_elements(db, board_id, [pen(x) for x in range(5)])
+
+    delta = await get_element_delta(db, board_id, since=0, limit=2)
+    assert [element.seq for element in delta.elements] == [1, 2]
+    assert (delta.last_seq, delta.has_more) == (2, True)
+
+    delta = await get_element_delta(db, board_id, since=4, limit=2)
+    assert [element.seq for element in delta.elements] == [5]
+    assert (delta.last_seq, delta.has_more) == (5, False)
+
+    delta = await get_element_delta(db, board_id, since=5)
+    assert (delta.elements, delta.last_seq, delta.has_more) == ([], 5, False)
+
+@pytest.mark.asyncio
+async def test_delta_stops_at_a_stroke_still_being_written():
+    """Test that last_seq doesn't pass a reserved seq until it is stored or given up on"""
+    db, board_id = await new_board()
+    await append_drawing_elements(db, board_id, [pen(0)])
+    # Seq 2 is reserved by a writer that hasn't inserted it yet
+    assert await reserve_stroke_seqs(db, board_id, 1) == 2
+    await append_drawing_elements(db, board_id, [pen(3), pen(4)])
+
+    delta = await get_element_delta(db, board_id, since=0)
+    assert [element.seq for element in delta.elements] == [1]
+    assert (delta.last_seq, delta.has_more) == (1, False)
+    delta = await get_element_delta(db, board_id, since=1)
+    assert (delta.elements, delta.last_seq) == ([], 1)
+
+    # Long after the reservation the stroke is taken as lost and skipped
+    await db.strokes.update_many({"whiteboard_id": board_id}, {"$set": {"created_at": datetime.utcnow() - timedelta(minutes=5)}})
+    delta = await get_element_delta(db, board_id, since=1)
+    assert [element.seq for element in delta.elements] == [3, 4]
+    assert delta.last_seq == 4
+
+@pytest.mark.asyncio
+async def test_delta_pages_through_the_snapshot():
+    """Test that clients behind the snapshot page through it, then continue from the log"""
+    db, board_id = await new_board()
+    clear = DrawingElement(type="clear", coordinates=[])
+    await append_drawing_elements(db, board_id, [pen(0), pen(1), pen(2), clear, pen(4), pen(5), pen(6), pen(7)])
+    assert await compact_whiteboard(db, board_id) == 8
+    await append_drawing_elements(db, board_id, [pen(8), pen(9)])
+
+    pages, since, has_more = [], 0, True
+    while has_more:
+        delta = await get_element_delta(db, board_id, since, limit=2)
+        pages.append([element.seq for element in delta.elements])
+        since, has_more = delta.last_seq, delta.has_more
+    assert pages == [[4, 5], [6, 7], [8], [9, 10]]
+    assert since == 10
+
+    # A client holding strokes from before the clear gets the clear first
+    delta = await get_element_delta(db, board_id, since=2, limit=10)
+    assert [element.seq for element in delta.elements] == [4, 5, 6, 7, 8]
+    assert delta.elements[0].type == "clear"
+    assert (delta.last_seq, delta.has_more) == (8, True)
\ No newline at end of file
@@ -0,0 +1,127 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from .geometry import Bounds, bounds_intersect, element_bounds
+from .metrics import REGISTRY
+
+load_dotenv()
+
+# Strokes this many pixels outside a reported viewport are still sent right away
+VIEWPORT_MARGIN = float(os.getenv("VIEWPORT_MARGIN", "256"))
+# Deferred strokes kept per recipient; past this they are dropped and the client resyncs
+VIEWPORT_MAX_DEFERRED = int(os.getenv("VIEWPORT_MAX_DEFERRED", "5000"))
+
+VIEWPORT_DEFERRED = REGISTRY.counter(
+    "whiteboard_viewport_deferred_total", "Drawing items held back from recipients that can't see them"
+)
+VIEWPORT_FLUSHED = REGISTRY.counter(
+    "whiteboard_viewport_flushed_total", "Deferred drawing items sent after a recipient panned to them"
+)
+VIEWPORT_RESYNCS = REGISTRY.counter(
+    "whiteboard_viewport_resyncs_total", "Recipients told to reload their viewport after deferred items overflowed"
+)
+
+
+def drawing_bounds(drawing_data: Any) -> Optional[Bounds]:
+    """Bounding box of live drawing data, or None if it has no usable points
+
+    Anything without bounds, like a clear, is treated as visible to
+    everyone.
+    """
+    if not isinstance(drawing_data, dict):
+        return None
+    try:
+        return element_bounds({
+            "type": drawing_data.get("tool"),
+            "coordinates": drawing_data.get("coordinates"),
+            "style": drawing_data.get("style"),
+        })
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+
+
+def parse_viewport(value: Any) -> Optional[Bounds]:
+    """Validate a client's [min_x, min_y, max_x, max_y] viewport"""
+    if not isinstance(value, (list, tuple)) or len(value) != 4:
+        return None
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value):
+        return None
+    min_x, min_y, max_x, max_y = (float(v) for v in value)
+    if min_x > max_x or min_y > max_y:
+        return None
+    return min_x, min_y, max_x, max_y
+
+
+class ViewportFilter:
+    """Tracks what each recipient can see and holds back strokes they can't
+
+    Recipients that never reported a viewport see everything. Items are
+    {"user_id", "data", "timestamp"} dicts, the same shape as
+    drawing_batch items. Held items are kept with their bounds and
+    released in arrival order once a new viewport covers them.
+    """
+
+    def __init__(self, margin: float = VIEWPORT_MARGIN, max_deferred: int = VIEWPORT_MAX_DEFERRED):
+        self.margin = margin
+        self.max_deferred = max_deferred
+        self.viewports: Dict[str, Bounds] = {}  # user_id -> padded viewport
+        self.deferred: Dict[str, List[Dict[str, Any]]] = {}  # user_id -> held items
+        self.overflowed: Dict[str, bool] = {}  # user_id -> held items were dropped
+
+    def set_viewport(self, user_id: str, bounds: Bounds) -> Tuple[List[Dict[str, Any]], bool]:
+        """Record a viewport and return the held items it now covers
+
+        The second value is True if held items were dropped since the last
+        viewport change, so the client has to reload what it sees.
+        """
+        self.viewports[user_id] = (
+            bounds[0] - self.margin, bounds[1] - self.margin, bounds[2] + self.margin, bounds[3] + self.margin
+        )
+        resync = self.overflowed.pop(user_id, False)
+        held = self.deferred.pop(user_id, [])
+        visible = []
+        for item in held:
+            if self.is_visible(user_id, item["bounds"]):
+                visible.append(item["item"])
+            else:
+                self.deferred.setdefault(user_id, []).append(item)
+        VIEWPORT_FLUSHED.inc(len(visible))
+        if resync:
+            VIEWPORT_RESYNCS.inc()
+        return visible, resync
+
+    def watches(self, user_ids) -> bool:
+        """Whether any of these recipients reported a viewport"""
+        return bool(self.viewports) and any(user_id in self.viewports for user_id in user_ids)
+
+    def is_visible(self, user_id: str, bounds: Optional[Bounds]) -> bool:
+        """Whether a recipient should get an item with these bounds now"""
+        viewport = self.viewports.get(user_id)
+        return viewport is None or bounds is None or bounds_intersect(viewport, bounds)
+
+    def defer(self, user_id: str, item: Dict[str, Any], bounds: Bounds):
+        """Hold an item back from a recipient until they pan to it"""
+        held = self.deferred.setdefault(user_id, [])
+        if len(held) >= self.max_deferred:
+            held.clear()
+            self.overflowed[user_id] = True
+        held.append({"item": item, "bounds": bounds})
+        VIEWPORT_DEFERRED.inc()
+
+    def is_holding(self, user_id: str) -> bool:
+        """Whether a recipient has items held back, or dropped since their last viewport change"""
+        return bool(self.deferred.get(user_id)) or self.overflowed.get(user_id, False)
+
+    def clear_deferred(self, user_id: str):
+        """Forget held items, e.g. after a clear or when leaving the room"""
+        self.deferred.pop(user_id, None)
+        self.overflowed.pop(user_id, None)
+
+    def remove(self, user_id: str):
+        """Forget everything about a recipient"""
+        self.viewports.pop(user_id, None)
+        self.clear_deferred(user_id)
+
+    def pending(self) -> int:
+        """Items held back across all recipients"""
+        return sum(len(held) for held in self.deferred.values())
@@ -1,13 +1,75 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
-from ..services.webrtc_service import webrtc_manager
-from ..services.auth_service import get_current_user
+from typing import Dict, Optional
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Body, Depends, Header, HTTPException, Query, status
+from ..models.user import User
+from ..models.whiteboard import RateLimit
+from ..services.webrtc_service import CLIENT_MESSAGE_TYPES, CLOSE_MIGRATED, WS_MESSAGES_RECEIVED, webrtc_manager
+from ..services.rate_limit import (
+    ADMIT,
+    CATEGORY_DRAWING,
+    DISCONNECT,
+    DROP,
+    HOLD,
+    WS_FRAMES_TOO_LARGE,
+    WS_MAX_FRAME_BYTES,
+    message_category,
+)
+from ..services.serialization import encode_message, loads
+from ..services.stroke_codec import StrokeCodecError, decode_stroke, parse_subprotocol, validate_stroke_frame
+from ..services.stroke_writer import PERSIST_LIVE_STROKES, drawing_data_to_element, stroke_buffer
+from ..services.viewport import parse_viewport
+from ..services.simplify import SIMPLIFY_ENABLED, simplify_drawing_data, simplify_stroke_frame
+from ..services.structured_logging import SampledLogger
+from ..services.auth_service import authenticate_token, get_current_user, get_token_expiry
+from ..services.whiteboard_service import get_board_access, get_element_delta, save_room_settings
 from ..database.mongodb import get_db
-import json
 import logging
+import os
 
 logger = logging.getLogger(__name__)
+hot_log = SampledLogger(logger)
 router = APIRouter()
 
+# Elements per sync_delta message when catching up a client
+SYNC_PAGE_SIZE = 1000
+
+# Shared secret for changing the shard map; unset disables the endpoint
+SHARD_ADMIN_TOKEN = os.getenv("SHARD_ADMIN_TOKEN")
+
+STROKES_RECEIVED = WS_MESSAGES_RECEIVED.labels("stroke")
+
+# Close code for frames over WS_MAX_FRAME_BYTES
+CLOSE_MESSAGE_TOO_BIG = 1009
+
+async def send_sync_delta(db, user_id: str, whiteboard_id: str, since: int):
+    """Send a client the drawing elements it missed since a sequence number"""
+    while True:
+        delta = await get_element_delta(db, whiteboard_id, since, SYNC_PAGE_SIZE)
+        await webrtc_manager.send_to_user(user_id, {"type": "sync_delta", **delta.dict()})
+        if not delta.has_more:
+            break
+        since = delta.last_seq
+
+def persist_drawing_data(user_id: str, drawing_data: dict):
+    """Queue a live stroke for write-behind persistence on the user's board"""
+    whiteboard_id = webrtc_manager.get_user_session(user_id)
+    if not PERSIST_LIVE_STROKES or whiteboard_id is None:
+        return
+    element = drawing_data_to_element(drawing_data)
+    if element is None:
+        hot_log.warning("invalid_drawing_data", "Not persisting invalid drawing data from %s", user_id)
+        return
+    stroke_buffer.add(whiteboard_id, element)
+
+async def authorize_whiteboard(db, user_id: str, whiteboard_id: str) -> bool:
+    """Check board access once per connection and remember the result"""
+    if webrtc_manager.is_authorized(user_id, whiteboard_id):
+        return True
+    access = await get_board_access(db, whiteboard_id)
+    if not access or not access.can_edit(user_id):
+        return False
+    webrtc_manager.set_authorized(user_id, whiteboard_id)
+    return True
+
 @router.websocket("/ws/{token}")
 async def websocket_endpoint(
     websocket: WebSocket, 
@@ -16,44 +78,136 @@ async def websocket_endpoint(
     db=Depends(get_db)
 ):
     """WebSocket endpoint for WebRTC signaling and real-time updates"""
+    # Authenticate once at the handshake; frames are trusted after this
+    user = await authenticate_token(db, token)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    user_id = user.id
+    
+    # Negotiate the stroke encoding
+    subprotocol = parse_subprotocol(websocket.scope.get("subprotocols", []))
+    
+    # Send clients of a board owned by another node there before registering them
+    redirect = webrtc_manager.shard_map.redirect_for(whiteboard_id)
+    if redirect:
+        await websocket.accept(subprotocol=subprotocol)
+        await websocket.send_text(encode_message({"type": "redirect", "whiteboard_id": whiteboard_id, **redirect}))
+        await websocket.close(code=CLOSE_MIGRATED)
+        return
+    
     try:
         # Connect to WebSocket
-        await webrtc_manager.connect(websocket, token)
+        await webrtc_manager.connect(websocket, user_id, {"username": user.username}, subprotocol=subprotocol)
+        webrtc_manager.schedule_expiry(user_id, get_token_expiry(token))
         
         # Join whiteboard session
-        await webrtc_manager.join_whiteboard(token, whiteboard_id)
+        if await authorize_whiteboard(db, user_id, whiteboard_id):
+            await webrtc_manager.join_whiteboard(user_id, whiteboard_id)
+        else:
+            webrtc_manager.end_connection(user_id, {"type": "access_denied", "whiteboard_id": whiteboard_id}, status.WS_1008_POLICY_VIOLATION)
+            return
         
         try:
             while True:
                 # Receive message from client
-                data = await websocket.receive_text()
-                message = json.loads(data)
+                frame = await websocket.receive()
+                if frame["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(frame.get("code", 1000))
+                
+                # Text length is in characters, a lower bound on its size in bytes
+                if len(frame.get("bytes") or frame.get("text") or "") > WS_MAX_FRAME_BYTES:
+                    WS_FRAMES_TOO_LARGE.inc()
+                    webrtc_manager.end_connection(user_id, {"type": "frame_too_large", "max_bytes": WS_MAX_FRAME_BYTES}, CLOSE_MESSAGE_TOO_BIG)
+                    return
+                
+                if frame.get("bytes") is not None:
+                    # Binary stroke frames are relayed without decoding
+                    STROKES_RECEIVED.inc()
+                    try:
+                        validate_stroke_frame(frame["bytes"])
+                    except StrokeCodecError as e:
+                        hot_log.warning("invalid_stroke_frame", "Invalid stroke frame from %s: %s", user_id, e)
+                        continue
+                    decision = webrtc_manager.throttle_message(user_id, CATEGORY_DRAWING)
+                    if decision == DISCONNECT:
+                        return
+                    stroke = frame["bytes"]
+                    if SIMPLIFY_ENABLED and decision != DROP:
+                        stroke = simplify_stroke_frame(stroke)
+                    if decision == HOLD:
+                        drawing_data = decode_stroke(stroke)
+                        webrtc_manager.hold_drawing_data(user_id, drawing_data)
+                        persist_drawing_data(user_id, drawing_data)
+                    if decision != ADMIT:
+                        continue
+                    await webrtc_manager.broadcast_binary_stroke(user_id, stroke)
+                    if PERSIST_LIVE_STROKES:
+                        persist_drawing_data(user_id, decode_stroke(stroke))
+                    continue
+                
+                message = loads(frame["text"])
                 
                 # Handle different message types
                 message_type = message.get("type")
+                WS_MESSAGES_RECEIVED.labels(message_type if message_type in CLIENT_MESSAGE_TYPES else "unknown").inc()
+                
+                decision = webrtc_manager.throttle_message(user_id, message_category(message_type))
+                if decision == DISCONNECT:
+                    return
+                if message_type == "drawing_data" and decision != DROP:
+                    # Relayed and persisted strokes are both the simplified ones
+                    message["data"] = simplify_drawing_data(message.get("data", {}))
+                if decision == HOLD:
+                    # Only drawing data is held; it is persisted now and relayed merged later
+                    webrtc_manager.hold_drawing_data(user_id, message.get("data", {}))
+                    persist_drawing_data(user_id, message.get("data", {}))
+                if decision != ADMIT:
+                    continue
                 
                 if message_type == "drawing_data":
                     # Broadcast drawing data to other users in the session
-                    await webrtc_manager.broadcast_drawing_data(token, message.get("data", {}))
+                    await webrtc_manager.broadcast_drawing_data(user_id, message.get("data", {}))
+                    persist_drawing_data(user_id, message.get("data", {}))
                 elif message_type in ["offer", "answer", "ice_candidate"]:
                     # Handle WebRTC signaling
-                    await webrtc_manager.handle_webrtc_signaling(token, message)
+                    await webrtc_manager.handle_webrtc_signaling(user_id, message)
                 elif message_type == "join_session":
                     # Join a whiteboard session
-                    await webrtc_manager.join_whiteboard(token, message.get("whiteboard_id"))
+                    join_id = message.get("whiteboard_id")
+                    if not await authorize_whiteboard(db, user_id, join_id):
+                        await webrtc_manager.send_to_user(user_id, {"type": "access_denied", "whiteboard_id": join_id})
+                        continue
+                    redirect = webrtc_manager.shard_map.redirect_for(join_id)
+                    if redirect:
+                        await webrtc_manager.send_to_user(user_id, {"type": "redirect", "whiteboard_id": join_id, **redirect})
+                        continue
+                    await webrtc_manager.join_whiteboard(user_id, join_id)
+                    
+                    # Catch the client up if it already holds elements up to a sequence number
+                    since = message.get("since")
+                    if isinstance(since, int) and since >= 0:
+                        await send_sync_delta(db, user_id, join_id, since)
                 elif message_type == "leave_session":
                     # Leave current whiteboard session
-                    await webrtc_manager.leave_whiteboard(token)
+                    await webrtc_manager.leave_whiteboard(user_id)
+                elif message_type == "viewport":
+                    # Only strokes near the visible canvas area are sent right away
+                    bounds = parse_viewport(message.get("bbox"))
+                    if bounds is None:
+                        hot_log.warning("invalid_viewport", "Invalid viewport from %s: %r", user_id, message.get("bbox"))
+                        continue
+                    webrtc_manager.set_viewport(user_id, bounds)
                 else:
-                    logger.warning(f"Unknown message type: {message_type}")
+                    hot_log.warning("unknown_message_type", "Unknown message type: %r", message_type)
                     
         except WebSocketDisconnect:
             # Handle disconnection
-            webrtc_manager.disconnect(token)
+            webrtc_manager.disconnect(user_id, websocket)
             
     except Exception as e:
-        logger.error(f"WebSocket error: {e}")
-        webrtc_manager.disconnect(token)
+        webrtc_manager.room_errors.record(whiteboard_id, "websocket_error", repr(e))
+        webrtc_manager.disconnect(user_id, websocket)
 
 @router.get("/sessions/{session_id}/users")
 async def get_active_users(
@@ -62,5 +216,118 @@ async def get_active_users(
     db=Depends(get_db)
 ):
     """Get list of active users in a whiteboard session"""
-    active_users = webrtc_manager.get_session_users(session_id)
-    return {"session_id": session_id, "active_users": active_users}
\ No newline at end of file
+    active_users = await webrtc_manager.get_session_users(session_id)
+    return {"session_id": session_id, "active_users": active_users}
+
+@router.get("/stats")
+async def get_connection_stats(
+    current_user: dict = Depends(get_current_user)
+):
+    """Get outbound queue, drawing batch, throttling and stroke persistence counters"""
+    return {
+        "queues": webrtc_manager.get_queue_stats(),
+        "batching": webrtc_manager.batching_stats.to_dict(),
+        "throttling": webrtc_manager.get_throttle_stats(),
+        "persistence": stroke_buffer.stats()
+    }
+
+@router.get("/shards")
+async def get_shard_map(
+    whiteboard_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Get the room affinity map, and a board's owner if one is given"""
+    shards = webrtc_manager.shard_map.to_dict()
+    if whiteboard_id:
+        shards["owner"] = webrtc_manager.shard_map.owner(whiteboard_id)
+    return shards
+
+@router.put("/shards")
+async def update_shard_map(
+    nodes: Dict[str, str] = Body(..., embed=True),
+    x_shard_admin_token: Optional[str] = Header(None)
+):
+    """Change room ownership on every node and hand off rooms that move"""
+    if not SHARD_ADMIN_TOKEN or x_shard_admin_token != SHARD_ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Shard map changes are not allowed"
+        )
+    await webrtc_manager.publish_shard_map(nodes)
+    return webrtc_manager.shard_map.to_dict()
+
+@router.put("/sessions/{session_id}/tick")
+async def set_session_tick(
+    session_id: str,
+    tick_ms: int = Query(..., ge=0),
+    current_user: User = Depends(get_current_user),
+    db=Depends(get_db)
+):
+    """Enable tick-based drawing batching for a session (0 disables it)"""
+    access = await get_board_access(db, session_id)
+    if not access:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Whiteboard not found"
+        )
+    
+    # Check if user is the owner
+    if access.owner_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only the owner can change batching"
+        )
+    
+    try:
+        webrtc_manager.set_room_tick(session_id, tick_ms)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    # Stored for workers that open the room later, published to those serving it now
+    await save_room_settings(db, session_id, {"tick_ms": tick_ms})
+    await webrtc_manager.publish_room_settings(session_id, {"tick_ms": tick_ms})
+    return {"session_id": session_id, "tick_ms": tick_ms}
+
+@router.put("/sessions/{session_id}/rate-limits")
+async def set_session_rate_limits(
+    session_id: str,
+    limits: Dict[str, RateLimit] = Body(..., embed=True),
+    current_user: User = Depends(get_current_user),
+    db=Depends(get_db)
+):
+    """Override inbound rate limits per message category for a session (empty resets them)"""
+    access = await get_board_access(db, session_id)
+    if not access:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Whiteboard not found"
+        )
+    
+    # Check if user is the owner
+    if access.owner_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only the owner can change rate limits"
+        )
+    
+    overrides = {category: (limit.rate, limit.burst) for category, limit in limits.items()}
+    try:
+        webrtc_manager.set_room_rate_limits(session_id, overrides)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    # Stored for workers that open the room later, published to those serving it now
+    settings = {"rate_limits": {category: list(limit) for category, limit in overrides.items()}}
+    await save_room_settings(db, session_id, settings)
+    await webrtc_manager.publish_room_settings(session_id, settings)
+    effective = webrtc_manager.rate_limits_for(session_id)
+    return {
+        "session_id": session_id,
+        "limits": {category: {"rate": rate, "burst": burst} for category, (rate, burst) in effective.items()}
+    }
\ No newline at end of file
@@ -1,62 +1,194 @@
 import asyncio
-import json
 import logging
-from typing import Dict, List, Optional, Set
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
 from fastapi import WebSocket, WebSocketDisconnect
 from ..models.whiteboard import DrawingElement
+from .backplane import (
+    CONTROL_CHANNEL,
+    NODE_ID,
+    Backplane,
+    InMemoryBackplane,
+    create_backplane,
+    decode_envelope,
+    encode_envelope,
+    room_channel,
+    user_channel,
+)
+from .metrics import REGISTRY
+from .rate_limit import (
+    DISCONNECT,
+    WS_RATE_LIMITS,
+    InboundThrottle,
+    RateLimits,
+    validate_limits,
+)
+from .send_queue import ConnectionSender
+from .serialization import encode_message, loads
+from .sharding import ROOM_HANDOFF_GRACE_SECONDS, ShardMap, shard_map as default_shard_map
+from .stroke_codec import BINARY_SUBPROTOCOL, decode_stroke, relay_frame
+from .structured_logging import RoomErrorAggregator, SampledLogger
+from .viewport import Bounds, ViewportFilter, drawing_bounds
+from .stroke_batcher import (
+    DEFAULT_TICK_MS,
+    MAX_TICK_MS,
+    MIN_TICK_MS,
+    BatchingStats,
+    RoomBatcher,
+)
 
 logger = logging.getLogger(__name__)
+# Connection churn and per-message failures are sampled so floods can't swamp the log
+hot_log = SampledLogger(logger)
+
+# Close codes sent when the server ends a connection
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+CLOSE_SESSION_EXPIRED = 4001
+CLOSE_REPLACED = 4002
+CLOSE_MIGRATED = 4003
+
+# Client message types counted by name; anything else is counted as "unknown"
+CLIENT_MESSAGE_TYPES = {
+    "drawing_data", "offer", "answer", "ice_candidate", "join_session", "leave_session", "stroke", "viewport"
+}
+
+WS_MESSAGES_RECEIVED = REGISTRY.counter(
+    "whiteboard_ws_messages_received_total", "WebSocket messages received by type", ["type"]
+)
+WS_MESSAGES_SENT = REGISTRY.counter(
+    "whiteboard_ws_messages_sent_total", "Messages queued to WebSocket clients by type", ["type"]
+)
+BROADCAST_FANOUT = REGISTRY.histogram(
+    "whiteboard_broadcast_fanout", "Local recipients per room broadcast",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+BROADCAST_SECONDS = REGISTRY.histogram(
+    "whiteboard_broadcast_duration_seconds", "Time to queue a room broadcast for its local recipients",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+)
+BACKPLANE_PUBLISH_FAILURES = REGISTRY.counter(
+    "whiteboard_backplane_publish_failures_total", "Messages that could not be published to other nodes"
+)
 
 class WebRTCManager:
-    def __init__(self):
+    def __init__(self, backplane: Optional[Backplane] = None, node_id: str = NODE_ID, shard_map: Optional[ShardMap] = None):
+        # Rooms can span workers: local members are served directly and
+        # everything is also published for the other nodes
+        self.backplane = backplane if backplane is not None else InMemoryBackplane()
+        self.node_id = node_id
+        self._background: Set[asyncio.Task] = set()
+        
+        # Optional room affinity; handoff hooks run before a room moves away
+        self.shard_map = shard_map if shard_map is not None else ShardMap({}, node_id)
+        self.handoff_hooks: List[Callable[[str], Awaitable[Any]]] = []
+        self.room_handoffs = 0
+        # Run with a whiteboard id when any node reports a change to the board's ACL
+        self.access_hooks: List[Callable[[str], Any]] = []
+        # Loads a board's stored room settings when its room opens on this node
+        self.settings_loader: Optional[Callable[[str], Awaitable[Optional[Dict[str, Any]]]]] = None
+        
         # Store active connections and peer connections
         self.active_connections: Dict[str, WebSocket] = {}
-        self.whiteboard_sessions: Dict[str, Set[str]] = set()  # whiteboard_id -> set of user_ids
+        self.senders: Dict[str, ConnectionSender] = {}  # user_id -> outbound queue
+        self.throttles: Dict[str, InboundThrottle] = {}  # user_id -> inbound rate limits
+        self.whiteboard_sessions: Dict[str, Set[str]] = {}  # whiteboard_id -> set of user_ids
         self.user_sessions: Dict[str, str] = {}  # user_id -> whiteboard_id
         self.user_info: Dict[str, Dict] = {}  # user_id -> user info
+        self.protocols: Dict[str, Optional[str]] = {}  # user_id -> negotiated subprotocol
+        self.slow_consumer_disconnects = 0
+        self.room_ticks: Dict[str, int] = {}  # whiteboard_id -> tick in ms
+        self.room_rate_limits: Dict[str, RateLimits] = {}  # whiteboard_id -> limits overriding the defaults
+        self.rate_limit_disconnects = 0
+        self.batchers: Dict[str, RoomBatcher] = {}  # whiteboard_id -> pending drawing data
+        self.batching_stats = BatchingStats()
+        self.viewport_filter = ViewportFilter()  # drawing held back from members who can't see it
+        self.authorized_boards: Dict[str, Set[str]] = {}  # user_id -> whiteboards checked at join
+        self.expiry_timers: Dict[str, asyncio.TimerHandle] = {}  # user_id -> token expiry
+        self.room_errors = RoomErrorAggregator(logger)
+
+    async def start(self):
+        """Start receiving messages published by other nodes"""
+        await self.backplane.start(self._on_backplane_message)
+        await self._backplane_call(self.backplane.subscribe(CONTROL_CHANNEL))
+
+    async def stop(self):
+        """Stop receiving messages from other nodes"""
+        await self.backplane.close()
 
-    async def connect(self, websocket: WebSocket, user_id: str, user_info: Dict = None):
+    async def connect(self, websocket: WebSocket, user_id: str, user_info: Dict = None, subprotocol: Optional[str] = None):
         """Connect a user to the WebSocket"""
-        await websocket.accept()
+        await websocket.accept(subprotocol=subprotocol)
+        if user_id in self.active_connections:
+            # The newest connection wins, e.g. when the same user reconnects
+            self.end_connection(user_id, {"type": "connection_replaced"}, CLOSE_REPLACED)
         self.active_connections[user_id] = websocket
+        self.protocols[user_id] = subprotocol
+        sender = ConnectionSender(websocket, user_id, self._drop_connection)
+        sender.start()
+        self.senders[user_id] = sender
+        self.throttles[user_id] = InboundThrottle(user_id)
         self.user_info[user_id] = user_info or {"username": user_id}
-        logger.info(f"User {user_id} connected")
+        await self._backplane_call(self.backplane.subscribe(user_channel(user_id)))
+        hot_log.info("user_connected", "User %s connected", user_id)
+
+    def disconnect(self, user_id: str, websocket: Optional[WebSocket] = None):
+        """Disconnect a user from the WebSocket
 
-    def disconnect(self, user_id: str):
-        """Disconnect a user from the WebSocket"""
+        If websocket is given, nothing happens unless it is still the
+        user's current connection.
+        """
+        if websocket is not None and self.active_connections.get(user_id) is not websocket:
+            return
+        
         if user_id in self.active_connections:
             del self.active_connections[user_id]
         
+        timer = self.expiry_timers.pop(user_id, None)
+        if timer:
+            timer.cancel()
+        self.authorized_boards.pop(user_id, None)
+        
+        sender = self.senders.pop(user_id, None)
+        if sender:
+            sender.close()
+        throttle = self.throttles.pop(user_id, None)
+        if throttle:
+            throttle.close()
+        self.viewport_filter.remove(user_id)
+        
         # Remove from any whiteboard session
         if user_id in self.user_sessions:
             whiteboard_id = self.user_sessions[user_id]
-            if whiteboard_id in self.whiteboard_sessions:
-                self.whiteboard_sessions[whiteboard_id].discard(user_id)
-                if not self.whiteboard_sessions[whiteboard_id]:
-                    del self.whiteboard_sessions[whiteboard_id]
+            self._remove_from_room(user_id, whiteboard_id)
             del self.user_sessions[user_id]
         
         if user_id in self.user_info:
             del self.user_info[user_id]
         
-        logger.info(f"User {user_id} disconnected")
+        self.protocols.pop(user_id, None)
+        self._spawn(self._release_user_channel(user_id))
+        
+        hot_log.info("user_disconnected", "User %s disconnected", user_id)
 
     async def join_whiteboard(self, user_id: str, whiteboard_id: str):
         """Join a whiteboard session"""
         # Leave current session if in one
         if user_id in self.user_sessions:
-            current_whiteboard = self.user_sessions[user_id]
-            if current_whiteboard in self.whiteboard_sessions:
-                self.whiteboard_sessions[current_whiteboard].discard(user_id)
-                if not self.whiteboard_sessions[current_whiteboard]:
-                    del self.whiteboard_sessions[current_whiteboard]
+            self._remove_from_room(user_id, self.user_sessions[user_id])
         
         # Join new session
         if whiteboard_id not in self.whiteboard_sessions:
             self.whiteboard_sessions[whiteboard_id] = set()
+            await self._backplane_call(self.backplane.subscribe(room_channel(whiteboard_id)))
+            await self._load_room_settings(whiteboard_id)
         
         self.whiteboard_sessions[whiteboard_id].add(user_id)
         self.user_sessions[user_id] = whiteboard_id
+        await self._backplane_call(self.backplane.set_presence(
+            whiteboard_id, user_id, {"node": self.node_id, "user_info": self.user_info.get(user_id, {})}
+        ))
         
         # Notify other users in the session
         await self.broadcast_to_whiteboard(
@@ -69,20 +201,20 @@ class WebRTCManager:
             exclude_user=user_id
         )
         
-        # Send current users list to the new user
-        current_users = list(self.whiteboard_sessions[whiteboard_id])
+        # Send current users list to the new user, including other nodes
+        current_users = await self._room_presence(whiteboard_id)
         await self.send_to_user(user_id, {
             "type": "current_users",
             "users": [
                 {
                     "user_id": uid,
-                    "user_info": self.user_info.get(uid, {})
+                    "user_info": user_info
                 }
-                for uid in current_users if uid != user_id
+                for uid, user_info in current_users.items() if uid != user_id
             ]
-        })
+        }, coalesce_key="current_users")
         
-        logger.info(f"User {user_id} joined whiteboard {whiteboard_id}")
+        hot_log.info("user_joined", "User %s joined whiteboard %s", user_id, whiteboard_id)
 
     async def leave_whiteboard(self, user_id: str):
         """Leave a whiteboard session"""
@@ -101,48 +233,185 @@ class WebRTCManager:
             )
             
             # Remove from session
-            if whiteboard_id in self.whiteboard_sessions:
-                self.whiteboard_sessions[whiteboard_id].discard(user_id)
-                if not self.whiteboard_sessions[whiteboard_id]:
-                    del self.whiteboard_sessions[whiteboard_id]
+            self._remove_from_room(user_id, whiteboard_id)
             
             del self.user_sessions[user_id]
-            logger.info(f"User {user_id} left whiteboard {whiteboard_id}")
+            hot_log.info("user_left", "User %s left whiteboard %s", user_id, whiteboard_id)
+
+    def _remove_from_room(self, user_id: str, whiteboard_id: str):
+        """Remove a user from a room and drop the room once it is empty"""
+        self.viewport_filter.clear_deferred(user_id)
+        if whiteboard_id in self.whiteboard_sessions:
+            self.whiteboard_sessions[whiteboard_id].discard(user_id)
+            self._spawn(self._release_presence(whiteboard_id, user_id))
+            if not self.whiteboard_sessions[whiteboard_id]:
+                del self.whiteboard_sessions[whiteboard_id]
+                batcher = self.batchers.pop(whiteboard_id, None)
+                if batcher:
+                    batcher.close()
+                self._spawn(self._release_room(whiteboard_id))
 
     async def broadcast_to_whiteboard(self, whiteboard_id: str, message: dict, exclude_user: Optional[str] = None):
         """Broadcast a message to all users in a whiteboard session"""
-        if whiteboard_id in self.whiteboard_sessions:
-            disconnected_users = []
-            for user_id in self.whiteboard_sessions[whiteboard_id]:
-                if user_id != exclude_user and user_id in self.active_connections:
-                    try:
-                        await self.active_connections[user_id].send_text(json.dumps(message))
-                    except Exception as e:
-                        logger.error(f"Error sending message to user {user_id}: {e}")
-                        disconnected_users.append(user_id)
-            
-            # Clean up disconnected users
-            for user_id in disconnected_users:
-                self.disconnect(user_id)
+        # Encode once and share the payload across all recipients
+        payload = encode_message(message)
+        message_type = message.get("type", "message")
+        self._deliver_to_room(whiteboard_id, payload, exclude_user, message_type)
+        await self._publish(
+            room_channel(whiteboard_id), {"k": "room", "w": whiteboard_id, "x": exclude_user, "t": message_type}, payload
+        )
+
+    def _deliver_to_room(self, whiteboard_id: str, payload: Any, exclude_user: Optional[str] = None,
+                         message_type: str = "message"):
+        """Queue a payload for the room's members connected to this node"""
+        started = time.perf_counter()
+        recipients = 0
+        for user_id in list(self.whiteboard_sessions.get(whiteboard_id, ())):
+            if user_id != exclude_user:
+                self._enqueue(user_id, payload)
+                recipients += 1
+        self._record_fanout(message_type, recipients, started)
+
+    async def announce_persisted(self, whiteboard_id: str, first_seq: int, last_seq: int):
+        """Tell a room's members on every node that its live strokes from first_seq to last_seq are stored"""
+        payload = encode_message({
+            "type": "strokes_persisted", "whiteboard_id": whiteboard_id, "first_seq": first_seq, "last_seq": last_seq
+        })
+        self._deliver_persisted(whiteboard_id, payload)
+        await self._publish(room_channel(whiteboard_id), {"k": "persisted", "w": whiteboard_id}, payload)
+
+    def _deliver_persisted(self, whiteboard_id: str, payload: str):
+        """Queue a strokes_persisted message for local members who have drawn everything it covers"""
+        members = self.whiteboard_sessions.get(whiteboard_id)
+        if not members:
+            return
+        # Drawing data waiting for the next tick goes out ahead of the seqs that cover it
+        batcher = self.batchers.get(whiteboard_id)
+        if batcher:
+            batcher.flush()
+        started = time.perf_counter()
+        recipients = 0
+        for user_id in list(members):
+            # Members with strokes held back for their viewport keep their seq until they resync
+            if not self.viewport_filter.is_holding(user_id):
+                self._enqueue(user_id, payload)
+                recipients += 1
+        self._record_fanout("strokes_persisted", recipients, started)
+
+    def _record_fanout(self, message_type: str, recipients: int, started: float):
+        """Record how many local clients a broadcast reached and how long queueing took"""
+        if recipients:
+            WS_MESSAGES_SENT.labels(message_type).inc(recipients)
+        BROADCAST_FANOUT.observe(recipients)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started)
+
+    async def send_to_user(self, user_id: str, message: dict, coalesce_key: Optional[str] = None):
+        """Send a message to a specific user, wherever they are connected"""
+        payload = encode_message(message)
+        message_type = message.get("type", "message")
+        if user_id in self.senders:
+            self._enqueue(user_id, payload, coalesce_key)
+            WS_MESSAGES_SENT.labels(message_type).inc()
+        else:
+            await self._publish(user_channel(user_id), {"k": "user", "u": user_id, "t": message_type}, payload)
+
+    def _enqueue(self, user_id: str, payload: Any, coalesce_key: Optional[str] = None):
+        """Queue a payload on a user's connection without waiting for the send"""
+        sender = self.senders.get(user_id)
+        if sender:
+            sender.enqueue(payload, coalesce_key)
 
-    async def send_to_user(self, user_id: str, message: dict):
-        """Send a message to a specific user"""
+    def _drop_connection(self, user_id: str, reason: str):
+        """Disconnect a user whose writer failed or fell too far behind"""
+        websocket = self.active_connections.get(user_id)
+        if reason == "overflow":
+            self.slow_consumer_disconnects += 1
+        sender = self.senders.get(user_id)
+        self.room_errors.record(
+            self.user_sessions.get(user_id), reason, sender.last_error if sender else user_id
+        )
+        self.disconnect(user_id)
+        if websocket is not None:
+            self._close_later(websocket)
+
+    def _close_later(self, websocket: WebSocket, code: int = CLOSE_TRY_AGAIN_LATER, final_message: Optional[dict] = None):
+        """Close a WebSocket from a synchronous code path, keeping the task alive until it finishes"""
+        task = asyncio.create_task(self._close_websocket(websocket, code, final_message))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _close_websocket(self, websocket: WebSocket, code: int = CLOSE_TRY_AGAIN_LATER, final_message: Optional[dict] = None):
+        """Close a WebSocket, ignoring errors from an already dead connection"""
+        try:
+            if final_message is not None:
+                await websocket.send_text(encode_message(final_message))
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    def end_connection(self, user_id: str, message: Optional[dict], code: int):
+        """Tell a user why their connection is ending, then close it"""
+        websocket = self.active_connections.get(user_id)
+        if websocket is None:
+            return
+        self.disconnect(user_id)
+        self._close_later(websocket, code, message)
+
+    def schedule_expiry(self, user_id: str, expires_at: Optional[float]):
+        """Close a connection when the token it authenticated with expires"""
+        timer = self.expiry_timers.pop(user_id, None)
+        if timer:
+            timer.cancel()
+        if expires_at is None:
+            return
+        delay = max(0.0, expires_at - time.time())
+        self.expiry_timers[user_id] = asyncio.get_running_loop().call_later(
+            delay, self.end_connection, user_id, {"type": "session_expired"}, CLOSE_SESSION_EXPIRED
+        )
+
+    def is_authorized(self, user_id: str, whiteboard_id: str) -> bool:
+        """Whether a board's access check already passed for this connection"""
+        return whiteboard_id in self.authorized_boards.get(user_id, ())
+
+    def set_authorized(self, user_id: str, whiteboard_id: str):
+        """Remember a passed access check for the rest of the connection"""
         if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Error sending message to user {user_id}: {e}")
-                self.disconnect(user_id)
+            self.authorized_boards.setdefault(user_id, set()).add(whiteboard_id)
+
+    async def revoke_whiteboard_access(self, whiteboard_id: str, user_ids: Optional[List[str]] = None):
+        """Forget cached access to a board and remove the users from its room
+
+        With no user_ids, everyone who joined the board loses access.
+        """
+        if user_ids is None:
+            user_ids = [uid for uid, boards in self.authorized_boards.items() if whiteboard_id in boards]
+        for user_id in user_ids:
+            self.authorized_boards.get(user_id, set()).discard(whiteboard_id)
+            if self.user_sessions.get(user_id) == whiteboard_id:
+                await self.leave_whiteboard(user_id)
+                await self.send_to_user(user_id, {"type": "access_revoked", "whiteboard_id": whiteboard_id})
+
+    async def publish_access_change(self, whiteboard_id: str, revoked: bool = False):
+        """Apply a board ACL change on this node and every other one"""
+        await self.apply_access_change(whiteboard_id, revoked)
+        await self._publish(CONTROL_CHANNEL, {"k": "access", "w": whiteboard_id}, encode_message({"revoked": revoked}))
+
+    async def apply_access_change(self, whiteboard_id: str, revoked: bool):
+        """Forget cached access to a board, and its room members too if access was revoked"""
+        for hook in self.access_hooks:
+            hook(whiteboard_id)
+        if revoked:
+            await self.revoke_whiteboard_access(whiteboard_id)
 
     async def handle_webrtc_signaling(self, user_id: str, data: dict):
         """Handle WebRTC signaling messages"""
         message_type = data.get("type")
         target_user_id = data.get("target_user_id")
         
-        if not target_user_id or target_user_id not in self.active_connections:
+        if not target_user_id:
             return
         
-        # Forward the message to the target user
+        # Forward the message to the target user, on this node or another
         message = data.copy()
         message["source_user_id"] = user_id
         
@@ -154,28 +423,450 @@ class WebRTCManager:
             return
         
         whiteboard_id = self.user_sessions[user_id]
+        message = {
+            "type": "drawing_data",
+            "user_id": user_id,
+            "data": drawing_data,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        payload = encode_message(message)
+        self._relay_drawing(whiteboard_id, message, payload)
+        await self._publish(room_channel(whiteboard_id), {"k": "drawing", "w": whiteboard_id}, payload)
+
+    def _relay_drawing(self, whiteboard_id: str, message: dict, payload: str):
+        """Relay drawing data to local room members, batching in tick mode"""
+        members = self.whiteboard_sessions.get(whiteboard_id)
+        if not members:
+            return
+        
+        # Rooms in tick mode relay drawing data in batches
+        tick_ms = self.room_ticks.get(whiteboard_id, DEFAULT_TICK_MS)
+        if tick_ms > 0:
+            batcher = self.batchers.get(whiteboard_id)
+            if batcher is None or batcher.tick_ms != tick_ms:
+                if batcher:
+                    batcher.close()
+                batcher = RoomBatcher(whiteboard_id, tick_ms, self._send_drawing_batch)
+                self.batchers[whiteboard_id] = batcher
+            recipients = len(members) - (message["user_id"] in members)
+            self.batching_stats.record_incoming(len(payload), recipients)
+            batcher.add(message["user_id"], message["data"], message["timestamp"])
+            return
         
         # Broadcast to all users in the session except the sender
-        await self.broadcast_to_whiteboard(
-            whiteboard_id,
-            {
-                "type": "drawing_data",
-                "user_id": user_id,
-                "data": drawing_data,
-                "timestamp": datetime.utcnow().isoformat()
-            },
-            exclude_user=user_id
+        if self.viewport_filter.watches(members):
+            self._deliver_drawing(whiteboard_id, message, payload)
+        else:
+            self._deliver_to_room(whiteboard_id, payload, exclude_user=message["user_id"], message_type="drawing_data")
+
+    def _deliver_drawing(self, whiteboard_id: str, message: dict, payload: str):
+        """Queue drawing data for members who can see it and hold it back from the rest"""
+        started = time.perf_counter()
+        recipients = 0
+        bounds = drawing_bounds(message["data"])
+        item = None
+        for user_id in list(self.whiteboard_sessions.get(whiteboard_id, ())):
+            if user_id == message["user_id"]:
+                continue
+            if self._filter_drawing(user_id, message["data"], bounds):
+                self._enqueue(user_id, payload)
+                recipients += 1
+            else:
+                if item is None:
+                    item = {"user_id": message["user_id"], "data": message["data"], "timestamp": message["timestamp"]}
+                self.viewport_filter.defer(user_id, item, bounds)
+        self._record_fanout("drawing_data", recipients, started)
+
+    def _filter_drawing(self, user_id: str, drawing_data: Any, bounds: Optional[Bounds]) -> bool:
+        """Whether a member should get drawing data now
+
+        A clear also drops whatever was held back from the member, since
+        it would be wiped anyway.
+        """
+        if bounds is None and isinstance(drawing_data, dict) and drawing_data.get("tool") == "clear":
+            self.viewport_filter.clear_deferred(user_id)
+        return self.viewport_filter.is_visible(user_id, bounds)
+
+    def set_viewport(self, user_id: str, bounds: Bounds):
+        """Record the canvas area a user can see and send them what was held back from it"""
+        visible, resync = self.viewport_filter.set_viewport(user_id, bounds)
+        if resync:
+            # Held items overflowed, so the client reloads its viewport from the stroke log
+            self._enqueue(user_id, encode_message({"type": "viewport_resync", "whiteboard_id": self.user_sessions.get(user_id)}))
+            WS_MESSAGES_SENT.labels("viewport_resync").inc()
+        if visible:
+            self._enqueue(user_id, encode_message({
+                "type": "drawing_batch", "items": visible, "timestamp": datetime.utcnow().isoformat()
+            }))
+            WS_MESSAGES_SENT.labels("drawing_batch").inc()
+
+    async def broadcast_binary_stroke(self, user_id: str, frame: bytes):
+        """Relay a binary stroke frame, decoding it only for JSON clients"""
+        if user_id not in self.user_sessions:
+            return
+        
+        whiteboard_id = self.user_sessions[user_id]
+        self._relay_stroke(whiteboard_id, user_id, frame)
+        await self._publish(room_channel(whiteboard_id), {"k": "stroke", "w": whiteboard_id, "u": user_id}, frame)
+
+    def _relay_stroke(self, whiteboard_id: str, user_id: str, frame: bytes):
+        """Relay a binary stroke frame to local room members"""
+        started = time.perf_counter()
+        recipients = 0
+        relayed = None
+        json_payload = None
+        members = list(self.whiteboard_sessions.get(whiteboard_id, ()))
+        item = None
+        if self.viewport_filter.watches(members):
+            # Only decode for rooms where someone reported a viewport
+            item = {"user_id": user_id, "data": decode_stroke(frame), "timestamp": datetime.utcnow().isoformat()}
+            bounds = drawing_bounds(item["data"])
+        for member_id in members:
+            if member_id == user_id:
+                continue
+            if item is not None and not self._filter_drawing(member_id, item["data"], bounds):
+                self.viewport_filter.defer(member_id, item, bounds)
+                continue
+            recipients += 1
+            if self.protocols.get(member_id) == BINARY_SUBPROTOCOL:
+                if relayed is None:
+                    relayed = relay_frame(user_id, frame)
+                self._enqueue(member_id, relayed)
+            else:
+                if json_payload is None:
+                    json_payload = encode_message({
+                        "type": "drawing_data",
+                        "user_id": user_id,
+                        "data": decode_stroke(frame),
+                        "timestamp": datetime.utcnow().isoformat()
+                    })
+                self._enqueue(member_id, json_payload)
+        self._record_fanout("stroke", recipients, started)
+
+    def _send_drawing_batch(self, whiteboard_id: str, items: List[Dict[str, Any]]):
+        """Send one batched frame per recipient, leaving out their own strokes"""
+        members = self.whiteboard_sessions.get(whiteboard_id)
+        if not members:
+            return
+        
+        started = time.perf_counter()
+        timestamp = datetime.utcnow().isoformat()
+        if self.viewport_filter.watches(members):
+            self._send_filtered_batch(whiteboard_id, members, items, timestamp, started)
+            return
+        senders = {item["user_id"] for item in items}
+        recipients = 0
+        
+        # Members who didn't draw this tick share a single encoded frame
+        listeners = [user_id for user_id in members if user_id not in senders]
+        if listeners:
+            payload = encode_message({"type": "drawing_batch", "items": items, "timestamp": timestamp})
+            self.batching_stats.record_outgoing(len(payload), len(listeners))
+            for user_id in listeners:
+                self._enqueue(user_id, payload)
+            recipients += len(listeners)
+        
+        for sender_id in senders & members:
+            other_items = [item for item in items if item["user_id"] != sender_id]
+            if other_items:
+                payload = encode_message({"type": "drawing_batch", "items": other_items, "timestamp": timestamp})
+                self.batching_stats.record_outgoing(len(payload), 1)
+                self._enqueue(sender_id, payload)
+                recipients += 1
+        self._record_fanout("drawing_batch", recipients, started)
+
+    def _send_filtered_batch(self, whiteboard_id: str, members: Set[str], items: List[Dict[str, Any]],
+                             timestamp: str, started: float):
+        """Send each member the items it can see, holding back the rest
+
+        Members that end up with the same items share a single encoded frame.
+        """
+        bounds = [drawing_bounds(item["data"]) for item in items]
+        frames: Dict[tuple, List[str]] = {}
+        for user_id in list(members):
+            visible = []
+            for index, item in enumerate(items):
+                if item["user_id"] == user_id:
+                    continue
+                if self._filter_drawing(user_id, item["data"], bounds[index]):
+                    visible.append(index)
+                else:
+                    self.viewport_filter.defer(user_id, item, bounds[index])
+            if visible:
+                frames.setdefault(tuple(visible), []).append(user_id)
+        recipients = 0
+        for indices, user_ids in frames.items():
+            payload = encode_message({"type": "drawing_batch", "items": [items[i] for i in indices], "timestamp": timestamp})
+            self.batching_stats.record_outgoing(len(payload), len(user_ids))
+            for user_id in user_ids:
+                self._enqueue(user_id, payload)
+            recipients += len(user_ids)
+        self._record_fanout("drawing_batch", recipients, started)
+
+    def set_room_tick(self, whiteboard_id: str, tick_ms: int):
+        """Enable tick batching for a room, or disable it with 0"""
+        if tick_ms and not MIN_TICK_MS <= tick_ms <= MAX_TICK_MS:
+            raise ValueError(f"tick_ms must be 0 or between {MIN_TICK_MS} and {MAX_TICK_MS}")
+        self.room_ticks[whiteboard_id] = tick_ms
+        if tick_ms == 0:
+            batcher = self.batchers.pop(whiteboard_id, None)
+            if batcher:
+                batcher.close()
+
+    def set_room_rate_limits(self, whiteboard_id: str, limits: RateLimits):
+        """Override inbound rate limits for a room; categories left out keep the defaults"""
+        validate_limits(limits)
+        if limits:
+            self.room_rate_limits[whiteboard_id] = dict(limits)
+        else:
+            self.room_rate_limits.pop(whiteboard_id, None)
+
+    def apply_room_settings(self, whiteboard_id: str, settings: Dict[str, Any]):
+        """Apply stored or published room settings; those left out are unchanged"""
+        if settings.get("tick_ms") is not None:
+            self.set_room_tick(whiteboard_id, settings["tick_ms"])
+        if settings.get("rate_limits") is not None:
+            # Stored and published as [rate, burst] pairs
+            self.set_room_rate_limits(
+                whiteboard_id, {category: tuple(limit) for category, limit in settings["rate_limits"].items()}
+            )
+
+    async def publish_room_settings(self, whiteboard_id: str, settings: Dict[str, Any]):
+        """Send room settings already applied here to every other node"""
+        await self._publish(CONTROL_CHANNEL, {"k": "settings", "w": whiteboard_id}, encode_message(settings))
+
+    async def _load_room_settings(self, whiteboard_id: str):
+        if self.settings_loader is None:
+            return
+        try:
+            settings = await self.settings_loader(whiteboard_id)
+            if settings:
+                self.apply_room_settings(whiteboard_id, settings)
+        except Exception as e:
+            hot_log.warning("room_settings_failed", "Could not load settings for whiteboard %s: %s", whiteboard_id, e)
+
+    def _adopt_room_settings(self, whiteboard_id: str, settings: Dict[str, Any]):
+        try:
+            self.apply_room_settings(whiteboard_id, settings)
+        except ValueError as e:
+            hot_log.warning("room_settings_failed", "Ignoring settings for whiteboard %s: %s", whiteboard_id, e)
+
+    def rate_limits_for(self, whiteboard_id: Optional[str]) -> RateLimits:
+        """Inbound rate limits in force for a room"""
+        overrides = self.room_rate_limits.get(whiteboard_id)
+        return {**WS_RATE_LIMITS, **overrides} if overrides else WS_RATE_LIMITS
+
+    def throttle_message(self, user_id: str, category: str) -> str:
+        """Apply a user's rate limits to an inbound message and return the decision
+
+        The client is told once per throttling episode; the disconnect
+        policy ends the connection here.
+        """
+        throttle = self.throttles.get(user_id)
+        if throttle is None:
+            return DISCONNECT
+        episodes = throttle.episodes
+        decision = throttle.admit(category, self.rate_limits_for(self.user_sessions.get(user_id)))
+        if decision == DISCONNECT:
+            self.rate_limit_disconnects += 1
+            self.room_errors.record(self.user_sessions.get(user_id), "rate_limited", user_id)
+            self.end_connection(user_id, {"type": "rate_limited", "category": category}, CLOSE_POLICY_VIOLATION)
+        elif throttle.episodes != episodes:
+            retry_after_ms = int(throttle.retry_after(category) * 1000) + 1
+            self._enqueue(user_id, encode_message({
+                "type": "rate_limited", "category": category, "action": decision, "retry_after_ms": retry_after_ms
+            }), coalesce_key=f"rate_limited:{category}")
+        return decision
+
+    def hold_drawing_data(self, user_id: str, drawing_data: dict):
+        """Keep throttled drawing data and relay it, merged, once the user may draw again"""
+        throttle = self.throttles.get(user_id)
+        if throttle is not None:
+            throttle.hold(drawing_data, lambda items: self._spawn(self._relay_held_drawing(user_id, items)))
+
+    async def _relay_held_drawing(self, user_id: str, items: List[Dict[str, Any]]):
+        for item in items:
+            await self.broadcast_drawing_data(user_id, item["data"])
+
+    async def get_session_users(self, whiteboard_id: str) -> List[str]:
+        """Get list of users in a whiteboard session across all nodes"""
+        return list(await self._room_presence(whiteboard_id))
+
+    async def _room_presence(self, whiteboard_id: str) -> Dict[str, Dict]:
+        """Map the users in a room, on any node, to their user info"""
+        present = {
+            user_id: self.user_info.get(user_id, {})
+            for user_id in self.whiteboard_sessions.get(whiteboard_id, ())
+        }
+        try:
+            remote = await self.backplane.get_presence(whiteboard_id)
+        except Exception as e:
+            hot_log.warning("presence_failed", "Could not read presence for whiteboard %s: %s", whiteboard_id, e)
+            remote = {}
+        for user_id, entry in remote.items():
+            present.setdefault(user_id, entry.get("user_info", {}))
+        return present
+
+    def _on_backplane_message(self, channel: str, data: bytes):
+        """Deliver a message published by another node to local connections"""
+        try:
+            header, body = decode_envelope(data)
+        except Exception as e:
+            hot_log.warning("malformed_backplane_message", "Discarding malformed backplane message on %s: %s", channel, e)
+            return
+        if header.get("n") == self.node_id:
+            # Already delivered locally before publishing
+            return
+        
+        kind = header.get("k")
+        if kind == "room":
+            self._deliver_to_room(header["w"], body, header.get("x"), header.get("t", "message"))
+        elif kind == "drawing":
+            self._relay_drawing(header["w"], loads(body), body)
+        elif kind == "stroke":
+            self._relay_stroke(header["w"], header["u"], body)
+        elif kind == "persisted":
+            self._deliver_persisted(header["w"], body)
+        elif kind == "user":
+            if header["u"] in self.senders:
+                self._enqueue(header["u"], body)
+                WS_MESSAGES_SENT.labels(header.get("t", "message")).inc()
+        elif kind == "shards":
+            self._spawn(self.apply_shard_map(loads(body)["nodes"]))
+        elif kind == "access":
+            self._spawn(self.apply_access_change(header["w"], loads(body)["revoked"]))
+        elif kind == "settings":
+            self._adopt_room_settings(header["w"], loads(body))
+        else:
+            hot_log.warning("unknown_backplane_kind", "Unknown backplane message kind: %s", kind)
+
+    async def _publish(self, channel: str, header: Dict[str, Any], body: Any):
+        """Publish to other nodes; local delivery never waits on or fails with this"""
+        try:
+            await self.backplane.publish(channel, encode_envelope(dict(header, n=self.node_id), body))
+        except Exception as e:
+            BACKPLANE_PUBLISH_FAILURES.inc()
+            hot_log.warning("backplane_publish_failed", "Backplane publish to %s failed: %s", channel, e)
+
+    async def _backplane_call(self, call):
+        """Await a backplane operation, logging instead of raising on failure"""
+        try:
+            await call
+        except Exception as e:
+            hot_log.warning("backplane_call_failed", "Backplane operation failed: %s", e)
+
+    def _spawn(self, coro):
+        """Run backplane bookkeeping from a synchronous code path"""
+        task = asyncio.create_task(self._backplane_call(coro))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _release_user_channel(self, user_id: str):
+        # The user may have reconnected before this ran
+        if user_id not in self.active_connections:
+            await self.backplane.unsubscribe(user_channel(user_id))
+
+    async def _release_room(self, whiteboard_id: str):
+        # Someone may have joined again before this ran
+        if whiteboard_id not in self.whiteboard_sessions:
+            await self.backplane.unsubscribe(room_channel(whiteboard_id))
+
+    async def _release_presence(self, whiteboard_id: str, user_id: str):
+        if self.user_sessions.get(user_id) != whiteboard_id:
+            await self.backplane.remove_presence(whiteboard_id, user_id)
+
+    async def publish_shard_map(self, nodes: Dict[str, str]):
+        """Change room ownership on every node"""
+        await self.apply_shard_map(nodes)
+        await self._publish(CONTROL_CHANNEL, {"k": "shards"}, encode_message({"nodes": nodes}))
+
+    async def apply_shard_map(self, nodes: Dict[str, str]):
+        """Adopt a new node list and hand off local rooms owned elsewhere"""
+        self.shard_map.update(nodes)
+        for whiteboard_id in list(self.whiteboard_sessions):
+            redirect = self.shard_map.redirect_for(whiteboard_id)
+            if redirect:
+                await self.hand_off_room(whiteboard_id, redirect)
+
+    async def hand_off_room(self, whiteboard_id: str, redirect: Dict[str, str]):
+        """Move a room's clients to its new owner
+
+        Pending drawing data is flushed first and the handoff hooks run
+        (e.g. persisting buffered strokes), so clients that reconnect with
+        their last sequence number are caught up by the new owner. Until
+        they do, the backplane keeps both halves of the room connected.
+        """
+        batcher = self.batchers.get(whiteboard_id)
+        if batcher:
+            batcher.flush()
+        for hook in self.handoff_hooks:
+            try:
+                await hook(whiteboard_id)
+            except Exception as e:
+                logger.error("Handoff hook failed for whiteboard %s: %s", whiteboard_id, e)
+        
+        members = list(self.whiteboard_sessions.get(whiteboard_id, ()))
+        self._deliver_to_room(whiteboard_id, encode_message({
+            "type": "migrate",
+            "whiteboard_id": whiteboard_id,
+            **redirect
+        }), message_type="migrate")
+        self.room_handoffs += 1
+        logger.info("Handing off whiteboard %s to node %s", whiteboard_id, redirect["node"])
+        
+        # Close anyone who hasn't moved on their own after the grace period
+        asyncio.get_running_loop().call_later(
+            ROOM_HANDOFF_GRACE_SECONDS, self._close_migrated, whiteboard_id, members
         )
 
-    def get_session_users(self, whiteboard_id: str) -> List[str]:
-        """Get list of users in a whiteboard session"""
-        if whiteboard_id in self.whiteboard_sessions:
-            return list(self.whiteboard_sessions[whiteboard_id])
-        return []
+    def _close_migrated(self, whiteboard_id: str, user_ids: List[str]):
+        for user_id in user_ids:
+            if self.user_sessions.get(user_id) == whiteboard_id:
+                self.end_connection(user_id, None, CLOSE_MIGRATED)
+
+    def get_queue_stats(self) -> Dict[str, Any]:
+        """Get outbound queue depth and drop counters for all connections"""
+        connections = {user_id: sender.stats() for user_id, sender in self.senders.items()}
+        return {
+            "connections": connections,
+            "total_depth": sum(stats["depth"] for stats in connections.values()),
+            "total_dropped": sum(stats["dropped"] for stats in connections.values()),
+            "total_coalesced": sum(stats["coalesced"] for stats in connections.values()),
+            "slow_consumer_disconnects": self.slow_consumer_disconnects,
+        }
+
+    def get_throttle_stats(self) -> Dict[str, Any]:
+        """Get inbound rate limit counters for throttled connections"""
+        connections = {user_id: throttle.stats() for user_id, throttle in self.throttles.items() if throttle.throttled}
+        return {
+            "connections": connections,
+            "total_throttled": sum(stats["throttled"] for stats in connections.values()),
+            "total_dropped": sum(stats["dropped"] for stats in connections.values()),
+            "rate_limit_disconnects": self.rate_limit_disconnects,
+        }
 
     def get_user_session(self, user_id: str) -> Optional[str]:
         """Get the whiteboard session a user is in"""
         return self.user_sessions.get(user_id)
 
 # Create a singleton instance
-webrtc_manager = WebRTCManager()
\ No newline at end of file
+webrtc_manager = WebRTCManager(create_backplane(), shard_map=default_shard_map)
+
+REGISTRY.callback("whiteboard_ws_connections", "Open WebSocket connections", lambda: len(webrtc_manager.active_connections))
+REGISTRY.callback("whiteboard_rooms", "Rooms with members on this worker", lambda: len(webrtc_manager.whiteboard_sessions))
+REGISTRY.callback(
+    "whiteboard_ws_send_queue_depth", "Payloads waiting in outbound queues",
+    lambda: sum(sender.depth for sender in webrtc_manager.senders.values())
+)
+REGISTRY.callback(
+    "whiteboard_slow_consumer_disconnects_total", "Connections dropped for falling behind",
+    lambda: webrtc_manager.slow_consumer_disconnects, kind="counter"
+)
+REGISTRY.callback(
+    "whiteboard_room_handoffs_total", "Rooms handed off to another node",
+    lambda: webrtc_manager.room_handoffs, kind="counter"
+)
+REGISTRY.callback(
+    "whiteboard_viewport_deferred_items", "Drawing items held back until their recipients pan to them",
+    lambda: webrtc_manager.viewport_filter.pending()
+)
\ No newline at end of file
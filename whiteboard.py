@@ -1,4 +1,5 @@
-from pydantic import BaseModel, Field
+import math
+from pydantic import BaseModel, Field, validator
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
@@ -6,6 +7,14 @@ class DrawingElement(BaseModel):
     type: str = Field(..., regex="^(pen|line|rectangle|circle|eraser|clear)$")
     coordinates: List[Dict[str, float]]
     style: Dict[str, Any] = Field(default_factory=dict)
+    seq: Optional[int] = None
+
+    @validator("coordinates")
+    def coordinates_are_finite(cls, coordinates):
+        # Infinity and NaN parse as floats but can't be drawn or indexed
+        if not all(math.isfinite(value) for point in coordinates for value in point.values()):
+            raise ValueError("coordinates must be finite numbers")
+        return coordinates
 
 class WhiteboardBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=100)
@@ -24,6 +33,21 @@ class Whiteboard(WhiteboardBase):
     owner_id: str
     elements: List[DrawingElement] = Field(default_factory=list)
     collaborators: List[str] = Field(default_factory=list)
+    stroke_seq: int = 0
+    created_at: datetime
+    updated_at: datetime
+    
+    class Config:
+        json_encoders = {
+            datetime: lambda v: v.isoformat()
+        }
+
+class WhiteboardSummary(WhiteboardBase):
+    """Whiteboard metadata for listings, without drawing elements"""
+    id: str
+    owner_id: str
+    collaborators: List[str] = Field(default_factory=list)
+    stroke_seq: int = 0
     created_at: datetime
     updated_at: datetime
     
@@ -32,7 +56,20 @@ class Whiteboard(WhiteboardBase):
             datetime: lambda v: v.isoformat()
         }
 
+class ElementDelta(BaseModel):
+    """Drawing elements added to a whiteboard after a sequence number"""
+    whiteboard_id: str
+    elements: List[DrawingElement] = Field(default_factory=list)
+    since: int
+    last_seq: int
+    has_more: bool = False
+
+class RateLimit(BaseModel):
+    """Inbound messages per second and burst for one message category"""
+    rate: float = Field(..., gt=0)
+    burst: float = Field(..., ge=1)
+
 class WhiteboardSession(BaseModel):
     whiteboard_id: str
     user_id: str
-    joined_at: datetim
\ No newline at end of file
+    joined_at: datetime
\ No newline at end of file
@@ -1,108 +1,482 @@
-from typing import List, Optional
+import logging
+import os
+from typing import Any, Awaitable, Callable, FrozenSet, List, NamedTuple, Optional, Tuple
 from datetime import datetime
-from ..models.whiteboard import Whiteboard, WhiteboardCreate, WhiteboardUpdate, DrawingElement
+from ..models.whiteboard import Whiteboard, WhiteboardCreate, WhiteboardUpdate, WhiteboardSummary, DrawingElement, ElementDelta
 from ..database.mongodb import get_db
 from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
+from dotenv import load_dotenv
+from .cache import TTLCache
+from .compact_stroke import CompactElement, element_document
+from .compaction_service import contiguous_strokes, get_snapshot_elements, get_snapshot_page
+from .metrics import REGISTRY, timed_db_operation
+from .simplify import simplify_elements
+from .spatial_index import Bounds, spatial_fields, spatial_filter
 
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Whiteboard documents only hold metadata, drawing elements live in db.strokes
+METADATA_PROJECTION = {"elements": 0}
+# Live room settings stored on whiteboard documents
+ROOM_SETTINGS_PROJECTION = {"_id": 0, "tick_ms": 1, "rate_limits": 1}
+# Stroke fields that aren't part of a DrawingElement
+ELEMENT_PROJECTION = {"_id": 0, "whiteboard_id": 0, "created_at": 0, "bbox": 0, "cells": 0}
+# Delta sync also reads created_at, to tell a stroke still being written from a lost one
+DELTA_PROJECTION = {"_id": 0, "whiteboard_id": 0, "bbox": 0, "cells": 0}
+# Times a snapshot page is read again when compaction replaces the snapshot during the read
+SNAPSHOT_READ_ATTEMPTS = 3
+# Server error code for a unique index violation
+DUPLICATE_KEY_ERROR = 11000
+
+# Owners and collaborators of active boards, keyed by whiteboard id. Changes
+# made on this worker invalidate entries at once; other workers see them when
+# an access change hook tells them, or within the TTL.
+BOARD_ACCESS_CACHE_SIZE = int(os.getenv("BOARD_ACCESS_CACHE_SIZE", "10000"))
+BOARD_ACCESS_CACHE_TTL_SECONDS = float(os.getenv("BOARD_ACCESS_CACHE_TTL_SECONDS", "30"))
+board_access_cache = TTLCache(BOARD_ACCESS_CACHE_SIZE, BOARD_ACCESS_CACHE_TTL_SECONDS)
+REGISTRY.callback("whiteboard_board_access_cache_entries", "Board ACLs cached", lambda: len(board_access_cache))
+REGISTRY.callback(
+    "whiteboard_board_access_cache_lookups_total", "Board ACL cache lookups by result",
+    lambda: {("hit",): board_access_cache.hits, ("miss",): board_access_cache.misses},
+    kind="counter", labelnames=["result"]
+)
+# Bumped on every invalidation, so a load that raced one isn't cached
+_board_access_epoch = 0
+# Awaited with (whiteboard_id, revoked) after a board's ACL changes, e.g. to update other workers and live rooms
+access_change_hooks: List[Callable[[str, bool], Awaitable[Any]]] = []
+
+class BoardAccess(NamedTuple):
+    """Who can open and change a board"""
+    owner_id: str
+    collaborators: FrozenSet[str]
+
+    def can_edit(self, user_id: str) -> bool:
+        """Whether a user owns the board or collaborates on it"""
+        return user_id == self.owner_id or user_id in self.collaborators
+
+@timed_db_operation
 async def create_whiteboard(db, whiteboard: WhiteboardCreate, owner_id: str) -> Whiteboard:
     """Create a new whiteboard"""
     whiteboard_dict = whiteboard.dict()
     whiteboard_dict["owner_id"] = owner_id
-    whiteboard_dict["elements"] = []
     whiteboard_dict["collaborators"] = []
+    whiteboard_dict["stroke_seq"] = 0
+    whiteboard_dict["strokes_since_snapshot"] = 0
     whiteboard_dict["created_at"] = datetime.utcnow()
     whiteboard_dict["updated_at"] = datetime.utcnow()
     
-    result = db.whiteboards.insert_one(whiteboard_dict)
+    result = await db.whiteboards.insert_one(whiteboard_dict)
     whiteboard_dict["id"] = str(result.inserted_id)
     
     return Whiteboard(**whiteboard_dict)
 
+@timed_db_operation
 async def get_whiteboard(db, whiteboard_id: str) -> Optional[Whiteboard]:
-    """Get a whiteboard by ID"""
+    """Get a whiteboard's metadata by ID (without drawing elements)"""
     if not ObjectId.is_valid(whiteboard_id):
         return None
         
-    whiteboard_data = db.whiteboards.find_one({"_id": ObjectId(whiteboard_id)})
+    whiteboard_data = await db.whiteboards.find_one({"_id": ObjectId(whiteboard_id)}, METADATA_PROJECTION)
     if whiteboard_data:
         whiteboard_data["id"] = str(whiteboard_data.pop("_id"))
         return Whiteboard(**whiteboard_data)
     return None
 
+@timed_db_operation
+async def _load_board_access(db, whiteboard_id: str) -> Optional[BoardAccess]:
+    whiteboard_data = await db.whiteboards.find_one(
+        {"_id": ObjectId(whiteboard_id)},
+        {"owner_id": 1, "collaborators": 1}
+    )
+    if not whiteboard_data:
+        return None
+    return BoardAccess(whiteboard_data["owner_id"], frozenset(whiteboard_data.get("collaborators") or ()))
+
+async def get_board_access(db, whiteboard_id: str) -> Optional[BoardAccess]:
+    """Get a board's owner and collaborators, from the cache when possible"""
+    access = board_access_cache.get(whiteboard_id)
+    if access is not None:
+        return access
+    if not ObjectId.is_valid(whiteboard_id):
+        return None
+    
+    epoch = _board_access_epoch
+    access = await _load_board_access(db, whiteboard_id)
+    if access is not None and epoch == _board_access_epoch:
+        board_access_cache.set(whiteboard_id, access)
+    return access
+
+def invalidate_board_access(whiteboard_id: str):
+    """Drop a board's cached ACL after its document changes"""
+    global _board_access_epoch
+    _board_access_epoch += 1
+    board_access_cache.invalidate(whiteboard_id)
+
+async def board_access_changed(whiteboard_id: str, revoked: bool = False):
+    """Invalidate a board's cached ACL and run the access change hooks"""
+    invalidate_board_access(whiteboard_id)
+    for hook in access_change_hooks:
+        try:
+            await hook(whiteboard_id, revoked)
+        except Exception as e:
+            logger.error("Access change hook failed for whiteboard %s: %s", whiteboard_id, e)
+
+def _user_whiteboards_query(user_id: str) -> dict:
+    """Match whiteboards owned by or shared with a user"""
+    return {"$or": [{"owner_id": user_id}, {"collaborators": user_id}]}
+
+@timed_db_operation
 async def get_user_whiteboards(db, user_id: str) -> List[Whiteboard]:
     """Get all whiteboards owned by or accessible to a user"""
     whiteboards = []
-    
-    # Get whiteboards owned by user
-    for wb in db.whiteboards.find({"owner_id": user_id}):
+    cursor = db.whiteboards.find(_user_whiteboards_query(user_id), METADATA_PROJECTION)
+    async for wb in cursor.sort("updated_at", DESCENDING):
         wb["id"] = str(wb.pop("_id"))
         whiteboards.append(Whiteboard(**wb))
     
-    # Get whiteboards where user is a collaborator
-    for wb in db.whiteboards.find({"collaborators": user_id}):
-        wb["id"] = str(wb.pop("_id"))
-        whiteboards.append(Whiteboard(**wb))
+    return whiteboards
+
+@timed_db_operation
+async def list_user_whiteboards(
+    db,
+    user_id: str,
+    skip: int = 0,
+    limit: int = 10,
+    before: Optional[datetime] = None,
+    before_id: Optional[str] = None
+) -> List[WhiteboardSummary]:
+    """List a page of a user's whiteboards, most recently updated first
     
-    # Sort by updated_at descending
-    whiteboards.sort(key=lambda x: x.updated_at, reverse=True)
+    Pass the updated_at and id of the last item as before and before_id to
+    page with a keyset cursor instead of skip.
+    """
+    query = _user_whiteboards_query(user_id)
+    if before is not None:
+        if before_id is not None and ObjectId.is_valid(before_id):
+            # Break ties between boards updated in the same millisecond
+            keyset = {"$or": [
+                {"updated_at": {"$lt": before}},
+                {"updated_at": before, "_id": {"$lt": ObjectId(before_id)}}
+            ]}
+        else:
+            keyset = {"updated_at": {"$lt": before}}
+        query = {"$and": [query, keyset]}
     
-    return whiteboards
+    cursor = db.whiteboards.find(query, METADATA_PROJECTION) \
+        .sort([("updated_at", DESCENDING), ("_id", DESCENDING)]) \
+        .skip(skip) \
+        .limit(limit)
+    
+    summaries = []
+    async for wb in cursor:
+        wb["id"] = str(wb.pop("_id"))
+        summaries.append(WhiteboardSummary(**wb))
+    return summaries
 
+@timed_db_operation
 async def update_whiteboard(db, whiteboard_id: str, whiteboard_update: WhiteboardUpdate) -> Optional[Whiteboard]:
     """Update a whiteboard"""
     if not ObjectId.is_valid(whiteboard_id):
         return None
     
-    update_data = {k: v for k, v in whiteboard_update.dict().items() if v is not None}
+    update_data = {k: v for k, v in whiteboard_update.dict(exclude={"elements"}).items() if v is not None}
     update_data["updated_at"] = datetime.utcnow()
     
-    result = db.whiteboards.update_one(
+    # Replacing the elements appends a clear followed by the new elements,
+    # keeping the stroke log append-only
+    if whiteboard_update.elements is not None:
+        elements = [DrawingElement(type="clear", coordinates=[])] + simplify_elements(whiteboard_update.elements)
+        if not await append_drawing_elements(db, whiteboard_id, elements):
+            return None
+    
+    result = await db.whiteboards.update_one(
         {"_id": ObjectId(whiteboard_id)},
         {"$set": update_data}
     )
+    invalidate_board_access(whiteboard_id)
     
     if result.modified_count > 0:
         return await get_whiteboard(db, whiteboard_id)
     return None
 
-async def add_drawing_element(db, whiteboard_id: str, element: DrawingElement) -> bool:
-    """Add a drawing element to a whiteboard"""
+@timed_db_operation
+async def reserve_stroke_seqs(db, whiteboard_id: str, count: int) -> Optional[int]:
+    """Reserve count sequence numbers for a board and return the first one"""
+    whiteboard_data = await db.whiteboards.find_one_and_update(
+        {"_id": ObjectId(whiteboard_id)},
+        {
+            "$inc": {"stroke_seq": count, "strokes_since_snapshot": count},
+            "$set": {"updated_at": datetime.utcnow()}
+        },
+        projection={"stroke_seq": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not whiteboard_data:
+        return None
+    return whiteboard_data["stroke_seq"] - count + 1
+
+def stroke_document(whiteboard_id: str, seq: int, element: DrawingElement) -> dict:
+    """Build a strokes collection document for an element"""
+    stroke = element_document(element)
+    stroke["whiteboard_id"] = whiteboard_id
+    stroke["seq"] = seq
+    stroke["created_at"] = datetime.utcnow()
+    stroke.update(spatial_fields(stroke))
+    return stroke
+
+async def assign_stroke_seqs(db, whiteboard_id: str, documents: List[dict]) -> bool:
+    """Give built stroke documents the board's next sequence numbers"""
     if not ObjectId.is_valid(whiteboard_id):
         return False
+    if not documents:
+        return True
     
-    result = db.whiteboards.update_one(
+    first_seq = await reserve_stroke_seqs(db, whiteboard_id, len(documents))
+    if first_seq is None:
+        return False
+    for offset, document in enumerate(documents):
+        document["seq"] = first_seq + offset
+    return True
+
+def _stroke_collection(db, write_concern: Optional[WriteConcern]):
+    if write_concern is None:
+        return db.strokes
+    return db.strokes.with_options(write_concern=write_concern)
+
+@timed_db_operation
+async def append_stroke_documents(
+    db,
+    whiteboard_id: str,
+    documents: List[dict],
+    write_concern: Optional[WriteConcern] = None
+) -> bool:
+    """Give built stroke documents the next sequence numbers and insert them in order"""
+    if not await assign_stroke_seqs(db, whiteboard_id, documents):
+        return False
+    if documents:
+        await _stroke_collection(db, write_concern).insert_many(documents)
+    return True
+
+@timed_db_operation
+async def insert_stroke_documents(
+    db,
+    documents: List[dict],
+    write_concern: Optional[WriteConcern] = None
+) -> List[int]:
+    """Insert stroke documents that already hold their seqs, and return the indexes of any rejected
+
+    Inserts are unordered and can be retried with the same documents: one
+    already stored by an attempt that failed partway hits the unique
+    (whiteboard_id, seq) index and counts as written.
+    """
+    try:
+        await _stroke_collection(db, write_concern).insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        if e.details.get("writeConcernErrors"):
+            raise
+        return [
+            error["index"] for error in e.details.get("writeErrors", [])
+            if error.get("code") != DUPLICATE_KEY_ERROR
+        ]
+    return []
+
+async def append_drawing_elements(
+    db,
+    whiteboard_id: str,
+    elements: List[DrawingElement],
+    write_concern: Optional[WriteConcern] = None
+) -> bool:
+    """Append drawing elements to a whiteboard's stroke log"""
+    # Build every document before reserving seqs, so a bad element can't burn any
+    documents = [stroke_document(whiteboard_id, 0, element) for element in elements]
+    return await append_stroke_documents(db, whiteboard_id, documents, write_concern)
+
+async def add_drawing_element(db, whiteboard_id: str, element: DrawingElement) -> bool:
+    """Add a drawing element to a whiteboard"""
+    return await append_drawing_elements(db, whiteboard_id, simplify_elements([element]))
+
+@timed_db_operation
+async def get_drawing_elements(
+    db,
+    whiteboard_id: str,
+    after_seq: int = 0,
+    limit: Optional[int] = None
+) -> List[CompactElement]:
+    """Get a whiteboard's drawing elements with a sequence number above after_seq"""
+    cursor = db.strokes.find(
+        {"whiteboard_id": whiteboard_id, "seq": {"$gt": after_seq}},
+        ELEMENT_PROJECTION
+    ).sort("seq", ASCENDING)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return [CompactElement.from_document(stroke) async for stroke in cursor]
+
+async def _get_snapshot(db, whiteboard_id: str) -> Tuple[int, List[CompactElement]]:
+    """Get the sequence number and elements of a board's compacted snapshot"""
+    if not ObjectId.is_valid(whiteboard_id):
+        return 0, []
+    whiteboard_data = await db.whiteboards.find_one(
         {"_id": ObjectId(whiteboard_id)},
-        {
-            "$push": {"elements": element.dict()},
-            "$set": {"updated_at": datetime.utcnow()}
-        }
+        {"snapshot_seq": 1, "snapshot_id": 1}
+    )
+    if not whiteboard_data or not whiteboard_data.get("snapshot_id"):
+        return 0, []
+    elements = await get_snapshot_elements(db, whiteboard_data["snapshot_id"])
+    return whiteboard_data["snapshot_seq"], [CompactElement.from_document(element) for element in elements]
+
+def _element_delta(whiteboard_id: str, elements: List[CompactElement], since: int, last_seq: int, has_more: bool) -> ElementDelta:
+    """Wrap compact elements in an ElementDelta without validating every point"""
+    return ElementDelta.construct(
+        whiteboard_id=whiteboard_id,
+        elements=elements,
+        since=since,
+        last_seq=last_seq,
+        has_more=has_more
+    )
+
+@timed_db_operation
+async def load_board_elements(db, whiteboard_id: str) -> List[CompactElement]:
+    """Get everything needed to render a board: its snapshot plus newer strokes"""
+    snapshot_seq, elements = await _get_snapshot(db, whiteboard_id)
+    return elements + await get_drawing_elements(db, whiteboard_id, snapshot_seq)
+
+async def _get_snapshot_delta(db, whiteboard_id: str, since: int, limit: int) -> Optional[ElementDelta]:
+    """Get a page of a board's snapshot for a client behind it, or None to read the stroke log"""
+    if not ObjectId.is_valid(whiteboard_id):
+        return None
+    for _ in range(SNAPSHOT_READ_ATTEMPTS):
+        whiteboard_data = await db.whiteboards.find_one(
+            {"_id": ObjectId(whiteboard_id)},
+            {"snapshot_seq": 1, "snapshot_id": 1}
+        )
+        if not whiteboard_data or not whiteboard_data.get("snapshot_id") or since >= whiteboard_data["snapshot_seq"]:
+            return None
+        snapshot_id = whiteboard_data["snapshot_id"]
+        documents = await get_snapshot_page(db, snapshot_id, since, limit + 1)
+        # Compaction only deletes a snapshot's chunks after switching the board to a new one
+        current = await db.whiteboards.find_one({"_id": ObjectId(whiteboard_id)}, {"snapshot_id": 1})
+        if current is not None and current.get("snapshot_id") == snapshot_id:
+            break
+    else:
+        return None
+    
+    elements = [CompactElement.from_document(document) for document in documents[:limit]]
+    if len(documents) > limit:
+        return _element_delta(whiteboard_id, elements, since, elements[-1].seq, True)
+    snapshot_seq = whiteboard_data["snapshot_seq"]
+    has_more = bool(await get_drawing_elements(db, whiteboard_id, snapshot_seq, 1))
+    return _element_delta(whiteboard_id, elements, since, snapshot_seq, has_more)
+
+@timed_db_operation
+async def get_element_delta(db, whiteboard_id: str, since: int = 0, limit: int = 1000) -> ElementDelta:
+    """Get up to limit drawing elements added after the since sequence number
+
+    Clients behind the compacted snapshot page through it instead of the
+    whole log; the snapshot starts with the board's last clear, so the
+    result renders the same. Reads from the log stop before a missing
+    sequence number that may still be written, so last_seq never moves
+    past a stroke the client hasn't seen.
+    """
+    snapshot_delta = await _get_snapshot_delta(db, whiteboard_id, since, limit)
+    if snapshot_delta is not None:
+        return snapshot_delta
+    
+    cursor = db.strokes.find(
+        {"whiteboard_id": whiteboard_id, "seq": {"$gt": since}},
+        DELTA_PROJECTION
+    ).sort("seq", ASCENDING).limit(limit + 1)
+    strokes = contiguous_strokes([stroke async for stroke in cursor], since)
+    has_more = len(strokes) > limit
+    elements = [CompactElement.from_document(stroke) for stroke in strokes[:limit]]
+    return _element_delta(whiteboard_id, elements, since, elements[-1].seq if elements else since, has_more)
+
+async def _last_clear_seq(db, whiteboard_id: str) -> int:
+    """Sequence number of a board's latest clear, or 0 if it was never cleared"""
+    stroke = await db.strokes.find_one(
+        {"whiteboard_id": whiteboard_id, "type": "clear"},
+        {"seq": 1},
+        sort=[("seq", DESCENDING)]
     )
+    return stroke["seq"] if stroke else 0
+
+@timed_db_operation
+async def get_elements_in_bounds(
+    db,
+    whiteboard_id: str,
+    bounds: Bounds,
+    since: int = 0,
+    limit: int = 1000
+) -> ElementDelta:
+    """Get up to limit visible elements after since whose bounding box intersects bounds
+
+    Strokes from before the board's last clear are left out. The clear
+    itself is included when it is newer than since, so clients that
+    already hold elements know to drop them.
+    """
+    clear_seq = await _last_clear_seq(db, whiteboard_id)
+    query = {
+        "whiteboard_id": whiteboard_id,
+        "seq": {"$gt": max(since, clear_seq - 1)},
+        "$or": [spatial_filter(bounds), {"type": "clear"}],
+    }
+    cursor = db.strokes.find(query, ELEMENT_PROJECTION).sort("seq", ASCENDING).limit(limit + 1)
+    elements = [CompactElement.from_document(stroke) async for stroke in cursor]
+    has_more = len(elements) > limit
+    elements = elements[:limit]
+    return _element_delta(whiteboard_id, elements, since, elements[-1].seq if elements else since, has_more)
+
+@timed_db_operation
+async def get_room_settings(db, whiteboard_id: str) -> Optional[dict]:
+    """Get the live room settings stored on a whiteboard"""
+    if not ObjectId.is_valid(whiteboard_id):
+        return None
+    return await db.whiteboards.find_one({"_id": ObjectId(whiteboard_id)}, ROOM_SETTINGS_PROJECTION)
+
+@timed_db_operation
+async def save_room_settings(db, whiteboard_id: str, settings: dict) -> bool:
+    """Store live room settings on a whiteboard, so any worker opening its room applies them"""
+    if not ObjectId.is_valid(whiteboard_id):
+        return False
     
-    return result.modified_count > 0
+    result = await db.whiteboards.update_one({"_id": ObjectId(whiteboard_id)}, {"$set": settings})
+    return result.matched_count > 0
 
+@timed_db_operation
 async def add_collaborator(db, whiteboard_id: str, user_id: str) -> bool:
     """Add a collaborator to a whiteboard"""
     if not ObjectId.is_valid(whiteboard_id):
         return False
     
-    result = db.whiteboards.update_one(
+    result = await db.whiteboards.update_one(
         {"_id": ObjectId(whiteboard_id)},
         {
             "$addToSet": {"collaborators": user_id},
             "$set": {"updated_at": datetime.utcnow()}
         }
     )
+    await board_access_changed(whiteboard_id)
     
     return result.modified_count > 0
 
+@timed_db_operation
 async def delete_whiteboard(db, whiteboard_id: str, owner_id: str) -> bool:
     """Delete a whiteboard (only by owner)"""
     if not ObjectId.is_valid(whiteboard_id):
         return False
     
-    result = db.whiteboards.delete_one({
+    result = await db.whiteboards.delete_one({
         "_id": ObjectId(whiteboard_id),
         "owner_id": owner_id
     })
     
-    return result.deleted_count > 0
\ No newline at end of file
+    if result.deleted_count > 0:
+        await board_access_changed(whiteboard_id, revoked=True)
+        await db.strokes.delete_many({"whiteboard_id": whiteboard_id})
+        await db.snapshot_chunks.delete_many({"whiteboard_id": whiteboard_id})
+        return True
+    return False
\ No newline at end of file